@@ -0,0 +1,210 @@
+"""识别后端选择：讯飞云端 + sherpa-onnx 本地，两路可同时吃同一份录音。
+
+- AudioTee：把一个录音流复制成多路，各路按自己的节奏读取；全部关闭后才关闭底层录音
+- ASRSelector：按策略选用后端
+  - cloud：只用讯飞（原行为）
+  - local：只用本地模型，不需要网络
+  - fallback：两路并行，默认采用讯飞；讯飞连不上、中途出错，或录音结束后 budget_s 内还没出最终结果时改用本地结果
+  - race：两路并行，谁先出非空最终结果用谁
+  并行时本地模型跟着录音实时解码，录音一结束就有结果，不必等讯飞失败后再从头识别。
+"""
+
+import queue
+import threading
+import time
+
+from asr.sherpa_asr import create_local_asr
+from utils.audio_device import DeviceUnavailable
+from utils.logger import logger
+
+POLICIES = ("cloud", "local", "fallback", "race")
+
+_END = object()
+
+
+class AudioBranch:
+    """AudioTee 的一路输出：可迭代，close() 可在其他线程调用，正在等待的读取会立即结束。"""
+
+    def __init__(self, tee, name):
+        self.tee = tee
+        self.name = name
+        self.closed = False
+        self._queue = queue.Queue()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.closed:
+            raise StopIteration
+        item = self._queue.get()
+        if item is _END or self.closed:
+            raise StopIteration
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._queue.put(_END)
+            self.tee._branch_closed()
+
+
+class AudioTee:
+    """后台线程读取源录音流，把每块分发给所有未关闭的分支；源出错（如 DeviceUnavailable）时各分支读到同一异常。"""
+
+    def __init__(self, source, names):
+        self.source = source
+        self.branches = [AudioBranch(self, name) for name in names]
+        self.ended_at = None  # 源录音结束的时刻（time.monotonic），用于计算识别收尾延迟
+        self._thread = threading.Thread(target=self._pump, name="asr-tee", daemon=True)
+        self._thread.start()
+
+    def _pump(self):
+        tail = _END
+        try:
+            for chunk in self.source:
+                open_branches = [b for b in self.branches if not b.closed]
+                if not open_branches:
+                    break
+                for b in open_branches:
+                    b._queue.put(chunk)
+        except Exception as e:
+            tail = e
+        finally:
+            self.ended_at = time.monotonic()
+            for b in self.branches:
+                b._queue.put(tail)
+            self._close_source()
+
+    def _branch_closed(self):
+        if all(b.closed for b in self.branches):
+            self._close_source()
+
+    def _close_source(self):
+        try:
+            self.source.close()
+        except Exception:
+            pass
+
+    def stats(self):
+        return self.source.stats() if hasattr(self.source, "stats") else {}
+
+
+class ASRSelector:
+    def __init__(self, cloud, local=None, policy="fallback", budget_s=1.5):
+        if policy not in POLICIES:
+            raise ValueError(f"未知的ASR策略: {policy}，可选 {POLICIES}")
+        if local is None and policy != "cloud":
+            logger.warning(f"ASR策略 {policy} 需要本地模型，未加载，改为只用讯飞")
+            policy = "cloud"
+        self.cloud = cloud
+        self.local = local
+        self.policy = policy
+        self.budget_s = budget_s
+        self.last_backend = None  # 最近一轮采用的后端："cloud" / "local"
+
+    def recognize_stream(self, audio_generator, on_partial=None):
+        """与 XunfeiASR.recognize_stream 相同：吃录音块生成器，返回最终文本。"""
+        if self.policy == "cloud":
+            self.last_backend = "cloud"
+            return self.cloud.recognize_stream(audio_generator, on_partial=on_partial)
+        if self.policy == "local":
+            self.last_backend = "local"
+            return self.local.recognize_stream(audio_generator, on_partial=on_partial)
+        return self._run_parallel(audio_generator, on_partial)
+
+    def _run_parallel(self, audio_generator, on_partial):
+        tee = AudioTee(audio_generator, ("cloud", "local"))
+        results = {}
+        changed = threading.Event()
+
+        def run(name, backend, branch, partial_cb):
+            outcome = {"text": "", "error": None}
+            try:
+                outcome["text"] = backend.recognize_stream(branch, on_partial=partial_cb)
+            except Exception as e:
+                outcome["error"] = e
+            finally:
+                branch.close()
+                outcome["done_at"] = time.monotonic()
+                results[name] = outcome
+                changed.set()
+
+        # fallback 以讯飞为准，中间结果只转发讯飞的；race 两路都转发
+        cloud_partial = on_partial
+        local_partial = on_partial if self.policy == "race" else None
+        cloud_branch, local_branch = tee.branches
+        threads = [
+            threading.Thread(target=run, args=("cloud", self.cloud, cloud_branch, cloud_partial), daemon=True),
+            threading.Thread(target=run, args=("local", self.local, local_branch, local_partial), daemon=True),
+        ]
+        for t in threads:
+            t.start()
+
+        winner = None
+        while winner is None:
+            changed.wait(timeout=0.05)
+            changed.clear()
+            for outcome in list(results.values()):
+                if isinstance(outcome["error"], DeviceUnavailable):
+                    self._cancel_all(tee)
+                    raise outcome["error"]
+            winner = self._pick(results, tee)
+
+        loser = "local" if winner == "cloud" else "cloud"
+        if loser not in results:
+            (self.local if loser == "local" else self.cloud).cancel()
+            tee.branches[0 if loser == "cloud" else 1].close()
+        # fallback 可能在本地还没收尾时就已决定改用本地：等它出最终结果
+        threads[0 if winner == "cloud" else 1].join()
+        outcome = results[winner]
+        if outcome["error"] is not None:
+            self._cancel_all(tee)
+            raise outcome["error"]
+        self.last_backend = winner
+        latency = ""
+        if tee.ended_at is not None:
+            latency = f"，录音结束后{(outcome['done_at'] - tee.ended_at) * 1000:.0f}ms出结果"
+        logger.info(f"ASR采用{'讯飞' if winner == 'cloud' else '本地'}结果（策略={self.policy}{latency}）")
+        if hasattr(audio_generator, "stats"):
+            logger.info(f"ASR上行本轮采集统计: {audio_generator.stats()}")
+        return outcome["text"]
+
+    def _pick(self, results, tee):
+        """返回应采用的后端名；还需要继续等待时返回 None。"""
+        cloud, local = results.get("cloud"), results.get("local")
+        cloud_ok = cloud is not None and cloud["error"] is None and not self.cloud.failed
+        if self.policy == "race":
+            if cloud_ok and cloud["text"]:
+                return "cloud"
+            if local is not None and local["error"] is None and local["text"]:
+                return "local"
+            if cloud is not None and local is not None:
+                return "cloud" if cloud_ok else "local"
+            return None
+        # fallback
+        if cloud_ok:
+            return "cloud"
+        if cloud is not None:
+            logger.warning(f"讯飞识别失败（{self.cloud.failed or cloud['error']}），改用本地识别结果")
+            return "local"
+        if tee.ended_at is not None and time.monotonic() - tee.ended_at > self.budget_s:
+            logger.warning(f"讯飞识别超出预算{self.budget_s}秒，改用本地识别结果")
+            return "local"
+        return None
+
+    def _cancel_all(self, tee):
+        self.cloud.cancel()
+        self.local.cancel()
+        for b in tee.branches:
+            b.close()
+
+
+def create_asr(cfg, cloud, samplerate=16000):
+    """按配置组装识别入口：cloud 为 XunfeiASR，本地模型按 cfg["sherpa"] 加载。"""
+    cfg = cfg or {}
+    policy = cfg.get("policy", "cloud")
+    local = create_local_asr(cfg.get("sherpa"), samplerate) if policy != "cloud" else None
+    return ASRSelector(cloud, local, policy=policy, budget_s=cfg.get("budget_s", 1.5))
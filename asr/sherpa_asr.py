@@ -0,0 +1,146 @@
+import glob
+import os
+import threading
+import time
+
+import numpy as np
+import sherpa_onnx
+
+from utils.audio_device import DeviceUnavailable
+from utils.logger import logger
+from utils.tracing import tracer
+
+TAIL_PADDING_S = 0.4  # 结束时补的静音：让模型把最后几个字的右侧上下文吃完再出最终结果
+
+
+def _find_model_file(model_dir, prefix, prefer_int8=True):
+    """在模型目录里找 prefix*.onnx；优先 int8 量化版本（树莓派上快 2~3 倍）。"""
+    candidates = sorted(glob.glob(os.path.join(model_dir, f"{prefix}*.onnx")))
+    int8 = [c for c in candidates if ".int8." in c]
+    fp32 = [c for c in candidates if ".int8." not in c]
+    ordered = (int8 + fp32) if prefer_int8 else (fp32 + int8)
+    if not ordered:
+        raise FileNotFoundError(f"模型目录 {model_dir} 中找不到 {prefix}*.onnx")
+    return ordered[0]
+
+
+class SherpaASR:
+    """
+    基于 sherpa-onnx 的本地流式识别（不依赖网络），接口与 XunfeiASR.recognize_stream 一致：
+    吃 Recorder 产出的 16k 单声道 int16 块，边收边解码，返回最终文本；on_partial 收中间结果。
+    model_type：zipformer（流式 transducer）或 paraformer（流式 paraformer）。
+    端点由 Recorder 的 VAD 负责，这里关闭 sherpa 自带的端点检测。
+    """
+
+    def __init__(self, model_dir, model_type="zipformer", num_threads=2, samplerate=16000,
+                 decoding_method="greedy_search", prefer_int8=True):
+        self.model_dir = model_dir
+        self.model_type = model_type
+        self.samplerate = samplerate
+        self._cancel = threading.Event()
+        self.last_final_latency = None  # 音频结束到出最终结果的耗时（秒）
+        tokens = os.path.join(model_dir, "tokens.txt")
+        if model_type == "paraformer":
+            self.recognizer = sherpa_onnx.OnlineRecognizer.from_paraformer(
+                tokens=tokens,
+                encoder=_find_model_file(model_dir, "encoder", prefer_int8),
+                decoder=_find_model_file(model_dir, "decoder", prefer_int8),
+                num_threads=num_threads,
+                sample_rate=samplerate,
+                enable_endpoint_detection=False,
+            )
+        else:
+            self.recognizer = sherpa_onnx.OnlineRecognizer.from_transducer(
+                tokens=tokens,
+                encoder=_find_model_file(model_dir, "encoder", prefer_int8),
+                decoder=_find_model_file(model_dir, "decoder", prefer_int8),
+                joiner=_find_model_file(model_dir, "joiner", prefer_int8),
+                num_threads=num_threads,
+                sample_rate=samplerate,
+                decoding_method=decoding_method,
+                enable_endpoint_detection=False,
+            )
+        logger.info(f"本地ASR模型已加载：{model_type}，{model_dir}")
+
+    def cancel(self):
+        """中止当前识别（可在其他线程调用），recognize_stream 尽快返回已有结果。"""
+        self._cancel.set()
+
+    def _decode(self, stream):
+        while self.recognizer.is_ready(stream):
+            self.recognizer.decode_stream(stream)
+
+    def recognize_stream(self, audio_generator, on_partial=None):
+        """边录音边识别：audio_generator 逐块 yield 16k 单声道 int16 PCM（bytes）。"""
+        self._cancel.clear()
+        self.last_final_latency = None
+        stream = self.recognizer.create_stream()
+        partial = ""
+        error = None
+        audio_s = 0.0
+        try:
+            for chunk in audio_generator:
+                if self._cancel.is_set():
+                    break
+                samples = np.frombuffer(chunk, dtype=np.int16).astype(np.float32) / 32768.0
+                audio_s += len(samples) / self.samplerate
+                stream.accept_waveform(self.samplerate, samples)
+                self._decode(stream)
+                text = self.recognizer.get_result(stream)
+                if text != partial:
+                    partial = text
+                    tracer.mark("asr.first_partial")
+                    logger.debug(f"本地ASR中间结果: {text}")
+                    if on_partial is not None:
+                        on_partial(text)
+        except DeviceUnavailable as e:
+            logger.warning(f"录音流不可用：{e}")
+            error = e
+        finally:
+            if audio_generator is not None:
+                try:
+                    audio_generator.close()
+                except Exception:
+                    pass
+        if error is not None:
+            raise error
+        if hasattr(audio_generator, "stats"):
+            logger.info(f"本地ASR本轮采集统计: {audio_generator.stats()}")
+        if self._cancel.is_set():
+            logger.info("本地ASR已取消")
+            return partial.strip()
+        ended = time.monotonic()
+        stream.accept_waveform(self.samplerate, np.zeros(int(TAIL_PADDING_S * self.samplerate), dtype=np.float32))
+        stream.input_finished()
+        self._decode(stream)
+        text = self.recognizer.get_result(stream).strip()
+        self.last_final_latency = time.monotonic() - ended
+        tracer.mark("asr.final", backend="sherpa")
+        if text:
+            logger.info(f"本地ASR最终识别文本: {text}（{audio_s:.2f}秒音频，收尾解码{self.last_final_latency * 1000:.0f}ms）")
+        else:
+            logger.error("本地ASR未识别到有效文本")
+        return text
+
+
+def create_local_asr(cfg, samplerate=16000):
+    """按配置创建本地识别器；未配置或模型缺失时返回 None（只用云端）。"""
+    cfg = cfg or {}
+    model_dir = cfg.get("model_dir")
+    if not model_dir:
+        return None
+    if not os.path.isdir(model_dir):
+        logger.warning(f"本地ASR模型目录不存在：{model_dir}，只使用讯飞识别")
+        return None
+    try:
+        return SherpaASR(
+            model_dir,
+            model_type=cfg.get("model_type", "zipformer"),
+            num_threads=cfg.get("num_threads", 2),
+            samplerate=samplerate,
+            decoding_method=cfg.get("decoding_method", "greedy_search"),
+            prefer_int8=cfg.get("prefer_int8", True),
+        )
+    except Exception as e:
+        logger.warning(f"本地ASR模型加载失败：{e}，只使用讯飞识别")
+        return None
@@ -9,24 +9,61 @@ import ssl
 import numpy as np
 from utils.logger import logger
 from utils.audio_device import DeviceUnavailable
-from urllib.parse import quote_plus
+from utils.tracing import tracer
+from urllib.parse import quote_plus, urlparse
+
+# 16k 单声道 16bit PCM 每秒字节数
+BYTES_PER_SECOND = 32000
+
+
+class Pacer:
+    """按实时倍速控制发送节奏：以首帧时刻为基准累计"应发到哪里"，只在超前时补睡，
+    send/序列化本身的耗时自动抵消，不会像固定 sleep 那样越发越落后。speed 为 0/None 时不限速。"""
+
+    def __init__(self, speed, bytes_per_second=BYTES_PER_SECOND):
+        self.speed = speed
+        self.bytes_per_second = bytes_per_second
+        self.start = None
+        self.sent = 0
+
+    def wait(self, nbytes):
+        """记录刚发送的字节数，并在超前于目标进度时等待。"""
+        if not self.speed:
+            return
+        now = time.monotonic()
+        if self.start is None:
+            self.start = now
+        self.sent += nbytes
+        delay = self.start + self.sent / self.bytes_per_second / self.speed - now
+        if delay > 0:
+            time.sleep(delay)
+
 
 class XunfeiASR:
-    def __init__(self, app_id, api_key, api_secret, hotwords=""):
+    def __init__(self, app_id, api_key, api_secret, hotwords="", send_speed=1.0,
+                 ws_url="wss://iat-api.xfyun.cn/v2/iat"):
         self.app_id = app_id
         self.api_key = api_key
         self.api_secret = api_secret
         self.hotwords = hotwords
-        self.ws_url = "wss://iat-api.xfyun.cn/v2/iat"
+        # 一次性识别（recognize）的发送倍速：1.0 为实时，2.0 为两倍速，0 为不限速
+        self.send_speed = send_speed
+        self.warmup = None  # 可选：utils.warmup.Warmup，唤醒时预先建好的连接从这里取
+        self.ws_url = ws_url  # 可指向本地模拟服务（bench/fake_xunfei.py）
         self.result = ""
         self.result_lock = threading.Lock()
         self.finished = threading.Event()
         self._last_error = None
+        self._final = False
+        self.failed = None  # 本轮失败原因：None / "connect" / "error" / "timeout"，区分"没听到话"和"服务不可用"
+        self.on_partial = None  # 可选：收到中间累计结果时回调 on_partial(text)
+        self._cancelled = False
 
     def _assemble_url(self):
-        host = "iat-api.xfyun.cn"
-        api = "/v2/iat"
         url = self.ws_url
+        parsed = urlparse(url)
+        host = parsed.netloc
+        api = parsed.path or "/"
 
         # 1. 生成RFC1123格式时间戳
         now = time.time()
@@ -68,6 +105,36 @@ class XunfeiASR:
         logger.info(f"ASR WS 连接: {host}")
         return url
 
+    def open_connection(self):
+        """建立并鉴权一条 ASR websocket 连接（预热与正常识别共用）。"""
+        return websocket.create_connection(self._assemble_url(), sslopt={"cert_reqs": ssl.CERT_NONE})
+
+    def _connect(self):
+        ws = self.warmup.take("asr") if self.warmup is not None else None
+        if ws is not None:
+            logger.info("ASR使用预热连接")
+            return ws
+        return self.open_connection()
+
+    def _serve(self, ws, on_open):
+        """后台线程：先触发 on_open（启动发送），再循环接收结果直到识别结束或连接断开。"""
+        def run():
+            on_open(ws)
+            try:
+                while not self.finished.is_set():
+                    message = ws.recv()
+                    if not message:
+                        break
+                    self._on_message(ws, message)
+            except Exception as e:
+                if not self.finished.is_set():
+                    self._on_error(ws, e)
+            finally:
+                self._on_close(ws)
+        wst = threading.Thread(target=run)
+        wst.daemon = True
+        wst.start()
+
     def _on_message(self, ws, message):
         logger.debug(f"ASR收到消息: {message[:500]}")  # 截断避免日志爆炸
         try:
@@ -75,6 +142,7 @@ class XunfeiASR:
             code = data.get("code", -1)
             if code != 0:
                 logger.error(f"ASR识别返回错误: code={code}, msg={data.get('message')}")
+                self.failed = "error"
                 self.finished.set()
                 return
     
@@ -104,10 +172,15 @@ class XunfeiASR:
             if status == 2:
                 with self.result_lock:
                     self.result = text
+                self._final = True
+                tracer.mark("asr.final", backend="xunfei")
                 logger.info(f"ASR识别完成，最终结果: {self.result.strip()}")
                 self.finished.set()
             else:
                 logger.info(f"ASR中间累计: {text}")
+                tracer.mark("asr.first_partial")
+                if self.on_partial is not None:
+                    self.on_partial(text)
         except Exception as e:
             logger.error(f"ASR返回解析异常: {e}")
             self.finished.set()
@@ -116,6 +189,12 @@ class XunfeiASR:
 
     def _on_error(self, ws, error):
         logger.error(f"ASR websocket异常: {error}")
+        self.failed = "error"
+        self.finished.set()
+
+    def cancel(self):
+        """中止当前流式识别（可在其他线程调用）：停止发送并尽快返回已有结果。"""
+        self._cancelled = True
         self.finished.set()
 
     def _on_close(self, ws, *args):
@@ -126,7 +205,7 @@ class XunfeiASR:
         def send_audio():
             try:
                 frame_size = 1280    # 40ms一帧，16k采样，单通道，16bit=2字节
-                intervel = 0.04      # 发送间隔
+                pacer = Pacer(self.send_speed)
                 audio = self.audio_data
                 idx = 0
                 status = 0
@@ -161,7 +240,7 @@ class XunfeiASR:
                     }
                     ws.send(json.dumps(d))
                     idx += frame_size
-                    time.sleep(intervel)
+                    pacer.wait(len(chunk))
                 if status != 2:
                     logger.debug("补发最后一帧（status=2，audio空）")
                     d = {
@@ -196,17 +275,12 @@ class XunfeiASR:
         self.words_list = []
         self.finished.clear()
         self._last_error = None
-        url = self._assemble_url()
-        ws = websocket.WebSocketApp(
-            url,
-            on_open=self._on_open,
-            on_message=self._on_message,
-            on_error=self._on_error,
-            on_close=self._on_close
-        )
-        wst = threading.Thread(target=ws.run_forever, kwargs={"sslopt": {"cert_reqs": ssl.CERT_NONE}})
-        wst.daemon = True
-        wst.start()
+        try:
+            ws = self._connect()
+        except Exception as e:
+            logger.error(f"ASR websocket异常: {e}")
+            return ""
+        self._serve(ws, self._on_open)
         self.finished.wait(timeout=30)
         try:
             ws.close()
@@ -218,18 +292,27 @@ class XunfeiASR:
             logger.error("ASR未识别到有效文本")
         return self.result.strip()
 
-    def recognize_stream(self, audio_generator):
+    def recognize_stream(self, audio_generator, send_speed=None, on_partial=None):
         """
         边录音边识别（流式）：audio_generator为yield音频块(bytes)的生成器
+        实时麦克风本身就按实时节奏产出，默认不限速、有多少发多少（积压时尽快追上）；
+        若传入的是已录好的音频，可用 send_speed 指定发送倍速。
+        返回空串时可看 self.failed 区分"没说话"和"连接/服务失败"。
         """
         self.result = ""
         self.words_list = []
         self._last_error = None
+        self.failed = None
+        self._final = False
+        self._cancelled = False
+        self.on_partial = on_partial
         self.finished.clear()
-        url = self._assemble_url()
 
         def send_audio(ws):
             status = 0  # 0首帧 1中间帧 2尾帧
+            pacer = Pacer(send_speed)
+            sent_bytes = 0
+            started = time.monotonic()
             try:
                 logger.info("ASR流式识别：开始分块发送")
                 for idx, audio_chunk in enumerate(audio_generator):
@@ -259,7 +342,8 @@ class XunfeiASR:
                         }
                     }
                     ws.send(json.dumps(d))
-                    time.sleep(0.04)
+                    sent_bytes += len(audio_chunk)
+                    pacer.wait(len(audio_chunk))
                 # 发送尾帧
                 if not self.finished.is_set():
                     logger.debug("流式ASR，发送尾帧（status=2）")
@@ -272,29 +356,36 @@ class XunfeiASR:
                         }
                     }
                     ws.send(json.dumps(d))
-                    logger.info("流式ASR所有音频已发送")
+                    elapsed = time.monotonic() - started
+                    logger.info(f"流式ASR所有音频已发送：{sent_bytes / BYTES_PER_SECOND:.2f}秒音频，用时{elapsed:.2f}秒")
             except DeviceUnavailable as e:
                 logger.warning(f"录音流不可用：{e}")
                 self._last_error = e
                 self.finished.set()
             except Exception as e:
                 logger.error(f"ASR流式音频发送异常: {e}")
+                self.failed = "error"
                 self.finished.set()
 
         def on_open(ws):
             threading.Thread(target=send_audio, args=(ws,)).start()
 
-        ws = websocket.WebSocketApp(
-            url,
-            on_open=on_open,
-            on_message=self._on_message,
-            on_error=self._on_error,
-            on_close=self._on_close
-        )
-        wst = threading.Thread(target=ws.run_forever, kwargs={"sslopt": {"cert_reqs": ssl.CERT_NONE}})
-        wst.daemon = True
-        wst.start()
-        self.finished.wait(timeout=30)
+        try:
+            ws = self._connect()
+        except Exception as e:
+            logger.error(f"ASR websocket异常: {e}")
+            self.failed = "connect"
+            if audio_generator is not None:
+                try:
+                    audio_generator.close()
+                except Exception:
+                    pass
+            return ""
+        self._serve(ws, on_open)
+        if not self.finished.wait(timeout=30):
+            self.failed = "timeout"
+        elif not self._final and not self._cancelled and self.failed is None and self._last_error is None:
+            self.failed = "error"  # 连接中途被关闭，没等到最终结果
         try:
             ws.close()
         except Exception:
@@ -305,6 +396,8 @@ class XunfeiASR:
                 audio_generator.close()
             except Exception:
                 pass
+        if hasattr(audio_generator, "stats"):
+            logger.info(f"ASR上行本轮采集统计: {audio_generator.stats()}")
         if self._last_error is not None:
             raise self._last_error
         if self.result.strip():
@@ -0,0 +1,229 @@
+"""回声消除（AEC）：用播放参考信号从麦克风信号中减掉音箱自己的声音。
+
+- FarEndBuffer：共享的带时间戳远端参考缓冲区。输出引擎（或旧版流式播放）把实际送往声卡的 PCM
+  连同"首个样点到达喇叭的时刻"写入；采集侧按麦克风块的时间戳取出同一时段的参考
+- EchoCanceller：分区块频域 NLMS 自适应滤波（overlap-save），每块的滤波与更新全部向量化；
+  Geigel 双讲检测：用户与音箱同时说话时暂停自适应，避免滤波器发散
+有了回声消除，录音不必等播放结束再留回响消散时间，播放中也能直接录。
+"""
+
+import threading
+import time
+from math import ceil
+
+import numpy as np
+
+from utils.resample import make_resampler
+
+
+class FarEndBuffer:
+    """远端参考时间线：绝对样点位置 = (喇叭播放时刻 - t0) × 采样率，未写入的时段视为静音。"""
+
+    def __init__(self, samplerate=44100, seconds=4.0, snap_ms=20.0):
+        self.samplerate = samplerate
+        self.capacity = int(samplerate * seconds)
+        self.data = np.zeros(self.capacity, dtype=np.int16)
+        self.head = 0  # 已写入的最远位置（不含）
+        self.snap = int(samplerate * snap_ms / 1000)  # 时间戳抖动容差
+        self.t0 = time.monotonic()
+        self._lock = threading.Lock()
+
+    def position(self, t):
+        return int(round((t - self.t0) * self.samplerate))
+
+    def write(self, samples, play_time):
+        """写入一段单声道 PCM；play_time 为首个样点到达喇叭的 time.monotonic() 时刻。
+        音频回调中调用：只做拷贝，不分配内存。"""
+        n = len(samples)
+        if n == 0:
+            return
+        pos = self.position(play_time)
+        with self._lock:
+            if abs(pos - self.head) <= self.snap:
+                pos = self.head  # 时间戳抖动：视为紧接上一段，保持参考连续
+            if pos > self.head:
+                self._store(max(self.head, pos - self.capacity), pos, None)  # 中间没有播放：补静音
+            if n > self.capacity:
+                samples = samples[n - self.capacity:]
+                pos += n - self.capacity
+            self._store(pos, pos + len(samples), samples)
+            self.head = max(self.head, pos + len(samples))
+
+    def _store(self, start, end, samples):
+        idx = start % self.capacity
+        n = end - start
+        first = min(n, self.capacity - idx)
+        if samples is None:
+            self.data[idx:idx + first] = 0
+            self.data[:n - first] = 0
+        else:
+            self.data[idx:idx + first] = samples[:first]
+            self.data[:n - first] = samples[first:]
+
+    def read(self, pos, n, out=None):
+        """读取 [pos, pos+n) 的参考（float32）；超出已写范围或已被覆盖的部分为 0。"""
+        if out is None:
+            out = np.empty(n, dtype=np.float32)
+        out[:n] = 0
+        with self._lock:
+            lo = max(pos, self.head - self.capacity)
+            hi = min(pos + n, self.head)
+            if hi > lo:
+                idx = lo % self.capacity
+                first = min(hi - lo, self.capacity - idx)
+                out[lo - pos:lo - pos + first] = self.data[idx:idx + first]
+                out[lo - pos + first:hi - pos] = self.data[:hi - lo - first]
+        return out[:n]
+
+
+class EchoCanceller:
+    """
+    分区频域 NLMS：滤波器长 tail_ms，按 block 样点分区，每块做一次 2×block 点 FFT。
+    - lead_ms：参考比麦克风时间戳提前读取的余量，吸收时间戳误差，保证回声路径落在因果区间内
+    - input_latency_ms：采集链路固有延迟（声音到达麦克风到读出之间）
+    - dtd_ratio：麦克风峰值超过 参考峰值×dtd_ratio 视为双讲，暂停自适应；None 关闭
+    """
+
+    def __init__(self, reference=None, samplerate=16000, block=160, tail_ms=200, mu=0.5,
+                 lead_ms=30.0, input_latency_ms=0.0, dtd_ratio=0.5):
+        self.reference = reference
+        self.samplerate = samplerate
+        self.block = block
+        self.parts = max(1, ceil(tail_ms * samplerate / 1000 / block))
+        self.mu = mu
+        self.lead_s = lead_ms / 1000.0
+        self.input_latency_s = input_latency_ms / 1000.0
+        self.dtd_ratio = dtd_ratio
+        self._eps = 2 * block * 1e-6  # 归一化正则项，参考近乎静音时防止步长爆炸
+        self._resampler = make_resampler(reference.samplerate, samplerate) if reference is not None else None
+        self._ref_buf = np.empty(0, dtype=np.float32)
+        self.reset()
+
+    def reset(self):
+        """清空滤波器与全部状态（换设备、换喇叭位置后调用）。"""
+        bins = self.block + 1
+        self._W = np.zeros((self.parts, bins), dtype=np.complex128)
+        self._X = np.zeros((self.parts, bins), dtype=np.complex128)  # 最近 parts 块参考的频谱，0 为最新
+        self._x_peak = np.zeros(self.parts)
+        self._frame = np.zeros(2 * self.block)  # overlap-save：上一块 + 当前块参考
+        self._mic_tail = np.zeros(0, dtype=np.float32)
+        self._ref_tail = np.zeros(0, dtype=np.float32)
+        self._out = np.zeros(0, dtype=np.float32)
+        self._ref_fifo = np.zeros(0, dtype=np.float32)
+        self._ref_pos = None
+        self._ref_frac = 0.0
+        self.mic_energy = 0.0  # 参考有声时段的输入/输出能量，用于估算 ERLE
+        self.out_energy = 0.0
+        self.doubletalk_blocks = 0
+        if self._resampler is not None:
+            self._resampler.reset()
+
+    def erle_db(self):
+        """累计回声回波损耗增强（ERLE），只统计参考有声的时段。"""
+        if self.out_energy <= 0:
+            return 0.0
+        return 10.0 * np.log10(self.mic_energy / self.out_energy)
+
+    def process(self, mono, end_time=None, ref=None):
+        """
+        消除一块单声道麦克风信号中的回声：int16 输入返回等长 int16，float32（[-1, 1]）输入返回 float32。
+        ref 给出时直接用作对齐好的参考（离线评测）；否则按块末时间戳 end_time 从 FarEndBuffer 取。
+        """
+        n = len(mono)
+        if ref is None:
+            if self.reference is None:
+                return mono
+            ref = self._reference_for(n, end_time if end_time is not None else time.monotonic())
+        B = self.block
+        is_int16 = np.asarray(mono).dtype == np.int16
+        d = np.concatenate([self._mic_tail, np.asarray(mono, dtype=np.float32) / (32768.0 if is_int16 else 1.0)])
+        x = np.concatenate([self._ref_tail, np.asarray(ref, dtype=np.float32) / 32768.0])
+        count = len(d) // B
+        out = np.empty(count * B, dtype=np.float32)
+        for i in range(count):
+            s = slice(i * B, (i + 1) * B)
+            out[s] = self._process_block(d[s], x[s])
+        self._mic_tail = d[count * B:]
+        self._ref_tail = x[count * B:]
+        # 块长不是 block 整数倍时输出滞后不足一个 block，开头补零保持等长
+        self._out = np.concatenate([self._out, out])
+        if len(self._out) < n:
+            self._out = np.concatenate([np.zeros(n - len(self._out), dtype=np.float32), self._out])
+        result, self._out = self._out[:n], self._out[n:]
+        if not is_int16:
+            return result
+        return np.clip(np.rint(result * 32768.0), -32768, 32767).astype(np.int16)
+
+    def _process_block(self, d, x):
+        B = self.block
+        self._frame[:B] = self._frame[B:]
+        self._frame[B:] = x
+        self._X[1:] = self._X[:-1]
+        self._X[0] = np.fft.rfft(self._frame)
+        self._x_peak[1:] = self._x_peak[:-1]
+        self._x_peak[0] = np.abs(x).max()
+
+        y = np.fft.irfft((self._W * self._X).sum(axis=0), n=2 * B)[B:]
+        e = d - y
+
+        far_peak = self._x_peak.max()
+        if far_peak <= 1e-4:
+            return e  # 参考静音：无回声可消，也不自适应
+        self.mic_energy += float(np.dot(d, d))
+        self.out_energy += float(np.dot(e, e)) + 1e-12
+        if self.dtd_ratio is not None and np.abs(d).max() > self.dtd_ratio * far_peak:
+            self.doubletalk_blocks += 1
+            return e
+
+        E = np.fft.rfft(np.concatenate([np.zeros(B), e]))
+        norm = (self._X.real ** 2 + self._X.imag ** 2).sum(axis=0) + self._eps
+        G = self.mu * np.conj(self._X) * (E / norm)
+        # 梯度约束：时域后半清零，保证是线性卷积而不是循环卷积
+        g = np.fft.irfft(G, n=2 * B, axis=1)
+        g[:, B:] = 0
+        self._W += np.fft.rfft(g, axis=1)
+        return e
+
+    def _reference_for(self, n, end_time):
+        """取与麦克风块同一时段的参考，并重采样到 samplerate。采集连续时按位置顺读，不连续时按时间戳重新对齐。"""
+        far = self.reference
+        ratio = far.samplerate / self.samplerate
+        start = end_time - n / self.samplerate - self.input_latency_s + self.lead_s
+        pos = far.position(start)
+        if self._ref_pos is None or abs(pos - self._ref_pos) > far.snap:
+            self._ref_pos = pos
+            self._ref_frac = 0.0
+            self._ref_fifo = np.zeros(0, dtype=np.float32)
+            # 麦克风侧同样不连续：丢弃上一段的零头，滤波器系数保留（回声路径没变）
+            self._mic_tail = self._ref_tail = self._out = np.zeros(0, dtype=np.float32)
+            if self._resampler is not None:
+                self._resampler.reset()
+        need = n * ratio + self._ref_frac
+        count = int(need)
+        self._ref_frac = need - count
+        if self._ref_buf.size < count:
+            self._ref_buf = np.empty(count, dtype=np.float32)
+        raw = far.read(self._ref_pos, count, self._ref_buf)
+        self._ref_pos += count
+        res = self._resampler.process(raw) if self._resampler is not None else raw
+        fifo = np.concatenate([self._ref_fifo, res])
+        if len(fifo) < n:
+            fifo = np.concatenate([np.zeros(n - len(fifo), dtype=np.float32), fifo])
+        ref, self._ref_fifo = fifo[:n], fifo[n:]
+        return ref
+
+
+def create_aec(cfg, reference, samplerate=16000):
+    """按配置创建回声消除器；未启用返回 None。"""
+    cfg = cfg or {}
+    if not cfg.get("enabled", False):
+        return None
+    return EchoCanceller(
+        reference,
+        samplerate=samplerate,
+        tail_ms=cfg.get("tail_ms", 200),
+        mu=cfg.get("mu", 0.5),
+        lead_ms=cfg.get("lead_ms", 30.0),
+        input_latency_ms=cfg.get("input_latency_ms", 0.0),
+        dtd_ratio=cfg.get("dtd_ratio", 0.5),
+    )
@@ -0,0 +1,112 @@
+"""语音打断（barge-in）：音箱说话期间继续听麦克风，用户一开口/喊唤醒词就立即停播。
+
+监听方式（mode）：
+- kws：唤醒词检测（抗回声，推荐）
+- vad：持续语音超过 min_speech_ms 即打断；播放中喇叭回声也会抬高能量，
+  因此使用更高的判定余量（margin_db），启用回声消除后可适当调低
+- both：任一触发即可
+触发后由调用方取消输出与 TTS；采集订阅不退订，游标移到开口位置后交给下一轮录音，开头不丢字。
+"""
+
+import threading
+
+from audio_in.vad import EnergyVAD
+from utils.logger import logger
+
+
+class BargeInListener:
+    def __init__(self, recorder, mode="kws", spotter_factory=None, min_speech_ms=400,
+                 margin_db=18.0, preroll_blocks=2):
+        self.recorder = recorder
+        self.mode = mode
+        self.spotter_factory = spotter_factory
+        self.min_speech_ms = min_speech_ms
+        self.margin_db = margin_db
+        self.preroll_blocks = preroll_blocks
+        self.triggered = threading.Event()
+        self.capture = None
+        self.start_cursor = 0  # 交给录音的起始游标
+        self._stop = threading.Event()
+        self._thread = None
+        self._on_trigger = None
+        if mode in ("kws", "both") and spotter_factory is None:
+            logger.warning("打断监听未提供唤醒词检测，改为 VAD 模式")
+            self.mode = "vad"
+
+    def start(self, on_trigger):
+        """开始监听；麦克风不可用时只记录日志，不影响播放。"""
+        self.triggered.clear()
+        self._stop.clear()
+        self._on_trigger = on_trigger
+        try:
+            self.capture = self.recorder.open_capture("barge-in")
+        except Exception as e:
+            logger.warning(f"打断监听无法打开麦克风: {e}")
+            self.capture = None
+            return
+        self._thread = threading.Thread(target=self._run, name="barge-in", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止监听。若已触发打断，返回游标已移到开口处的采集订阅交给录音；否则退订返回 None。"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+        capture, self.capture = self.capture, None
+        if capture is None:
+            return None
+        if self.triggered.is_set():
+            capture.seek(self.start_cursor)
+            return capture
+        capture.close()
+        return None
+
+    def _run(self):
+        capture = self.capture
+        pipeline = self.recorder.make_pipeline()
+        vad = EnergyVAD(samplerate=self.recorder.samplerate, margin_db=self.margin_db) \
+            if self.mode in ("vad", "both") else None
+        spotter = self.spotter_factory() if self.mode in ("kws", "both") else None
+        speech_ms = 0.0
+        onset_cursor = None
+        while not self._stop.is_set():
+            cursor = capture.cursor
+            try:
+                item = capture.read(timeout=0.2)
+            except Exception as e:
+                logger.warning(f"打断监听读取麦克风失败: {e}")
+                return
+            if item is None:
+                if capture.closed:
+                    return
+                continue
+            block, ts, _ = item
+            mono = pipeline(block, ts)
+            if spotter is not None:
+                keyword = spotter(mono)
+                if keyword:
+                    logger.info(f"播放中检测到唤醒词打断: {keyword}")
+                    self._trigger(capture.cursor)
+                    return
+            if vad is not None:
+                for p in vad.process(mono):
+                    if p >= 0.5:
+                        if onset_cursor is None:
+                            onset_cursor = cursor
+                        speech_ms += vad.frame_ms
+                    else:
+                        speech_ms = 0.0
+                        onset_cursor = None
+                if speech_ms >= self.min_speech_ms:
+                    logger.info("播放中检测到用户说话，打断播放")
+                    self._trigger(max(0, onset_cursor - self.preroll_blocks))
+                    return
+
+    def _trigger(self, start_cursor):
+        self.start_cursor = start_cursor
+        self.triggered.set()
+        try:
+            self._on_trigger()
+        except Exception as e:
+            logger.error(f"打断处理异常: {e}")
@@ -0,0 +1,309 @@
+"""麦克风采集中心（CaptureHub）：整个进程只打开一次输入流，分发给所有订阅者。
+
+- 采集线程只做一件事——从 PortAudio 阻塞读取，把带时间戳的音频块写入有界环形缓冲区
+- 唤醒词、录音、打断监听等各自 subscribe() 一个订阅，按自己的游标读取块视图（零拷贝）；
+  处理慢的订阅只会积压，落后超过缓冲区容量时丢弃最旧的块并告警，永远不会拖慢采集
+- 设备监视也在这里：设备从列表消失、读取停滞时重开输入流，不再额外打开探测流；订阅者收到 DeviceUnavailable。
+  持续数字静音（macOS 静默拔线）判定需显式开启（silence_s），硬件静音的麦克风也会一直送全零
+- 连续打开失败时定期刷新设备列表，仍不行则原地重启进程兜底
+"""
+
+import os
+import threading
+import time
+
+import numpy as np
+
+from utils.audio_backend import get_backend
+from utils.audio_device import DeviceUnavailable, find_input_device, refresh_audio_devices, self_restart, \
+    wait_for_input_device
+from utils.logger import logger
+
+
+class BlockRing:
+    """有界环形缓冲区：预分配 (容量, 块长, 声道) 数组，按单调递增的序号读写。"""
+
+    def __init__(self, capacity, block_frames, channels, dtype="int16"):
+        self.capacity = capacity
+        self.data = np.zeros((capacity, block_frames, channels), dtype=dtype)
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.seq = 0  # 下一个写入序号
+        self.closed = False
+        self._cond = threading.Condition()
+
+    def push(self, block, timestamp):
+        idx = self.seq % self.capacity
+        self.data[idx] = block
+        self.times[idx] = timestamp
+        with self._cond:
+            self.seq += 1
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def wake(self):
+        """唤醒所有等待中的读取方（让其重新检查 stop 条件）。"""
+        with self._cond:
+            self._cond.notify_all()
+
+    def get(self, cursor, timeout=None, stop=None):
+        """
+        读取序号为 cursor 的块；返回 (块视图, 时间戳, 下一个游标, 丢块数)。
+        块视图直接指向缓冲区，容量个块之后会被覆盖，需要长期保留请 copy。
+        超时、缓冲区已关闭或 stop() 为真且无新数据时返回 None。
+        """
+        with self._cond:
+            ready = lambda: cursor < self.seq or self.closed or (stop is not None and stop())
+            if not self._cond.wait_for(ready, timeout):
+                return None
+            if cursor >= self.seq:
+                return None
+            lost = 0
+            oldest = self.oldest()
+            if cursor < oldest:
+                lost = oldest - cursor
+                cursor = oldest
+        idx = cursor % self.capacity
+        return self.data[idx], self.times[idx], cursor + 1, lost
+
+    def oldest(self):
+        """仍可安全读取的最旧序号：seq - capacity 号槽位正是下一次 push 要覆盖的位置，不算在内。"""
+        return max(self.seq - self.capacity + 1, 0)
+
+    def depth(self, cursor):
+        return self.seq - cursor
+
+
+class Subscription:
+    """一个订阅者的读取游标；read() 取下一块，close() 退订。"""
+
+    def __init__(self, hub, name, cursor):
+        self.hub = hub
+        self.name = name
+        self.cursor = cursor
+        self.blocks = 0
+        self.lost = 0  # 因落后过多被丢弃的块数
+        self.max_backlog = 0
+        self.closed = False
+        self.error = None
+        self._overflows_at = hub.overflows
+        self._last_report = 0.0
+
+    @property
+    def overflows(self):
+        """订阅以来的设备溢出次数。"""
+        return self.hub.overflows - self._overflows_at
+
+    def read(self, timeout=None):
+        """
+        读取下一块，返回 (块视图, 时间戳, 丢块数)；超时或已退订返回 None。
+        设备断开时抛出 DeviceUnavailable。
+        """
+        if self.error is not None:
+            raise self.error
+        item = self.hub.ring.get(self.cursor, timeout, stop=lambda: self.closed or self.error is not None)
+        if item is None:
+            if self.error is not None:
+                raise self.error
+            return None
+        block, ts, self.cursor, lost = item
+        self.blocks += 1
+        if lost:
+            self.lost += lost
+            self.hub._report_slow(self, lost)
+        self.max_backlog = max(self.max_backlog, self.depth())
+        return block, ts, lost
+
+    def depth(self):
+        return self.hub.ring.depth(self.cursor)
+
+    def seek(self, cursor):
+        """把游标移到指定序号（不早于缓冲区中最旧的块），用于交接时从用户开口处开始读。"""
+        self.cursor = max(cursor, self.hub.ring.oldest())
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+    abort = close
+
+    def _fail(self, error):
+        self.error = error
+
+
+class CaptureHub:
+    def __init__(self, samplerate, channels, dtype, block_size, device=None, buffer_s=4.0,
+                 stall_s=2.0, silence_s=None, monitor_interval=3.0):
+        self.samplerate = samplerate
+        self.channels = channels
+        self.dtype = dtype
+        self.block_size = block_size
+        self.device = device
+        capacity = max(8, int(buffer_s * samplerate / block_size))
+        self.ring = BlockRing(capacity, block_size, channels, dtype)
+        self.stall_s = stall_s
+        self.silence_s = silence_s  # 持续全零多少秒判定为静默拔线；None 为不判定
+        self.monitor_interval = monitor_interval
+        self.overflows = 0  # PortAudio 报告的设备溢出次数
+        self.reopens = 0
+        self._subs = []
+        self._subs_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._stream = None
+        self._last_block_at = 0.0
+        self._silent_since = None
+        self._thread = None
+
+    # ---- 订阅 ----
+
+    def subscribe(self, name):
+        """新建订阅，从当前时刻开始读取。"""
+        sub = Subscription(self, name, self.ring.seq)
+        with self._subs_lock:
+            self._subs.append(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        sub.closed = True
+        with self._subs_lock:
+            if sub in self._subs:
+                self._subs.remove(sub)
+        self.ring.wake()
+
+    def _report_slow(self, sub, lost):
+        now = time.monotonic()
+        if now - sub._last_report >= 10.0:
+            sub._last_report = now
+            logger.warning(f"采集订阅[{sub.name}]处理过慢，丢弃了{lost}块（累计{sub.lost}块）")
+
+    def stats(self):
+        with self._subs_lock:
+            subs = {s.name: {"backlog": s.depth(), "max_backlog": s.max_backlog, "lost": s.lost} for s in self._subs}
+        return {"overflows": self.overflows, "reopens": self.reopens, "ready": self.ready, "subscribers": subs}
+
+    # ---- 设备 ----
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def start(self):
+        """启动后台采集线程（设备未接入时在后台等待，不阻塞调用方）。"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="audio-capture", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        self._abort_stream()
+        self.ring.close()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+
+    def _run(self):
+        failures = 0
+        while not self._stop.is_set():
+            device_id = wait_for_input_device(self.device) if self.device else None
+            try:
+                stream = get_backend().InputStream(
+                    samplerate=self.samplerate,
+                    channels=self.channels,
+                    dtype=self.dtype,
+                    blocksize=self.block_size,
+                    device=device_id,
+                )
+                stream.start()
+            except Exception as e:
+                failures += 1
+                if failures == 1 or failures % 12 == 0:
+                    logger.warning(f"麦克风打开失败：{e}，等待重新接入...")
+                # 连续失败：每约12秒刷新一次设备列表（清除幽灵条目）；约1分钟后仍不行则自动重启兜底
+                if failures % 4 == 0:
+                    refresh_audio_devices()
+                if failures % 20 == 0:
+                    self_restart()
+                self._stop.wait(3)
+                continue
+            failures = 0
+            os.environ["VOICEBOX_RESTART_COUNT"] = "0"
+            self._stream = stream
+            self._last_block_at = time.monotonic()
+            self._silent_since = None
+            self._ready.set()
+            logger.info(f"麦克风采集已启动（设备={device_id}）")
+            dead = threading.Event()
+            monitor = threading.Thread(target=self._monitor, args=(dead,), name="audio-capture-monitor", daemon=True)
+            monitor.start()
+            try:
+                self._read_loop(stream, dead)
+            finally:
+                dead.set()
+                self._ready.clear()
+                self._abort_stream()
+                monitor.join(timeout=1.0)
+                if not self._stop.is_set():
+                    self.reopens += 1
+                    self._fail_subscribers(DeviceUnavailable("麦克风已断开"))
+            self._stop.wait(1.0)
+
+    def _read_loop(self, stream, dead):
+        try:
+            while not dead.is_set() and not self._stop.is_set():
+                block, overflowed = stream.read(self.block_size)
+                if overflowed:
+                    self.overflows += 1
+                now = time.monotonic()
+                self._last_block_at = now
+                if block.any():
+                    self._silent_since = None
+                elif self._silent_since is None:
+                    self._silent_since = now
+                self.ring.push(block, now)
+        except Exception as e:
+            if not self._stop.is_set() and not dead.is_set():
+                logger.warning(f"麦克风读取异常：{e}，准备重新接入...")
+
+    def _monitor(self, dead):
+        """监视麦克风是否仍在线；发现异常就中止输入流，让读取循环退出并重开。"""
+        while not dead.wait(timeout=self.monitor_interval):
+            reason = None
+            if self.device and find_input_device(self.device) is None:
+                reason = "检测到麦克风断开"
+            elif time.monotonic() - self._last_block_at > self.stall_s:
+                reason = "检测到麦克风读取停滞"
+            elif self.silence_s and self._silent_since is not None and \
+                    time.monotonic() - self._silent_since > self.silence_s:
+                # macOS 静默拔线：不报错、列表不更新、流不停止，只送全零
+                reason = "检测到麦克风持续输出数字静音"
+            if reason:
+                logger.warning(f"{reason}，准备重新接入...")
+                dead.set()
+                # 先通知订阅者，不等被中止的 read 返回
+                self._ready.clear()
+                self._fail_subscribers(DeviceUnavailable("麦克风已断开"))
+                self._abort_stream()
+                return
+
+    def _abort_stream(self):
+        stream, self._stream = self._stream, None
+        if stream is None:
+            return
+        for action in (stream.abort, stream.close):
+            try:
+                action()
+            except Exception:
+                pass
+
+    def _fail_subscribers(self, error):
+        with self._subs_lock:
+            subs = list(self._subs)
+        for sub in subs:
+            sub._fail(error)
+        self.ring.wake()
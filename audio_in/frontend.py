@@ -0,0 +1,159 @@
+"""多声道麦克风前端：唤醒词与录音共用的一套处理。
+
+- FrontEnd：逐声道去直流 → GCC-PHAT 估计各声道相对第 0 路的到达时延 → 延迟求和波束形成，输出单声道 float32
+  时延只在有声块上更新并做平滑，静音块沿用上一次的方向；单声道输入只去直流
+- AGC：慢速自动增益，块内线性过渡避免拉链噪声；只在明显高于底噪的块上调整，避免说话间隙把底噪放大
+- to_int16：float32 → int16 写入预分配缓冲区，给 ASR 上行与 VAD
+所有运算按整块批量进行，缓冲区预分配复用，每块不再新建数组。
+"""
+
+import numpy as np
+
+
+class FrontEnd:
+    def __init__(self, channels, samplerate=16000, block_size=1280, beamform=True, max_delay_ms=0.5,
+                 dc_alpha=0.05, gate_dbfs=-50.0, delay_smooth=0.2, min_coherence=0.15):
+        self.channels = channels
+        self.samplerate = samplerate
+        self.beamform = beamform and channels > 1
+        self.max_lag = max(1, int(round(max_delay_ms * samplerate / 1000)))
+        self.dc_alpha = dc_alpha
+        self.gate = 10 ** (gate_dbfs / 20.0)
+        self.delay_smooth = delay_smooth
+        self.min_coherence = min_coherence
+        self.delays = np.zeros(channels)  # 各声道相对第 0 路的平滑时延（样点，正值表示更晚到达）
+        self._dc = np.zeros(channels, dtype=np.float32)
+        self._block_size = 0
+        self._alloc(block_size)
+
+    def _alloc(self, n):
+        L = self.max_lag
+        self._block_size = n
+        self._x = np.empty((n, self.channels), dtype=np.float32)
+        self._hist = np.zeros((n + 2 * L, self.channels), dtype=np.float32)
+        self._out = np.empty(n, dtype=np.float32)
+        self._gather = np.empty((n, self.channels), dtype=np.float32)
+        self._set_index(np.rint(self.delays).astype(int))
+
+    def _set_index(self, lags):
+        self._lags = lags
+        # 输出比输入固定滞后 max_lag 个样点，正负时延都能对齐
+        rows = np.arange(self._block_size)[:, None] + (self.max_lag + lags)[None, :]
+        self._index = rows * self.channels + np.arange(self.channels)[None, :]  # 展平后的下标，取数不再分配
+
+    def process(self, block):
+        """处理一块 (帧, 声道) int16/float 采集数据，返回单声道 float32（[-1, 1]，内部缓冲区视图）。"""
+        block = np.asarray(block)
+        if block.ndim == 1:
+            block = block[:, None]
+        n = block.shape[0]
+        if n != self._block_size:
+            self._alloc(n)
+        x = self._x
+        np.multiply(block, 1.0 / 32768.0 if block.dtype == np.int16 else 1.0, out=x, casting="unsafe")
+        self._dc += self.dc_alpha * (x.mean(axis=0) - self._dc)
+        x -= self._dc
+        if not self.beamform:
+            self._out[:] = x[:, 0]
+            return self._out
+        if np.sqrt(np.mean(x[:, 0] ** 2)) > self.gate:
+            self._update_delays(x)
+        L2 = 2 * self.max_lag
+        hist = self._hist
+        hist[:L2] = hist[n:n + L2]
+        hist[L2:] = x
+        np.take(hist.reshape(-1), self._index, out=self._gather)
+        np.mean(self._gather, axis=1, out=self._out)
+        return self._out
+
+    def _update_delays(self, x):
+        """GCC-PHAT：各声道与第 0 路的互功率谱做相位变换后求互相关峰，限定在 ±max_lag 内。"""
+        n = x.shape[0]
+        L = self.max_lag
+        spec = np.fft.rfft(x, n=2 * n, axis=0)
+        cross = spec[:, 1:] * np.conj(spec[:, :1])
+        cross /= np.abs(cross) + 1e-12
+        cc = np.fft.irfft(cross, n=2 * n, axis=0)
+        window = np.concatenate([cc[-L:], cc[:L + 1]])  # 滞后 -L..L
+        peak = window.argmax(axis=0)
+        coherence = window[peak, np.arange(window.shape[1])]
+        lags = peak - L
+        # 相干性太低（噪声、混响主导）的声道不更新
+        ok = coherence >= self.min_coherence
+        self.delays[1:][ok] += self.delay_smooth * (lags[ok] - self.delays[1:][ok])
+        new = np.rint(self.delays).astype(int)
+        if not np.array_equal(new, self._lags):
+            self._set_index(new)
+
+    def reset(self):
+        self.delays[:] = 0
+        self._dc[:] = 0
+        self._hist[:] = 0
+        self._set_index(np.zeros(self.channels, dtype=int))
+
+
+class AGC:
+    """慢速自动增益：把有声块的 RMS 拉向 target_dbfs，增益限制在 [min_gain_db, max_gain_db]。
+    "有声"指高于绝对门限 gate_dbfs 且高于跟踪到的底噪 speech_margin_db。"""
+
+    def __init__(self, target_dbfs=-20.0, max_gain_db=18.0, min_gain_db=-6.0, gate_dbfs=-50.0,
+                 speech_margin_db=12.0, attack=0.3, release=0.05):
+        self.target = 10 ** (target_dbfs / 20.0)
+        self.max_gain = 10 ** (max_gain_db / 20.0)
+        self.min_gain = 10 ** (min_gain_db / 20.0)
+        self.gate = 10 ** (gate_dbfs / 20.0)
+        self.speech_margin = 10 ** (speech_margin_db / 20.0)
+        self.noise = None  # 底噪 RMS：向下快、向上慢
+        self.attack = attack  # 需要降增益（太响）时的调整速度
+        self.release = release  # 需要升增益时的调整速度，较慢，避免说话间隙把底噪抬起来
+        self.gain = 1.0
+        self._ramp = np.empty(0, dtype=np.float32)
+
+    def process(self, x):
+        """就地调整 float32 单声道块的增益并返回。"""
+        n = len(x)
+        if n == 0:
+            return x
+        rms = float(np.sqrt(np.mean(x * x)))
+        gain = self.gain
+        if self.noise is None:
+            self.noise = rms
+        self.noise += (0.3 if rms < self.noise else 0.01) * (rms - self.noise)
+        if rms > self.gate and rms > self.noise * self.speech_margin:
+            desired = min(self.max_gain, max(self.min_gain, self.target / rms))
+            rate = self.attack if desired < gain else self.release
+            gain += rate * (desired - gain)
+        if self._ramp.size != n:
+            self._ramp = np.linspace(0.0, 1.0, n, dtype=np.float32)
+        # 块内从旧增益线性过渡到新增益
+        x *= self.gain + (gain - self.gain) * self._ramp
+        np.clip(x, -1.0, 1.0, out=x)
+        self.gain = gain
+        return x
+
+
+def to_int16(x, out=None):
+    """float32（[-1, 1]）→ int16；out 为预分配缓冲区（长度不够时重新分配），返回其视图。"""
+    n = len(x)
+    if out is None or out.size < n:
+        out = np.empty(n, dtype=np.int16)
+    view = out[:n]
+    np.clip(x, -1.0, 1.0, out=x)
+    np.multiply(x, 32767.0, out=view, casting="unsafe")
+    return view
+
+
+def create_frontend(cfg, channels, samplerate, block_size):
+    """按配置创建前端与 AGC；返回 (FrontEnd, AGC 或 None)。"""
+    cfg = cfg or {}
+    frontend = FrontEnd(
+        channels,
+        samplerate=samplerate,
+        block_size=block_size,
+        beamform=cfg.get("beamform", True),
+        max_delay_ms=cfg.get("max_delay_ms", 0.5),
+    )
+    agc = None
+    if cfg.get("agc", True):
+        agc = AGC(target_dbfs=cfg.get("target_dbfs", -20.0), max_gain_db=cfg.get("max_gain_db", 18.0))
+    return frontend, agc
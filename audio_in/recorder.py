@@ -1,17 +1,24 @@
-import sounddevice as sd
+from math import ceil
+
 import numpy as np
 import time
 from utils.logger import logger
 import audio_out.player as player
-from utils.audio_device import DeviceUnavailable, find_input_device
+from audio_in.capture import CaptureHub
+from audio_in.frontend import create_frontend, to_int16
+from audio_in.vad import Endpointer, EnergyVAD, ThresholdVAD
+from utils.audio_device import DeviceUnavailable
+from utils.resample import make_resampler
+from utils.tracing import tracer
 
 
 class RecordingStream:
-    """包装录音生成器与底层音频流：可迭代，支持从外部安全关闭（避免遗留幽灵音频流）。"""
+    """包装录音生成器与采集订阅：可迭代，支持从外部安全关闭（退订，不影响共享输入流）。"""
 
-    def __init__(self, generator, stream_ref):
+    def __init__(self, generator, stream_ref, turn_stats=None):
         self._generator = generator
         self._stream_ref = stream_ref
+        self._turn_stats = turn_stats if turn_stats is not None else {}
 
     def __iter__(self):
         return self
@@ -31,9 +38,14 @@ class RecordingStream:
         except Exception:
             pass
 
+    def stats(self):
+        """本轮采集统计：块数、最大积压块数、设备溢出次数、因积压丢弃的块数。"""
+        return dict(self._turn_stats)
+
 
 class Recorder:
-    def __init__(self, samplerate=16000, channels=4, dtype='int16', block_size=1280, max_record_time=15, silence_threshold=2000, silence_duration=2.0, device=None):
+    def __init__(self, samplerate=16000, channels=4, dtype='int16', block_size=1280, max_record_time=15, silence_threshold=2000, silence_duration=2.0, device=None, capture_samplerate=None,
+                 vad=None, onset_ms=150, endpoint_ms=None, aec=None, hub=None, frontend_cfg=None):
         self.samplerate = samplerate
         self.channels = channels
         self.dtype = dtype
@@ -42,86 +54,197 @@ class Recorder:
         self.silence_threshold = silence_threshold
         self.silence_duration = silence_duration
         self.device = device
+        # 部分麦克风只支持 48k 采集：按采集率打开设备，再流式重采样到 samplerate 交给 ASR
+        self.capture_samplerate = capture_samplerate or samplerate
+        # 可插拔 VAD：默认沿用固定阈值判定；配置自适应 VAD 后说完只需 endpoint_ms 静音即停止
+        self.vad = vad or ThresholdVAD(samplerate=samplerate, threshold=silence_threshold)
+        self.onset_ms = onset_ms
+        self.endpoint_ms = endpoint_ms if endpoint_ms is not None else silence_duration * 1000
+        # 回声消除：有了它录音不必等播放结束、留回响消散时间
+        self.aec = aec
+        # 共享麦克风采集：与唤醒词检测共用一条常开的输入流；未传入时首次录音自行创建
+        self.hub = hub
+        # 多声道前端（去直流、波束形成、自动增益）配置，见 audio_in/frontend.py
+        self.frontend_cfg = frontend_cfg or {}
+
+    def open_capture(self, name="recorder"):
+        """订阅共享麦克风，从当前时刻开始读；设备不可用时抛出 DeviceUnavailable。"""
+        if self.hub is None:
+            self.hub = CaptureHub(
+                samplerate=self.capture_samplerate,
+                channels=self.channels,
+                dtype=self.dtype,
+                block_size=int(self.block_size * self.capture_samplerate / self.samplerate),
+                device=self.device,
+            )
+            self.hub.start()
+        if not self.hub.wait_ready(timeout=1.0):
+            logger.warning("录音时麦克风不可用，未找到设备。")
+            raise DeviceUnavailable("麦克风未接入")
+        return self.hub.subscribe(name)
+
+    def make_pipeline(self, dtype="int16", aec=True, agc=True, vad_tap=False):
+        """
+        为一个消费方建立独立的处理链（各自保留滤波器状态），返回 process(采集块, 时间戳=None) -> 单声道块。
+        顺序：前端（去直流、波束形成）→ 重采样到 samplerate → 回声消除（要求线性，须在增益之前）→ 自动增益。
+        dtype 为 "int16"（ASR 上行、VAD）或 "float32"（sherpa，[-1, 1]）；返回内部缓冲区视图，下一块前有效。
+        vad_tap 为真时（仅 int16）返回 (单声道块, 增益前的单声道块)：VAD 的绝对阈值（silence_threshold）
+        按原始音量设定，不能喂给被 AGC 放大过的信号。
+        """
+        capture_block = int(self.block_size * self.capture_samplerate / self.samplerate)
+        frontend, gain = create_frontend(self.frontend_cfg, self.channels, self.capture_samplerate, capture_block)
+        gain = gain if agc else None
+        resampler = make_resampler(self.capture_samplerate, self.samplerate)
+        canceller = self.aec if aec else None
+        out = np.empty(self.block_size, dtype=np.int16)
+        tap = np.empty(self.block_size, dtype=np.int16) if vad_tap else None
+
+        def process(block, timestamp=None):
+            nonlocal out, tap
+            x = frontend.process(block)
+            if resampler is not None:
+                x = resampler.process(x)
+            if canceller is not None and timestamp is not None:
+                x = canceller.process(x, timestamp)
+            if tap is not None:
+                tap = to_int16(x, tap)
+                if gain is None:
+                    return tap, tap
+            if gain is not None:
+                x = gain.process(x)
+            if dtype == "float32":
+                return x
+            if out.size < len(x):
+                out = np.empty(len(x), dtype=np.int16)
+            mono = to_int16(x, out)
+            return (mono, tap) if tap is not None else mono
+
+        return process
+
+    def speech_follows(self, span, listen_ms=300, drop_db=15.0, min_speech_ms=150):
+        """
+        判断用户是否一口气说了"唤醒词+指令"：以唤醒词本身的音量为参照，唤醒词结束后 listen_ms 内
+        累计有 min_speech_ms 的帧不低于 (唤醒词音量 - drop_db) 即视为紧接着在说话。
+        是则返回游标定位在唤醒词结束处的采集订阅（直接交给 record_stream，指令从缓冲区补发），否则返回 None。
+        """
+        start, end = span
+        sub = self.open_capture("preroll")
+        sub.seek(start)
+        block_ms = 1000.0 * self.hub.block_size / self.hub.samplerate
+        stop = end + ceil(listen_ms / block_ms)
+        pipeline = self.make_pipeline(aec=False, agc=False)  # 要比较原始音量，不做增益
+        meter = EnergyVAD(samplerate=self.samplerate)  # 只借用它的分帧求能量
+        keyword_db, after_db = [], []
+        try:
+            while sub.cursor < stop:
+                item = sub.read(timeout=1.0)
+                if item is None:
+                    break
+                db = meter.frame_db(pipeline(item[0]))
+                (keyword_db if sub.cursor <= end else after_db).append(db)
+        except Exception:
+            sub.close()
+            raise
+        follows = False
+        if keyword_db and after_db:
+            # 取唤醒词中较响的部分作参照，避开字间停顿
+            reference = np.percentile(np.concatenate(keyword_db), 75)
+            speech_ms = np.count_nonzero(np.concatenate(after_db) >= reference - drop_db) * meter.frame_ms
+            follows = speech_ms >= min_speech_ms
+            logger.debug(f"唤醒词后 {listen_ms}ms 内语音 {speech_ms:.0f}ms（参照 {reference:.1f}dB）")
+        if not follows:
+            sub.close()
+            return None
+        sub.seek(end)
+        return sub
+
+    def prime_vad(self, cursor, history_s=2.0):
+        """
+        自适应 VAD 还没有噪声底时，用采集缓冲区里 cursor 之前 history_s 秒的音频估计它。
+        开机后第一轮就可能从说话中途开始（一口气说"唤醒词+指令"），拿第一帧当噪声底会把它定在语音音量上。
+        """
+        if getattr(self.vad, "noise_floor_db", 0) is not None or self.hub is None:
+            return
+        block_ms = 1000.0 * self.hub.block_size / self.hub.samplerate
+        start = max(cursor - ceil(history_s * 1000 / block_ms), self.hub.ring.oldest())
+        if start >= cursor:
+            return
+        sub = self.hub.subscribe("vad-prime")
+        sub.seek(start)
+        pipeline = self.make_pipeline(aec=False, agc=False)
+        meter = EnergyVAD(samplerate=self.samplerate)  # 只借用它的分帧求能量
+        history = []
+        try:
+            while sub.cursor < cursor:
+                item = sub.read(timeout=0.2)
+                if item is None:
+                    break
+                history.append(meter.frame_db(pipeline(item[0])))
+        finally:
+            sub.close()
+        if history:
+            self.vad.prime(np.concatenate(history))
+            logger.debug(f"VAD 噪声底按交接前 {len(history) * block_ms / 1000:.1f}s 缓冲估计为 {self.vad.noise_floor_db:.1f}dB")
 
-    def record_stream(self, max_wait_s=15.0):
+    def record_stream(self, max_wait_s=15.0, settle_s=1.5, capture=None):
         """
         流式录音：打开麦克风后先等待用户开口，开口后才开始有效录音。
         - 开口前持续发送静音帧，保持 ASR 连接不断
-        - 开口需连续两帧超过阈值（约150ms），避免误触发
-        - 开口后静音 silence_duration 秒自动停止
+        - 开口需连续 onset_ms（约150ms）判为语音，避免误触发
+        - 开口后连续 endpoint_ms 判为非语音自动停止
         - 等 max_wait_s 秒无人说话则放弃本轮
+        - 可传入已有的采集订阅（如打断监听交接过来的，游标已在用户开口处），不丢开头
+        - 启用回声消除且最近的播放都写入了回声参考时不等播放结束，立即开始；
+          子进程播放（mpg123/afplay）没有参考信号，仍要等播完并留出回响消散时间
         """
-        player.wait_until_idle(timeout_s=10)
-        time.sleep(1.5)  # 播放结束后留足回响消散时间，避免录到音箱自己的回声
-        silence_chunk = int(self.samplerate * self.silence_duration)
+        if capture is None and not (self.aec is not None and player.echo_reference_covers(settle_s)):
+            player.wait_until_idle(timeout_s=10)
+            time.sleep(settle_s)  # 播放结束后留足回响消散时间，避免录到音箱自己的回声
         max_total = int(self.samplerate * self.max_record_time)
         max_wait = int(self.samplerate * max_wait_s)
 
         state = {
-            "speech_started": False,
-            "onset_count": 0,
-            "silence_count": 0,
             "waited": 0,
             "total": 0,
         }
+        self.vad.reset()
+        endpointer = Endpointer(onset_ms=self.onset_ms, endpoint_ms=self.endpoint_ms)
 
         stream_ref = []
+        turn_stats = {"blocks": 0, "max_backlog": 0, "overflows": 0, "dropped": 0}
 
-        def gen():
-            device_id = find_input_device(self.device) if self.device else None
-            if device_id is None and self.device:
-                logger.warning("录音时麦克风不可用，未找到设备。")
-                raise DeviceUnavailable("麦克风未接入")
-            last_check = time.monotonic()
-            input_stream = None
-            try:
-                input_stream = sd.InputStream(
-                    samplerate=self.samplerate,
-                    channels=self.channels,
-                    dtype=self.dtype,
-                    blocksize=self.block_size,
-                    device=device_id,
-                )
-                input_stream.start()
-            except Exception as e:
-                logger.warning(f"录音时麦克风打开失败：{e}")
-                if input_stream is not None:
-                    try:
-                        input_stream.close()
-                    except Exception:
-                        pass
-                raise DeviceUnavailable("麦克风已断开或不可用") from e
-            stream_ref.append(input_stream)
+        def gen(capture):
+            if capture is None:
+                capture = self.open_capture()
+            stream_ref.append(capture)
+            self.prime_vad(capture.cursor)
+            # VAD 看增益前的信号：固定阈值按原始音量设定，AGC 放大后静音也会被判为语音
+            pipeline = self.make_pipeline(vad_tap=True)
             try:
                 logger.info("开始流式录音，请说话...")
+                tracer.mark("mic.open")
                 while True:
-                    if self.device and time.monotonic() - last_check >= 1.0:
-                        last_check = time.monotonic()
-                        if find_input_device(self.device) is None:
-                            logger.warning("录音中检测到麦克风断开，结束本轮。")
-                            raise DeviceUnavailable("麦克风已断开")
                     try:
-                        block, _ = input_stream.read(self.block_size)
-                    except Exception:
-                        logger.debug("录音流已关闭，结束本轮。")
-                        return
-                    if self.channels > 1:
-                        # 4 路平均拾音：比单取第 0 路更稳定（决策3，实测后可回退）
-                        mono = block.astype(np.float32).mean(axis=1).astype(np.int16)
-                    else:
-                        mono = block
-                    level = np.abs(mono).mean()
-
-                    if not state["speech_started"]:
+                        item = capture.read(timeout=1.0)
+                    except DeviceUnavailable:
+                        logger.warning("录音中检测到麦克风断开，结束本轮。")
+                        raise
+                    if item is None:
+                        if capture.closed:
+                            logger.debug("录音流已关闭，结束本轮。")
+                            return
+                        continue
+                    block, ts, _ = item
+                    mono, vad_in = pipeline(block, ts)
+                    probs = self.vad.process(vad_in)
+                    event = endpointer.update(probs, self.vad.frame_ms)
+
+                    if event == "onset":
+                        tracer.mark("speech.onset")
+                        logger.debug("检测到用户开口，开始有效录音。")
+                    elif not endpointer.speech_started:
                         # 等待用户开口
-                        if level >= self.silence_threshold:
-                            state["onset_count"] += 1
-                            if state["onset_count"] >= 2:
-                                state["speech_started"] = True
-                                state["silence_count"] = 0
-                                logger.debug("检测到用户开口，开始有效录音。")
-                        else:
-                            state["onset_count"] = 0
+                        if not len(probs) or probs.max() < endpointer.threshold:
                             state["waited"] += len(mono)
                             if state["waited"] >= max_wait:
                                 logger.info("等待用户说话超时，结束本轮。")
@@ -134,20 +257,23 @@ class Recorder:
                     yield mono.tobytes()
                     state["total"] += len(mono)
                     if state["total"] >= max_total:
+                        tracer.mark("speech.endpoint", reason="max_time")
                         logger.info("达到最长录音时间，自动停止。")
                         break
-                    if level < self.silence_threshold:
-                        state["silence_count"] += len(mono)
-                        if state["silence_count"] >= silence_chunk:
-                            logger.info("检测到静音，自动停止流式录音。")
-                            break
-                    else:
-                        state["silence_count"] = 0
+                    if event == "end":
+                        tracer.mark("speech.endpoint")
+                        logger.info("检测到说话结束，自动停止流式录音。")
+                        break
 
             finally:
-                try:
-                    input_stream.close()
-                except Exception:
-                    pass
+                capture.close()
+                turn_stats["blocks"] = capture.blocks
+                turn_stats["dropped"] = capture.lost
+                turn_stats["max_backlog"] = capture.max_backlog
+                turn_stats["overflows"] = capture.overflows
+                logger.info(
+                    f"录音统计：块数={turn_stats['blocks']} 最大积压={turn_stats['max_backlog']}块 "
+                    f"设备溢出={turn_stats['overflows']} 丢块={turn_stats['dropped']}"
+                )
 
-        return RecordingStream(gen(), stream_ref)
+        return RecordingStream(gen(capture), stream_ref, turn_stats)
@@ -0,0 +1,177 @@
+"""语音活动检测（VAD）与端点判定。
+
+各 VAD 统一接口：process(int16 单声道块) -> 每帧的语音概率数组（0~1），frame_ms 为帧长。
+- ThresholdVAD：原固定阈值判定（块平均幅度 ≥ silence_threshold），保留作兼容
+- EnergyVAD：按帧能量（dB）对比自适应噪声底，厨房等嘈杂环境噪声底随之抬高，安静卧室也不漏掉轻声
+- SileroVAD：sherpa-onnx 的 Silero VAD 模型（复用已有 sherpa-onnx 依赖），需另行下载模型
+Endpointer 根据帧概率判定开口与说完，说完判定只需几百毫秒静音，而不是固定 2 秒。
+"""
+
+import numpy as np
+
+
+class ThresholdVAD:
+    """原有逻辑：整块平均幅度超过阈值即为语音（每块一帧）。"""
+
+    def __init__(self, samplerate=16000, threshold=2000):
+        self.samplerate = samplerate
+        self.threshold = threshold
+        self.frame_ms = None  # 帧长即块长，由调用方的块决定
+
+    def process(self, block):
+        self.frame_ms = len(block) * 1000.0 / self.samplerate
+        level = np.abs(block).mean() if len(block) else 0.0
+        return np.array([1.0 if level >= self.threshold else 0.0])
+
+    def reset(self):
+        pass
+
+
+class EnergyVAD:
+    """
+    自适应能量 VAD：
+    - 噪声底只在非语音帧以 EMA 跟踪，向下快、向上慢；语音期间也以极慢速度上浮，
+      防止背景噪声突然变大后永远判为语音
+    - 语音概率 = sigmoid((帧能量 - 噪声底 - margin_db) / slope_db)
+    """
+
+    def __init__(self, samplerate=16000, frame_ms=10, margin_db=10.0, slope_db=2.0,
+                 floor_down=0.2, floor_up=0.02, floor_drift_db_s=1.0, min_floor_db=-75.0):
+        self.samplerate = samplerate
+        self.frame_ms = frame_ms
+        self.frame_len = int(samplerate * frame_ms / 1000)
+        self.margin_db = margin_db
+        self.slope_db = slope_db
+        self.floor_down = floor_down
+        self.floor_up = floor_up
+        self.floor_drift = floor_drift_db_s * frame_ms / 1000.0
+        self.min_floor_db = min_floor_db
+        self.noise_floor_db = None
+        self._tail = np.zeros(0, dtype=np.float32)
+
+    def frame_db(self, block):
+        """把块（拼上次剩余样点）切成整帧，返回每帧能量 dBFS。"""
+        samples = np.concatenate([self._tail, np.asarray(block, dtype=np.float32) / 32768.0])
+        n = len(samples) // self.frame_len
+        self._tail = samples[n * self.frame_len:]
+        frames = samples[:n * self.frame_len].reshape(n, self.frame_len)
+        power = np.mean(frames * frames, axis=1) + 1e-12
+        return 10.0 * np.log10(power)
+
+    def prime(self, db, percentile=20):
+        """
+        用一段帧能量（如交接点之前的缓冲音频）估计初始噪声底，取低分位避开其中的语音；
+        已有噪声底时不动。
+        """
+        if self.noise_floor_db is None and len(db):
+            self.noise_floor_db = max(float(np.percentile(db, percentile)), self.min_floor_db)
+
+    def process(self, block):
+        db = self.frame_db(block)
+        # 没有历史可用时退而用首块的低分位估计；首块可能已在说话，调用方应先 prime()
+        self.prime(db)
+        probs = np.empty(len(db))
+        for i, e in enumerate(db):
+            floor = self.noise_floor_db
+            p = 1.0 / (1.0 + np.exp(-(e - floor - self.margin_db) / self.slope_db))
+            probs[i] = p
+            if p < 0.5:
+                rate = self.floor_down if e < floor else self.floor_up
+                floor += rate * (e - floor)
+            else:
+                floor += self.floor_drift
+            self.noise_floor_db = max(floor, self.min_floor_db)
+        return probs
+
+    def reset(self):
+        self._tail = np.zeros(0, dtype=np.float32)
+
+
+class SileroVAD:
+    """sherpa-onnx Silero VAD：每 512 样点（32ms）一个判定，输出 0/1 概率。"""
+
+    WINDOW = 512
+
+    def __init__(self, model, samplerate=16000, threshold=0.5, num_threads=1):
+        import sherpa_onnx
+
+        config = sherpa_onnx.VadModelConfig()
+        config.silero_vad.model = model
+        config.silero_vad.threshold = threshold
+        config.silero_vad.min_silence_duration = 0.1
+        config.silero_vad.min_speech_duration = 0.1
+        config.silero_vad.window_size = self.WINDOW
+        config.sample_rate = samplerate
+        config.num_threads = num_threads
+        self.samplerate = samplerate
+        self.frame_ms = self.WINDOW * 1000.0 / samplerate
+        self._vad = sherpa_onnx.VoiceActivityDetector(config, buffer_size_in_seconds=30)
+        self._tail = np.zeros(0, dtype=np.float32)
+
+    def process(self, block):
+        samples = np.concatenate([self._tail, np.asarray(block, dtype=np.float32) / 32768.0])
+        n = len(samples) // self.WINDOW
+        self._tail = samples[n * self.WINDOW:]
+        probs = np.empty(n)
+        for i in range(n):
+            self._vad.accept_waveform(samples[i * self.WINDOW:(i + 1) * self.WINDOW])
+            probs[i] = 1.0 if self._vad.is_speech_detected() else 0.0
+            # 只用逐帧判定，不需要 sherpa 内部缓存的语音段
+            while not self._vad.empty():
+                self._vad.pop()
+        return probs
+
+    def reset(self):
+        self._vad.reset()
+        self._tail = np.zeros(0, dtype=np.float32)
+
+
+class Endpointer:
+    """
+    端点判定：连续 onset_ms 语音判为开口；开口后连续 endpoint_ms 非语音判为说完。
+    update() 返回 "onset" / "end" / None。
+    """
+
+    def __init__(self, onset_ms=150, endpoint_ms=600, threshold=0.5):
+        self.onset_ms = onset_ms
+        self.endpoint_ms = endpoint_ms
+        self.threshold = threshold
+        self.speech_started = False
+        self._speech_run = 0.0
+        self._silence_run = 0.0
+
+    def update(self, probs, frame_ms):
+        event = None
+        for p in probs:
+            if p >= self.threshold:
+                self._speech_run += frame_ms
+                self._silence_run = 0.0
+            else:
+                self._speech_run = 0.0
+                self._silence_run += frame_ms
+            if not self.speech_started:
+                if self._speech_run >= self.onset_ms:
+                    self.speech_started = True
+                    event = "onset"
+            elif self._silence_run >= self.endpoint_ms:
+                return "end"
+        return event
+
+
+def vad_endpoint_ms(cfg):
+    """自适应 VAD（energy / silero）说完判定的静音毫秒数；threshold 模式返回 None，沿用 silence_duration。"""
+    cfg = cfg or {}
+    if cfg.get("type", "threshold") in ("energy", "silero"):
+        return cfg.get("endpoint_ms")
+    return None
+
+
+def create_vad(cfg, samplerate=16000, silence_threshold=2000):
+    """按配置创建 VAD：type 为 energy / silero / threshold（旧版固定阈值，默认）。"""
+    cfg = cfg or {}
+    kind = cfg.get("type", "threshold")
+    if kind == "energy":
+        return EnergyVAD(samplerate=samplerate, margin_db=cfg.get("margin_db", 10.0))
+    if kind == "silero":
+        return SileroVAD(cfg["silero_model"], samplerate=samplerate, threshold=cfg.get("threshold", 0.5))
+    return ThresholdVAD(samplerate=samplerate, threshold=silence_threshold)
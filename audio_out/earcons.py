@@ -0,0 +1,112 @@
+"""提示音库：欢迎语、错误提示音在启动时一次性解码为 PCM 常驻内存，播放时不再 fork 播放器进程。
+
+解码结果（16k 单声道 int16 裸 PCM）落盘为同名 .pcm，下次启动直接读取，连解码都省掉；
+源文件比 .pcm 新（换了欢迎音、重新生成了提示音）时重新解码。
+播放时统计"唤醒词检测 → 提示音首个样点"的延迟：输出引擎记录的是样点真正写入输出流的时刻，
+流式播放（未启用引擎）按阻塞写返回时刻与输出延迟估算。
+"""
+
+import os
+import platform
+import subprocess
+import tempfile
+import wave
+
+import numpy as np
+
+from utils.logger import logger
+
+EARCON_SAMPLERATE = 16000
+EARCON_PRIORITY = 10  # 高于 TTS 流（0），插队播放
+_CHUNK_BYTES = 3200  # 100ms
+
+
+def decode_to_pcm(path, samplerate=EARCON_SAMPLERATE):
+    """把 MP3 等音频解码为单声道 int16 PCM（bytes）；macOS 用 afconvert，Linux 用 mpg123。"""
+    if path.endswith(".pcm"):
+        with open(path, "rb") as f:
+            return f.read()
+    if path.endswith(".wav"):
+        return _read_wav(path)
+    if platform.system() == "Darwin":
+        with tempfile.TemporaryDirectory() as tmp:
+            out = os.path.join(tmp, "decoded.wav")
+            subprocess.run(["afconvert", "-f", "WAVE", "-d", f"LEI16@{samplerate}", "-c", "1", path, out],
+                           check=True, capture_output=True)
+            return _read_wav(out)
+    proc = subprocess.run(["mpg123", "-q", "-s", "-m", "-e", "s16", "-r", str(samplerate), path],
+                          check=True, capture_output=True)
+    return proc.stdout
+
+
+def _read_wav(path):
+    with wave.open(path, "rb") as wf:
+        frames = wf.readframes(wf.getnframes())
+        if wf.getnchannels() > 1:
+            pcm = np.frombuffer(frames, dtype=np.int16).reshape(-1, wf.getnchannels())
+            frames = pcm.mean(axis=1).astype(np.int16).tobytes()
+        return frames
+
+
+class EarconBank:
+    def __init__(self, engine=None, samplerate=EARCON_SAMPLERATE):
+        self.engine = engine
+        self.samplerate = samplerate
+        self._bank = {}
+        self.last_wake_latency_ms = None
+
+    def load(self, tag, path):
+        """载入一条提示音：同名 .pcm 不比源文件旧时直接读取，否则解码一次并落盘 .pcm。失败返回 False。
+        只有 .pcm 没有源文件时（讯飞不可用时离线生成）直接读 .pcm。"""
+        pcm_path = os.path.splitext(path)[0] + ".pcm"
+        try:
+            if os.path.exists(path) and (not os.path.exists(pcm_path) or
+                                         os.path.getmtime(path) > os.path.getmtime(pcm_path)):
+                pcm = decode_to_pcm(path, self.samplerate)
+                with open(pcm_path, "wb") as f:
+                    f.write(pcm)
+            elif os.path.exists(pcm_path):
+                pcm = decode_to_pcm(pcm_path)
+            else:
+                logger.warning(f"提示音文件不存在：{path}")
+                return False
+        except Exception as e:
+            logger.error(f"提示音解码失败（{tag}）：{e}")
+            return False
+        self._bank[tag] = pcm
+        logger.debug(f"提示音已载入内存：{tag}（{len(pcm)}字节）")
+        return True
+
+    def __contains__(self, tag):
+        return tag in self._bank
+
+    def _chunks(self, pcm):
+        view = memoryview(pcm)
+        for offset in range(0, len(pcm), _CHUNK_BYTES):
+            yield view[offset:offset + _CHUNK_BYTES]
+
+    def play(self, tag, wait=True, since=None):
+        """
+        播放内存中的提示音；since 为触发时刻（time.monotonic()），用于统计到首个样点的延迟。
+        通过输出引擎播放时返回 Playback 句柄，否则走 sounddevice 流式播放（阻塞到播完）并返回是否成功。
+        """
+        pcm = self._bank.get(tag)
+        if pcm is None:
+            logger.warning(f"提示音未载入：{tag}")
+            return None
+        if self.engine is None:
+            from audio_out.player import play_audio_stream
+            on_first = (lambda at: self._record_latency(tag, since, at)) if since is not None else None
+            return play_audio_stream(self._chunks(pcm), src_samplerate=self.samplerate, traced=False,
+                                     on_first_sample=on_first)
+        handle = self.engine.enqueue(self._chunks(pcm), priority=EARCON_PRIORITY,
+                                     src_samplerate=self.samplerate, tag=tag)
+        if wait:
+            handle.wait(timeout=len(pcm) / 2 / self.samplerate + 5)
+            if since is not None and handle.first_sample_at is not None:
+                self._record_latency(tag, since, handle.first_sample_at)
+        return handle
+
+    def _record_latency(self, tag, since, first_sample_at):
+        self.last_wake_latency_ms = (first_sample_at - since) * 1000
+        logger.info(f"提示音[{tag}]首个样点距触发 {self.last_wake_latency_ms:.0f}ms")
@@ -0,0 +1,339 @@
+"""常驻音频输出引擎：进程内只打开一次输出流，回调从无锁环形缓冲区取数据。
+
+- 单生产者（送数线程）/ 单消费者（音频回调）环形缓冲区，读写位置各自只由一方推进，不加锁
+- enqueue() 投递 PCM 源（TTS 流、提示音），按优先级逐块调度：高优先级源到来后
+  在下一个块边界插队，低优先级源暂停、之后继续
+- cancel()/flush() 由回调跳过被取消源已写入的数据段实现，一个回调周期内生效
+- wait_until_idle() 由缓冲区真正播完驱动，而不是锁住一个子进程
+- 统计欠载（underrun）次数，便于排查卡顿：只计已开始出声的源中途断粮，等网络首帧不算
+- 设置 reference（audio_in.aec.FarEndBuffer）后，回调把实际输出连同到达喇叭的时刻写入，供回声消除对齐
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from utils.audio_backend import get_backend
+from utils.logger import logger
+from utils.resample import make_resampler
+
+
+class Playback:
+    """一次投递的播放句柄：可等待播完、可取消，记录首个样点的输出时间。"""
+
+    def __init__(self, source, priority, src_samplerate, tag):
+        self.source = source
+        self.priority = priority
+        self.src_samplerate = src_samplerate
+        self.tag = tag
+        self.cancelled = False
+        self.error = None
+        self.frames = 0
+        self.enqueued_at = time.monotonic()
+        self.first_sample_at = None
+        self.done = threading.Event()
+        self._iter = None
+        self._resampler = None
+
+    @property
+    def ok(self):
+        return self.done.is_set() and not self.cancelled and self.error is None
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+
+class RingBuffer:
+    """单生产者单消费者环形缓冲区；位置为单调递增的绝对帧号。"""
+
+    def __init__(self, capacity, channels, dtype=np.int16):
+        self.capacity = capacity
+        self.data = np.zeros((capacity, channels), dtype=dtype)
+        self.write_pos = 0
+        self.read_pos = 0
+
+    def free(self):
+        return self.capacity - (self.write_pos - self.read_pos)
+
+    def write(self, frames):
+        """写入帧（调用方保证有足够空间）；返回写入前的位置。"""
+        n = frames.shape[0]
+        start = self.write_pos
+        idx = start % self.capacity
+        first = min(n, self.capacity - idx)
+        self.data[idx:idx + first] = frames[:first]
+        if first < n:
+            self.data[:n - first] = frames[first:]
+        self.write_pos = start + n
+        return start
+
+    def read_into(self, out, n):
+        idx = self.read_pos % self.capacity
+        first = min(n, self.capacity - idx)
+        out[:first] = self.data[idx:idx + first]
+        if first < n:
+            out[first:n] = self.data[:n - first]
+        self.read_pos += n
+
+
+class OutputEngine:
+    def __init__(self, device=None, samplerate=44100, channels=2, blocksize=1024, buffer_s=1.0, reference=None):
+        self.device = device
+        self.samplerate = samplerate
+        self.channels = channels
+        self.blocksize = blocksize
+        self.ring = RingBuffer(int(samplerate * buffer_s), channels)
+        self.underruns = 0
+        self.frames_played = 0
+        self.reference = reference  # 回声消除的远端参考缓冲区
+        self.gain = 1.0  # 软件音量（线性增益），对之后送入缓冲区的音频生效
+        self._out_latency = 0.0
+        self._segments = deque()  # (起, 止, 句柄, 是否末段)，送数线程追加、回调弹出
+        self._pending = []  # 优先级堆
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._feeding = None
+        self._playing = None  # 已开始出声、尚未播完的源（回调线程独占）
+        self._frames = np.empty((blocksize * 4, channels), dtype=np.int16)
+        self._stream = None
+        self._stream_lock = threading.Lock()
+        self._feeder = threading.Thread(target=self._feed_loop, name="audio-out-feeder", daemon=True)
+        self._feeder.start()
+
+    # ---- 对外接口 ----
+
+    def enqueue(self, source, priority=0, src_samplerate=16000, tag=None):
+        """投递一个 PCM 源（yield 单声道 int16 bytes 的可迭代对象），返回 Playback 句柄。
+        priority 越大越优先；同优先级先来先播。"""
+        handle = Playback(source, priority, src_samplerate, tag)
+        self._ensure_stream()
+        with self._cond:
+            # 入堆与清空闲标志在同一把锁内：回调只在持锁时判定空闲，不会把刚投递的源漏掉
+            heapq.heappush(self._pending, (-priority, next(self._seq), handle))
+            self._idle.clear()
+            self._cond.notify()
+        return handle
+
+    def cancel(self, handle=None):
+        """取消指定播放（默认取消全部）；已写入缓冲区的数据在下一个回调周期内被丢弃。"""
+        with self._cond:
+            if handle is not None:
+                handles = [handle]
+            else:
+                handles = [h for _, _, h in self._pending] + [seg[2] for seg in list(self._segments)]
+            for h in handles:
+                h.cancelled = True
+            self._cond.notify()
+
+    def flush(self):
+        """清空缓冲区并取消所有播放。"""
+        self.cancel()
+
+    def wait_until_idle(self, timeout_s=None):
+        return self._idle.wait(timeout_s)
+
+    @property
+    def alive(self):
+        """输出流是否在正常运行（设备拔出后回调停止，需要调用方放弃等待）。"""
+        try:
+            return self._stream is not None and self._stream.active
+        except Exception:
+            return False
+
+    @property
+    def idle(self):
+        return self._idle.is_set()
+
+    def stats(self):
+        return {
+            "underruns": self.underruns,
+            "frames_played": self.frames_played,
+            "buffered_frames": self.ring.write_pos - self.ring.read_pos,
+            "pending": len(self._pending),
+        }
+
+    def suspend(self):
+        """空闲时关闭输出流并暂停重开（刷新设备列表期间），返回 True；正在播放返回 False。
+        暂停期间投递会阻塞到 resume()。"""
+        self._stream_lock.acquire()
+        if not self._idle.is_set():
+            self._stream_lock.release()
+            return False
+        if self._stream is not None:
+            try:
+                self._stream.close()
+            except Exception:
+                pass
+            self._stream = None
+        return True
+
+    def resume(self):
+        """结束 suspend()；输出流在下次投递时重新打开。"""
+        self._stream_lock.release()
+
+    def close(self):
+        with self._stream_lock:
+            if self._stream is not None:
+                try:
+                    self._stream.close()
+                except Exception:
+                    pass
+                self._stream = None
+
+    # ---- 输出流 ----
+
+    def _ensure_stream(self):
+        """确保输出流在运行；设备异常断开后在下次投递时重新打开。"""
+        with self._stream_lock:
+            if self._stream is not None:
+                try:
+                    if self._stream.active:
+                        return
+                except Exception:
+                    pass
+                try:
+                    self._stream.close()
+                except Exception:
+                    pass
+                self._stream = None
+            backend = get_backend()
+            out_dev = backend.query_devices(device=self.device, kind="output")
+            logger.info(f"音频输出引擎启动：输出设备=[{out_dev.get('index')}] {out_dev.get('name')}")
+            self._stream = backend.OutputStream(
+                samplerate=self.samplerate,
+                channels=self.channels,
+                dtype="int16",
+                blocksize=self.blocksize,
+                device=self.device,
+                callback=self._callback,
+            )
+            self._stream.start()
+            try:
+                self._out_latency = float(self._stream.latency)
+            except Exception:
+                self._out_latency = 0.0
+
+    def _callback(self, outdata, frames, time_info, status):
+        if status.output_underflow:
+            self.underruns += 1
+        ring = self.ring
+        filled = 0
+        while filled < frames and self._segments:
+            start, end, handle, last = self._segments[0]
+            if handle.cancelled or ring.read_pos >= end:
+                ring.read_pos = max(ring.read_pos, end)
+                self._segments.popleft()
+                if last or handle.cancelled:
+                    handle.done.set()
+                    if self._playing is handle:
+                        self._playing = None
+                continue
+            if handle.first_sample_at is None:
+                handle.first_sample_at = time.monotonic()
+            n = min(frames - filled, end - ring.read_pos)
+            ring.read_into(outdata[filled:], n)
+            filled += n
+            self._playing = handle
+        if filled < frames:
+            outdata[filled:] = 0
+            # 已开始出声的源还没播完却没数据可取：欠载（源尚未出首帧时是在等网络，不算）
+            if self._playing is not None and not self._playing.cancelled:
+                self.underruns += 1
+        self.frames_played += filled
+        if self.reference is not None:
+            self.reference.write(outdata[:, 0], self._dac_time(time_info))
+        if not self._segments and not self._idle.is_set():
+            self._mark_idle()
+
+    def _mark_idle(self):
+        """持锁判定空闲，与 enqueue 的入堆/清标志互斥；拿不到锁就留给下一个回调，不阻塞音频线程。"""
+        if not self._cond.acquire(blocking=False):
+            return
+        try:
+            if not self._segments and not self._pending and self._feeding is None:
+                self._idle.set()
+        finally:
+            self._cond.release()
+
+    def _dac_time(self, time_info):
+        """本回调数据到达喇叭的 time.monotonic() 时刻；宿主 API 不提供 DAC 时间时按输出延迟估算。"""
+        now = time.monotonic()
+        try:
+            ahead = time_info.outputBufferDacTime - time_info.currentTime
+        except AttributeError:
+            ahead = 0.0
+        if not 0.0 < ahead < 1.0:
+            ahead = self._out_latency
+        return now + ahead
+
+    # ---- 送数线程 ----
+
+    def _feed_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                _, _, handle = self._pending[0]
+                self._feeding = handle
+            if handle.cancelled:
+                self._finish(handle, close=True)
+                continue
+            if handle._iter is None:
+                handle._iter = iter(handle.source)
+                handle._resampler = make_resampler(handle.src_samplerate, self.samplerate)
+            try:
+                chunk = next(handle._iter)
+            except StopIteration:
+                self._finish(handle)
+                continue
+            except Exception as e:
+                logger.error(f"音频源读取失败（{handle.tag}）: {e}")
+                handle.error = e
+                self._finish(handle, close=True)
+                continue
+            self._write(handle, chunk)
+
+    def _write(self, handle, chunk):
+        block = np.frombuffer(chunk, dtype=np.int16)
+        if handle._resampler is not None:
+            block = handle._resampler.process(block)
+        if self.gain != 1.0:
+            block = np.clip(block * self.gain, -32768, 32767).astype(np.int16)
+        if self._frames.shape[0] < block.size:
+            self._frames = np.empty((block.size, self.channels), dtype=np.int16)
+        offset = 0
+        while offset < block.size and not handle.cancelled:
+            space = self.ring.free()
+            if space <= 0:
+                time.sleep(0.005)
+                continue
+            n = min(space, block.size - offset)
+            # 单声道扩展为多声道（复用缓冲区）
+            frames = self._frames[:n]
+            frames[:] = block[offset:offset + n, None]
+            start = self.ring.write(frames)
+            self._segments.append((start, start + n, handle, False))
+            handle.frames += n
+            offset += n
+
+    def _finish(self, handle, close=False):
+        """源结束：追加末段标记并从堆中移除，由回调在真正播完时置 done。"""
+        if close:
+            try:
+                handle.source.close()
+            except Exception:
+                pass
+        pos = self.ring.write_pos
+        self._segments.append((pos, pos, handle, True))
+        with self._cond:
+            self._pending = [item for item in self._pending if item[2] is not handle]
+            heapq.heapify(self._pending)
+            self._feeding = None
+        if not self.alive:
+            handle.done.set()
@@ -1,17 +1,96 @@
 import subprocess
 import platform
-import sounddevice as sd
 import numpy as np
 import threading
+import time
+from utils.audio_backend import get_backend
+from utils.audio_device import register_stream_owner
 from utils.logger import logger
+from utils.resample import make_resampler
+from utils.tracing import tracer
+from audio_out.engine import OutputEngine
 
 _audio_play_lock = threading.Lock()  # 新增：全局锁
 _is_playing_event = threading.Event() # 新增：播放事件控制
+_engine = None  # 常驻输出引擎（configure_engine 启用后流式播放都走它）
+_reference = None  # 回声消除的远端参考缓冲区（set_echo_reference 设置）
+_volume = 100  # 软件音量 0~100（set_volume 设置）
+_unreferenced_playing = False  # 正在用 mpg123/afplay 子进程播放：这条路径不写回声参考
+_unreferenced_end = 0.0  # 上一次子进程播放结束的时刻
+
+
+class _PlaybackStreams:
+    """刷新设备列表前关闭播放侧的音频流：流式播放/子进程播放进行中时拒绝，常驻引擎空闲时关闭其输出流。"""
+
+    def suspend(self):
+        if not _audio_play_lock.acquire(blocking=False):
+            return False
+        if _engine is not None and not _engine.suspend():
+            _audio_play_lock.release()
+            return False
+        return True
+
+    def resume(self):
+        if _engine is not None:
+            _engine.resume()
+        _audio_play_lock.release()
+
+
+register_stream_owner(_PlaybackStreams())
+
+
+def configure_engine(device=None, samplerate=44100, channels=2, blocksize=1024):
+    """启用常驻输出引擎：启动时就打开输出流，之后每次播放不再重复开关设备。"""
+    global _engine
+    if _engine is not None:
+        return _engine
+    _engine = OutputEngine(device=device, samplerate=samplerate, channels=channels, blocksize=blocksize,
+                           reference=_reference)
+    _engine.gain = _volume_gain(_volume)
+    try:
+        _engine._ensure_stream()
+    except Exception as e:
+        logger.warning(f"输出设备暂不可用，首次播放时重试: {e}")
+    return _engine
+
+
+def get_engine():
+    return _engine
+
+
+def set_echo_reference(reference):
+    """设置回声消除参考缓冲区：此后流式播放的实际输出都会连同播放时刻写入其中。"""
+    global _reference
+    _reference = reference
+    if _engine is not None:
+        _engine.reference = reference
+
+
+def _volume_gain(volume):
+    # 平方律：听感上比线性均匀，50 约为 -12dB
+    return (volume / 100.0) ** 2
+
+
+def set_volume(volume):
+    """设置软件音量（0~100），对之后的流式播放生效；返回实际生效的值。"""
+    global _volume
+    _volume = max(0, min(100, int(round(volume))))
+    if _engine is not None:
+        _engine.gain = _volume_gain(_volume)
+    return _volume
+
+
+def get_volume():
+    return _volume
+
 
 def wait_until_idle(timeout_s: float = None) -> bool:
     """
     等到播放结束；返回 True 表示已空闲，False 表示超时仍在“播放中”（可能卡死）
     """
+    if _engine is not None and not _engine.wait_until_idle(timeout_s):
+        logger.warning(f"等待输出引擎播放完成超时，引擎状态: {_engine.stats()}")
+        return False
     if not _is_playing_event.is_set():
         return True
     logger.debug("等待播放完成中...")
@@ -20,9 +99,19 @@ def wait_until_idle(timeout_s: float = None) -> bool:
         logger.warning("等待播放超时，可能存在卡死的播放进程。")
     return ok
     
+def echo_reference_covers(settle_s=0.0):
+    """最近 settle_s 秒内的播放都写入了回声参考：回声消除能减掉，录音不必等播放结束。
+    子进程播放（play_audio）不经过参考缓冲区，正在播或刚播完时返回 False。"""
+    if _reference is None or _unreferenced_playing:
+        return False
+    return time.monotonic() - _unreferenced_end >= settle_s
+
+
 def play_audio(file_path, device=None):
+    global _unreferenced_playing, _unreferenced_end
     with _audio_play_lock:
         _is_playing_event.set()
+        _unreferenced_playing = True
         try:
             cmd = _build_play_cmd(file_path, device)
             logger.debug(f"准备播放音频: {' '.join(cmd)}")
@@ -31,6 +120,8 @@ def play_audio(file_path, device=None):
         except Exception as e:
             logger.error(f"播放失败: {e}")
         finally:
+            _unreferenced_playing = False
+            _unreferenced_end = time.monotonic()
             _is_playing_event.clear()
 
 def _build_play_cmd(file_path, device):
@@ -40,34 +131,96 @@ def _build_play_cmd(file_path, device):
     alsa_device = device if device else "default"
     return ["mpg123", "-q", "-a", alsa_device, file_path]
 
-def play_audio_stream(audio_generator, device=None, samplerate=44100, channels=2, dtype='int16'):
+def _close_source(audio_generator):
+    """放弃一个音频源：生成器（如流式朗读）关闭后其后台合成线程随即停下。"""
+    close = getattr(audio_generator, "close", None)
+    if close is not None:
+        try:
+            close()
+        except Exception:
+            pass
+
+
+def play_audio_stream(audio_generator, device=None, samplerate=44100, channels=2, dtype='int16', src_samplerate=16000,
+                      traced=True, on_first_sample=None):
+    """
+    流式播放 src_samplerate 单声道 PCM；traced 为真时记录本轮首个样点与播放结束（提示音传 False）。
+    on_first_sample(时刻) 在首个样点送出后调用一次，时刻为 time.monotonic() 下的估计值。
+    """
+    if _engine is not None:
+        return _play_with_engine(audio_generator, src_samplerate, traced, on_first_sample)
     with _audio_play_lock:
         _is_playing_event.set()
         try:
-            out_dev = sd.query_devices(device=device, kind="output")
+            backend = get_backend()
+            out_dev = backend.query_devices(device=device, kind="output")
             logger.info(f"流式播放音频启动... 输出设备=[{out_dev.get('index')}] {out_dev.get('name')}")
             logger.info("流式播放音频启动...")
             rms_sum = 0.0
             rms_count = 0
-            with sd.OutputStream(samplerate=samplerate, channels=channels, dtype=dtype, device=device) as stream:
+            # 流式多相重采样：跨块保留滤波器状态，块间无接缝
+            resampler = make_resampler(src_samplerate, samplerate)
+            frames = np.empty((0, channels), dtype=dtype)
+            with backend.OutputStream(samplerate=samplerate, channels=channels, dtype=dtype, device=device) as stream:
                 for audio_chunk in audio_generator:
-                    # 假设音频帧为16kHz单声道PCM
+                    # 音频帧为 src_samplerate 单声道 PCM
                     block = np.frombuffer(audio_chunk, dtype=dtype)
                     rms_sum += float(np.square(block.astype(np.float64)).sum())
                     rms_count += block.size
-                    # 升采样到44.1k
-                    target_len = int(len(block) * samplerate / 16000)
-                    xp = np.linspace(0, len(block)-1, target_len)
-                    x = np.arange(len(block))
-                    upsampled = np.interp(xp, x, block).astype(np.int16)
-                    # 扩展为双声道
-                    stereo = np.stack([upsampled, upsampled], axis=-1)
-                    stream.write(stereo)
+                    upsampled = resampler.process(block) if resampler else block
+                    if _volume != 100:
+                        upsampled = np.clip(upsampled * _volume_gain(_volume), -32768, 32767).astype(dtype)
+                    if frames.shape[0] < upsampled.size:
+                        frames = np.empty((upsampled.size, channels), dtype=dtype)
+                    # 扩展为多声道（复用缓冲区）
+                    out = frames[:upsampled.size]
+                    out[:] = upsampled[:, None]
+                    stream.write(out)
+                    if traced:
+                        tracer.mark("audio.first_sample")
+                    if on_first_sample is not None:
+                        # 阻塞写返回时本块在输出队列末尾：首个样点约在 latency - 块长 之后出声
+                        on_first_sample(time.monotonic() + stream.latency - len(out) / samplerate)
+                        on_first_sample = None
+                    if _reference is not None:
+                        # 阻塞写返回时本块位于输出队列末尾，约 latency 后播完
+                        _reference.write(out[:, 0], time.monotonic() + stream.latency - len(out) / samplerate)
             rms = (rms_sum / rms_count) ** 0.5 if rms_count else 0.0
             logger.info(f"流式音频播放结束。样本={rms_count} RMS={rms:.1f}")
+            if traced:
+                tracer.mark("playback.end")
             return True
         except Exception as e:
             logger.error(f"流式播放失败: {e}")
             return False
         finally:
             _is_playing_event.clear()
+            _close_source(audio_generator)
+
+
+def _play_with_engine(audio_generator, src_samplerate, traced=True, on_first_sample=None):
+    """投递到常驻输出引擎并等待真正播完；输出流中途失效时放弃等待。"""
+    try:
+        handle = _engine.enqueue(audio_generator, src_samplerate=src_samplerate, tag="stream")
+    except Exception as e:
+        logger.error(f"流式播放失败: {e}")
+        _close_source(audio_generator)
+        return False
+    logger.info("流式播放音频启动（输出引擎）...")
+    while not handle.wait(timeout=0.5):
+        if not _engine.alive:
+            logger.error("输出流已失效，取消本次播放。")
+            _engine.cancel(handle)
+            return False
+    if handle.first_sample_at is not None:
+        if on_first_sample is not None:
+            on_first_sample(handle.first_sample_at)
+        latency_ms = (handle.first_sample_at - handle.enqueued_at) * 1000
+        logger.info(f"流式音频播放结束。帧数={handle.frames} 首样点延迟={latency_ms:.0f}ms 欠载累计={_engine.underruns}")
+        if traced:
+            # 引擎记下了首个样点真正写入输出流的时刻，回填
+            tracer.mark("audio.first_sample", at=handle.first_sample_at)
+            tracer.mark("playback.end")
+    if handle.error is not None:
+        logger.error(f"流式播放失败: {handle.error}")
+    return handle.ok
@@ -0,0 +1,79 @@
+"""本地流式识别 CPU 基准：实时率（RTF）、每块解码耗时与收尾延迟。
+
+用法（仓库根目录，树莓派上跑）：
+    python -m bench.bench_asr 录音1.wav 录音2.wav
+    python -m bench.bench_asr 录音.wav --model-dir asr/sherpa-onnx-streaming-paraformer-bilingual-zh-en --model-type paraformer
+    python -m bench.bench_asr 录音.wav --threads 1 2 4
+
+按实时录音的块长（默认 1280 样点 = 80ms）逐块送入，尽快解码不限速：
+- RTF = 解码耗时 / 音频时长，< 1 才跟得上实时说话，建议留出余量（< 0.5）
+- 每块耗时 P50/P95/最大值须小于块长，否则录音越积越多
+- 收尾延迟：音频结束（补静音 + input_finished）到出最终结果的时间，即本地识别比录音结束晚多少
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from asr.sherpa_asr import TAIL_PADDING_S, SherpaASR
+from bench.eval_vad import SAMPLERATE, load_wav
+
+
+def run(asr, pcm, block):
+    recognizer = asr.recognizer
+    stream = recognizer.create_stream()
+    audio = pcm.astype(np.float32) / 32768.0
+    per_block = []
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    for i in range(0, len(audio), block):
+        t = time.perf_counter()
+        stream.accept_waveform(SAMPLERATE, audio[i:i + block])
+        asr._decode(stream)
+        per_block.append(time.perf_counter() - t)
+    t = time.perf_counter()
+    stream.accept_waveform(SAMPLERATE, np.zeros(int(TAIL_PADDING_S * SAMPLERATE), dtype=np.float32))
+    stream.input_finished()
+    asr._decode(stream)
+    text = recognizer.get_result(stream).strip()
+    final_latency = time.perf_counter() - t
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    return text, np.array(per_block), final_latency, wall, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地流式识别实时率基准")
+    parser.add_argument("wavs", nargs="+")
+    parser.add_argument("--model-dir", default="asr/sherpa-onnx-streaming-zipformer-zh-14M-2023-02-23")
+    parser.add_argument("--model-type", default="zipformer", choices=["zipformer", "paraformer"])
+    parser.add_argument("--threads", type=int, nargs="+", default=[2])
+    parser.add_argument("--block", type=int, default=1280)
+    parser.add_argument("--fp32", action="store_true", help="用 fp32 模型（默认优先 int8）")
+    args = parser.parse_args()
+
+    pcms = [(path, load_wav(path)) for path in args.wavs]
+    block_ms = args.block * 1000 / SAMPLERATE
+    for threads in args.threads:
+        t = time.perf_counter()
+        asr = SherpaASR(args.model_dir, model_type=args.model_type, num_threads=threads, prefer_int8=not args.fp32)
+        print(f"== {args.model_type}，{threads} 线程（加载 {time.perf_counter() - t:.2f}s），块长 {block_ms:.0f}ms")
+        total_audio = total_wall = total_cpu = 0.0
+        for path, pcm in pcms:
+            duration = len(pcm) / SAMPLERATE
+            text, per_block, final_latency, wall, cpu = run(asr, pcm, args.block)
+            total_audio += duration
+            total_wall += wall
+            total_cpu += cpu
+            ms = per_block * 1000
+            print(f"{path}: {duration:.1f}s  RTF {wall / duration:.3f}（CPU {cpu / duration:.3f}）  "
+                  f"每块 P50 {np.percentile(ms, 50):.1f}ms P95 {np.percentile(ms, 95):.1f}ms 最大 {ms.max():.1f}ms  "
+                  f"收尾 {final_latency * 1000:.0f}ms")
+            print(f"  识别结果: {text}")
+        if total_audio:
+            print(f"合计 {total_audio:.1f}s 音频：RTF {total_wall / total_audio:.3f}，CPU 时间/音频时长 {total_cpu / total_audio:.3f}")
+
+
+if __name__ == "__main__":
+    main()
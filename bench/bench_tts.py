@@ -0,0 +1,78 @@
+"""本地 TTS CPU 基准：首帧延迟与实时率（RTF）。
+
+用法（仓库根目录，树莓派上跑）：
+    python -m bench.bench_tts --model-dir tts/vits-zh-hf-fanchen-C --model vits-zh-hf-fanchen-C.onnx
+    python -m bench.bench_tts --model-dir tts/matcha-icefall-zh-baker --model-type matcha \\
+        --vocoder tts/vocos-22khz-univ.onnx --threads 1 2 4
+    python -m bench.bench_tts --texts replies.txt          # 每行一句
+
+- 首帧延迟：调用 synthesize_stream 到拿到第一帧 PCM 的时间，决定"说完话多久出声"，对比 tts.first_chunk_budget_s
+- RTF = 合成耗时 / 合成音频时长，< 1 才能边合成边播放不断音
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from tts.sherpa_tts import SherpaTTS
+
+DEFAULT_TEXTS = [
+    "好的。",
+    "现在是下午三点二十分。",
+    "明天北京晴，最高气温二十六度，最低十五度，适合出门。",
+    "这个问题可以分三步来看：先确认需求，再比较几种方案的成本，最后挑一个最容易落地的开始做。",
+]
+
+
+def run(tts, text):
+    started = time.perf_counter()
+    cpu_start = time.process_time()
+    first = None
+    samples = 0
+    for chunk in tts.synthesize_stream(text):
+        if first is None:
+            first = time.perf_counter() - started
+        samples += len(chunk) // 2
+    wall = time.perf_counter() - started
+    cpu = time.process_time() - cpu_start
+    return first or wall, wall, cpu, samples / tts.samplerate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 TTS 首帧延迟与实时率基准")
+    parser.add_argument("--model-dir", required=True)
+    parser.add_argument("--model-type", default="vits", choices=["vits", "matcha"])
+    parser.add_argument("--model")
+    parser.add_argument("--vocoder")
+    parser.add_argument("--sid", type=int, default=0)
+    parser.add_argument("--threads", type=int, nargs="+", default=[2])
+    parser.add_argument("--texts", help="文本文件，每行一句；缺省用内置的几句长短不一的回复")
+    args = parser.parse_args()
+
+    texts = DEFAULT_TEXTS
+    if args.texts:
+        with open(args.texts, "r", encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+
+    for threads in args.threads:
+        t = time.perf_counter()
+        tts = SherpaTTS(args.model_dir, model_type=args.model_type, model=args.model, vocoder=args.vocoder,
+                        sid=args.sid, num_threads=threads)
+        print(f"== {args.model_type}，{threads} 线程，{tts.samplerate}Hz（加载 {time.perf_counter() - t:.2f}s）")
+        run(tts, "预热。")  # 首次推理含内存分配与图优化，不计入
+        firsts, total_wall, total_cpu, total_audio = [], 0.0, 0.0, 0.0
+        for text in texts:
+            first, wall, cpu, duration = run(tts, text)
+            firsts.append(first * 1000)
+            total_wall += wall
+            total_cpu += cpu
+            total_audio += duration
+            print(f"{len(text):>3}字  首帧 {first * 1000:6.0f}ms  合成 {wall * 1000:6.0f}ms  "
+                  f"音频 {duration:5.2f}s  RTF {wall / max(duration, 1e-6):.3f}  {text[:20]}")
+        print(f"首帧 P50 {np.percentile(firsts, 50):.0f}ms 最大 {max(firsts):.0f}ms；"
+              f"合计 RTF {total_wall / total_audio:.3f}，CPU 时间/音频时长 {total_cpu / total_audio:.3f}")
+
+
+if __name__ == "__main__":
+    main()
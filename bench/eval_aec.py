@@ -0,0 +1,106 @@
+"""回声消除离线评测：在录好的测试文件上测 ERLE（回声回波损耗增强）。
+
+准备数据：让音箱播放一段参考音频 ref.wav，同时用麦克风录下 mic.wav（期间不要说话，
+可在后半段加一句人声测双讲），例如：
+    aplay -D <输出设备> ref.wav & arecord -D <麦克风> -r 16000 -c 1 -f S16_LE -d 20 mic.wav
+
+用法（仓库根目录）：
+    python -m bench.eval_aec mic.wav ref.wav
+    python -m bench.eval_aec mic.wav ref.wav --tail-ms 300 --mu 0.3 --out cleaned.wav
+
+两个文件的起点不必对齐：先用互相关估出整体延迟（即配置里 input_latency_ms 的参考值）再对齐。
+输出每秒 ERLE 曲线、收敛后的稳态 ERLE 以及双讲阈值建议。
+"""
+
+import argparse
+import wave
+
+import numpy as np
+
+from audio_in.aec import EchoCanceller
+from bench.eval_vad import load_wav
+
+SAMPLERATE = 16000
+BLOCK = 1280
+
+
+def estimate_delay(mic, ref, max_delay_s=1.0):
+    """互相关估计回声相对参考的延迟（样点）。"""
+    n = 1 << int(np.ceil(np.log2(len(mic) + len(ref))))
+    corr = np.fft.irfft(np.fft.rfft(mic, n) * np.conj(np.fft.rfft(ref, n)), n)
+    max_lag = int(max_delay_s * SAMPLERATE)
+    return int(np.argmax(np.abs(corr[:max_lag])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回声消除 ERLE 离线评测")
+    parser.add_argument("mic_wav", help="麦克风录音（含回声）")
+    parser.add_argument("ref_wav", help="播放的参考音频")
+    parser.add_argument("--tail-ms", type=float, default=200)
+    parser.add_argument("--mu", type=float, default=0.5)
+    parser.add_argument("--lead-ms", type=float, default=30.0)
+    parser.add_argument("--dtd-ratio", type=float, default=0.5, help="双讲阈值，<=0 关闭")
+    parser.add_argument("--delay-ms", type=float, help="手动指定延迟，缺省自动估计")
+    parser.add_argument("--out", help="把消除后的信号写成 WAV")
+    args = parser.parse_args()
+
+    mic = load_wav(args.mic_wav).astype(np.float32)
+    ref = load_wav(args.ref_wav).astype(np.float32)
+    if args.delay_ms is not None:
+        delay = int(args.delay_ms * SAMPLERATE / 1000)
+    else:
+        delay = estimate_delay(mic, ref)
+    print(f"回声延迟 {delay * 1000 / SAMPLERATE:.1f}ms（{delay} 样点）")
+
+    # 与实时链路一致：参考比回声提前 lead_ms，回声路径落在滤波器的因果区间内
+    shift = delay - int(args.lead_ms * SAMPLERATE / 1000)
+    aligned = np.zeros_like(mic)
+    if shift >= 0:
+        seg = ref[:len(mic) - shift]
+        aligned[shift:shift + len(seg)] = seg
+    else:
+        seg = ref[-shift:-shift + len(mic)]
+        aligned[:len(seg)] = seg
+
+    aec = EchoCanceller(None, samplerate=SAMPLERATE, tail_ms=args.tail_ms, mu=args.mu,
+                        dtd_ratio=args.dtd_ratio if args.dtd_ratio > 0 else None)
+    mic16 = np.clip(mic, -32768, 32767).astype(np.int16)
+    ref16 = np.clip(aligned, -32768, 32767).astype(np.int16)
+    out = np.concatenate([
+        aec.process(mic16[i:i + BLOCK], ref=ref16[i:i + BLOCK])
+        for i in range(0, len(mic16) - BLOCK + 1, BLOCK)
+    ]).astype(np.float32)
+
+    print("秒    ERLE(dB)  参考能量(dBFS)")
+    erle = []
+    for s in range(len(out) // SAMPLERATE):
+        seg = slice(s * SAMPLERATE, (s + 1) * SAMPLERATE)
+        ref_db = 10 * np.log10(np.mean((aligned[seg] / 32768.0) ** 2) + 1e-12)
+        value = 10 * np.log10((np.sum(mic[seg] ** 2) + 1e-6) / (np.sum(out[seg] ** 2) + 1e-6))
+        erle.append(value if ref_db > -60 else np.nan)
+        print(f"{s:<5} {value:8.1f}  {ref_db:8.1f}")
+    steady = np.array(erle[2:]) if len(erle) > 2 else np.array(erle)
+    print(f"稳态 ERLE（2 秒后中位数）: {np.nanmedian(steady):.1f}dB  累计: {aec.erle_db():.1f}dB  "
+          f"双讲块数: {aec.doubletalk_blocks}")
+
+    # 双讲阈值建议：纯回声时麦克风峰值/参考峰值的 P99 再留 20% 余量
+    ratios = []
+    window = int(args.tail_ms * SAMPLERATE / 1000)
+    for i in range(window, len(mic) - 160, 160):
+        far = np.abs(aligned[i - window:i + 160]).max()
+        if far > 300:
+            ratios.append(np.abs(mic[i:i + 160]).max() / far)
+    if ratios:
+        print(f"双讲阈值建议（仅在无人说话的录音上有效）: dtd_ratio ≈ {np.percentile(ratios, 99) * 1.2:.2f}")
+
+    if args.out:
+        with wave.open(args.out, "wb") as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(SAMPLERATE)
+            wf.writeframes(np.clip(out, -32768, 32767).astype(np.int16).tobytes())
+        print(f"已写出 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""VAD 离线评测：在标注好的 WAV 上比较各 VAD 的端点延迟与截断率。
+
+数据格式：每个 foo.wav 旁放一个同名 foo.txt（Audacity 标签格式，每行"起始秒<TAB>结束秒[<TAB>标签]"），
+标出说话段；以第一段起点为真实开口、最后一段终点为真实说完。
+
+用法（仓库根目录）：
+    python -m bench.eval_vad data/vad_wavs --block 1200
+    python -m bench.eval_vad data/vad_wavs --silero audio_in/silero_vad.onnx
+
+指标：
+- 端点延迟：判定说完的时刻 - 真实说完时刻（越小，用户等得越短）
+- 截断率：在真实说完之前就判定结束（会吞掉后半句）或始终未判定开口的比例
+"""
+
+import argparse
+import glob
+import os
+import wave
+
+import numpy as np
+
+from audio_in.vad import Endpointer, EnergyVAD, SileroVAD, ThresholdVAD
+from utils.resample import make_resampler
+
+SAMPLERATE = 16000
+
+
+def load_wav(path):
+    with wave.open(path, "rb") as wf:
+        rate = wf.getframerate()
+        channels = wf.getnchannels()
+        pcm = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+    if channels > 1:
+        pcm = pcm.reshape(-1, channels).astype(np.float32).mean(axis=1).astype(np.int16)
+    resampler = make_resampler(rate, SAMPLERATE)
+    return resampler.process(pcm).copy() if resampler else pcm
+
+
+def load_labels(path):
+    spans = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2:
+                spans.append((float(parts[0]), float(parts[1])))
+    return min(s for s, _ in spans), max(e for _, e in spans)
+
+
+def run_vad(vad, pcm, block, onset_ms, endpoint_ms):
+    """模拟录音循环：返回 (开口时刻, 说完时刻)，未判定为 None。"""
+    vad.reset()
+    endpointer = Endpointer(onset_ms=onset_ms, endpoint_ms=endpoint_ms)
+    onset = end = None
+    for offset in range(0, len(pcm) - block + 1, block):
+        event = endpointer.update(vad.process(pcm[offset:offset + block]), vad.frame_ms)
+        t = (offset + block) / SAMPLERATE
+        if event == "onset":
+            onset = t
+        elif event == "end":
+            end = t
+            break
+    return onset, end
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VAD 离线评测")
+    parser.add_argument("wav_dir")
+    parser.add_argument("--block", type=int, default=1200, help="录音块长（样点）")
+    parser.add_argument("--threshold", type=float, default=2000, help="固定阈值 VAD 的阈值")
+    parser.add_argument("--silence-duration", type=float, default=2.0, help="固定阈值 VAD 的静音时长（秒）")
+    parser.add_argument("--endpoint-ms", type=float, default=700)
+    parser.add_argument("--onset-ms", type=float, default=150)
+    parser.add_argument("--silero", help="silero_vad.onnx 路径（可选）")
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(args.wav_dir, "*.wav")))
+    data = []
+    for path in files:
+        label = os.path.splitext(path)[0] + ".txt"
+        if os.path.exists(label):
+            data.append((os.path.basename(path), load_wav(path), load_labels(label)))
+    if not data:
+        print("没有找到带标注的 WAV")
+        return
+
+    candidates = [
+        ("threshold", lambda: ThresholdVAD(SAMPLERATE, args.threshold), args.silence_duration * 1000),
+        ("energy", lambda: EnergyVAD(SAMPLERATE), args.endpoint_ms),
+    ]
+    if args.silero:
+        candidates.append(("silero", lambda: SileroVAD(args.silero, SAMPLERATE), args.endpoint_ms))
+
+    print(f"{len(data)} 条标注音频，块长 {args.block} 样点")
+    for name, factory, endpoint_ms in candidates:
+        latencies = []
+        truncated = 0
+        for _, pcm, (_, true_end) in data:
+            vad = factory()  # 每条音频独立评测，噪声底不跨文件继承
+            onset, end = run_vad(vad, pcm, args.block, args.onset_ms, endpoint_ms)
+            if onset is None or (end is not None and end < true_end):
+                truncated += 1
+                continue
+            # 到文件末尾仍未判定结束：按音频总长计，说明尾部静音不足
+            end = end if end is not None else len(pcm) / SAMPLERATE
+            latencies.append((end - true_end) * 1000)
+        lat = np.array(latencies) if latencies else np.array([np.nan])
+        print(f"{name:<10} 端点延迟 均值 {np.nanmean(lat):7.0f}ms  P50 {np.nanpercentile(lat, 50):7.0f}ms  "
+              f"P90 {np.nanpercentile(lat, 90):7.0f}ms   截断率 {truncated / len(data) * 100:5.1f}%")
+
+
+if __name__ == "__main__":
+    main()
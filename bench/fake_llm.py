@@ -0,0 +1,198 @@
+"""本地 OpenAI 兼容大模型模拟服务：给 DeepseekAdapter 用，不需要 API Key 与网络。
+
+用法（仓库根目录）：
+    python -m bench.fake_llm --port 8766 --first-token 0.5 --tps 30
+    # 然后在配置里把 deepseek.api_url 改成 http://127.0.0.1:8766
+
+- POST /chat/completions：流式（SSE，末尾带 usage 分片）与非流式都支持；GET /models 供连接预热
+- 首个 token 在 first_token_delay_s 秒后下发，之后每秒 tokens_per_s 个（每个 token 两个字）
+- usage 里按 DeepSeek 的字段给出 prompt_cache_hit_tokens / prompt_cache_miss_tokens：
+  与之前请求的最长公共前缀（按 64 token 取整）算作命中，可用来观察上下文前缀是否稳定
+- error_rate 为按概率返回 HTTP 500 的比例
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dialogue.context_manager import estimate_tokens
+from utils.logger import logger
+
+DEFAULT_REPLY = "明天北京晴，最高气温二十六度，最低十五度。早晚温差比较大，出门记得带件外套。适合户外活动。"
+CACHE_UNIT_TOKENS = 64  # DeepSeek 上下文缓存的存储单元
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive，与 DeepseekAdapter 的连接复用一致
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [
+                {"id": "deepseek-chat", "object": "model", "created": 0, "owned_by": "bench"}]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        server = self.server.owner
+        cpu_start = time.thread_time()
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+            elif server.fail():
+                self._send_json(500, {"error": {"message": "模拟错误", "type": "server_error"}})
+            elif body.get("stream"):
+                self._stream(server, body)
+            else:
+                self._complete(server, body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # 客户端提前断开（打断、对冲落败）
+        finally:
+            server.add_cpu(time.thread_time() - cpu_start)
+
+    def _complete(self, server, body):
+        usage = server.usage(body.get("messages", []))
+        time.sleep(server.first_token_delay_s + len(server.tokens()) / server.tokens_per_s)
+        self._send_json(200, {
+            "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model", "deepseek-chat"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": server.reply}}],
+            "usage": usage,
+        })
+
+    def _write_chunk(self, payload):
+        data = f"data: {payload}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream(self, server, body):
+        usage = server.usage(body.get("messages", []))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        started = time.monotonic() + server.first_token_delay_s
+        base = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": body.get("model", "deepseek-chat")}
+        for i, token in enumerate(server.tokens()):
+            delay = started + i / server.tokens_per_s - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            delta = {"content": token} if i else {"role": "assistant", "content": token}
+            self._write_chunk(json.dumps(dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": None}]),
+                                         ensure_ascii=False))
+        self._write_chunk(json.dumps(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self._write_chunk(json.dumps(dict(base, choices=[], usage=usage)))
+        self._write_chunk("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class FakeLLMServer:
+    def __init__(self, host="127.0.0.1", port=0, reply=DEFAULT_REPLY, first_token_delay_s=0.5, tokens_per_s=30.0,
+                 error_rate=0.0, seed=None):
+        self.reply = reply
+        self.first_token_delay_s = first_token_delay_s
+        self.tokens_per_s = tokens_per_s
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.cpu_s = 0.0
+        self._prompts = []  # 最近几次请求的序列化提示，用来模拟前缀缓存
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.owner = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-llm", daemon=True)
+        self._thread.start()
+        logger.info(f"大模型模拟服务已启动：{self.base_url}")
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def add_cpu(self, seconds):
+        with self._lock:
+            self.cpu_s += seconds
+
+    def stats(self):
+        return {"requests": self.requests, "errors": self.errors, "cpu_s": round(self.cpu_s, 3)}
+
+    def fail(self):
+        with self._lock:
+            self.requests += 1
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.errors += 1
+                return True
+        return False
+
+    def tokens(self):
+        return [self.reply[i:i + 2] for i in range(0, len(self.reply), 2)]
+
+    def usage(self, messages):
+        """按与之前请求的最长公共前缀估算缓存命中，字段与 DeepSeek 一致。"""
+        prompt = json.dumps(messages, ensure_ascii=False)
+        with self._lock:
+            common = max((_common_prefix(prompt, p) for p in self._prompts), default=0)
+            self._prompts = (self._prompts + [prompt])[-8:]
+        total = estimate_tokens(prompt)
+        hit = min(total, estimate_tokens(prompt[:common]) // CACHE_UNIT_TOKENS * CACHE_UNIT_TOKENS)
+        completion = estimate_tokens(self.reply)
+        return {"prompt_tokens": total, "completion_tokens": completion, "total_tokens": total + completion,
+                "prompt_cache_hit_tokens": hit, "prompt_cache_miss_tokens": total - hit}
+
+
+def _common_prefix(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容大模型模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--reply", default=DEFAULT_REPLY)
+    parser.add_argument("--first-token", type=float, default=0.5, help="首个 token 延迟（秒）")
+    parser.add_argument("--tps", type=float, default=30.0, help="每秒 token 数")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server = FakeLLMServer(host=args.host, port=args.port, reply=args.reply, first_token_delay_s=args.first_token,
+                           tokens_per_s=args.tps, error_rate=args.error_rate).start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
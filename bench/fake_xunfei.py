@@ -0,0 +1,302 @@
+"""本地讯飞模拟服务：按讯飞听写（IAT v2）与流式合成（TTS v2）的 websocket 协议应答，不需要账号与网络。
+
+用法（仓库根目录）：
+    python -m bench.fake_xunfei --port 8765 --text "明天北京天气怎么样"
+    # 然后在配置里把 xunfei_asr.ws_url / xunfei.ws_url 改成
+    #   ws://127.0.0.1:8765/v2/iat 与 ws://127.0.0.1:8765/v2/tts
+
+- 听写：开口后（音频块 RMS 超过 speech_rms）每收到 partial_ms 音频下发一次中间结果（wpgs 整段替换，
+  逐字多露出一点），收到尾帧后
+  final_delay_s 秒下发最终结果 text；不做真正的识别，回放时由驱动按录音设置 text
+- 合成：收到请求 first_chunk_delay_s 秒后开始下发，按每字 1/chars_per_s 秒估算音频时长，
+  每 chunk_ms 一帧，合成速度为实时的 1/rtf；音频是低音量正弦音
+- error_rate 为按概率返回错误码的比例；connect_delay_s 模拟握手耗时
+- 不校验鉴权参数；cpu_s 统计服务线程自身的 CPU 时间，供基准从总 CPU 中扣除
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import random
+import socketserver
+import struct
+import threading
+import time
+from urllib.parse import urlparse
+
+import numpy as np
+
+from utils.logger import logger
+
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+_OP_TEXT, _OP_CLOSE, _OP_PING, _OP_PONG = 0x1, 0x8, 0x9, 0xA
+# 16k 单声道 16bit PCM 每秒字节数
+BYTES_PER_SECOND = 32000
+
+
+class WebSocketClosed(Exception):
+    pass
+
+
+class WebSocketConnection:
+    """最小的服务端 websocket（RFC 6455）：只处理不分片的文本帧、ping 与关闭。"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.closed = False
+
+    def _read_exact(self, n):
+        data = b""
+        while len(data) < n:
+            chunk = self.sock.recv(n - len(data))
+            if not chunk:
+                raise WebSocketClosed()
+            data += chunk
+        return data
+
+    def recv(self):
+        """读取下一条文本消息；对方关闭时抛出 WebSocketClosed。"""
+        while True:
+            head = self._read_exact(2)
+            opcode = head[0] & 0x0F
+            length = head[1] & 0x7F
+            if length == 126:
+                length = struct.unpack(">H", self._read_exact(2))[0]
+            elif length == 127:
+                length = struct.unpack(">Q", self._read_exact(8))[0]
+            mask = self._read_exact(4) if head[1] & 0x80 else None
+            payload = self._read_exact(length)
+            if mask:
+                key = np.frombuffer(mask, dtype=np.uint8)
+                data = np.frombuffer(payload, dtype=np.uint8)
+                payload = (data ^ np.resize(key, len(data))).tobytes()
+            if opcode == _OP_CLOSE:
+                self.close()
+                raise WebSocketClosed()
+            if opcode == _OP_PING:
+                self._send_frame(_OP_PONG, payload)
+                continue
+            if opcode == _OP_TEXT:
+                return payload.decode("utf-8")
+
+    def _send_frame(self, opcode, payload):
+        head = bytes([0x80 | opcode])
+        if len(payload) < 126:
+            head += bytes([len(payload)])
+        elif len(payload) < 65536:
+            head += bytes([126]) + struct.pack(">H", len(payload))
+        else:
+            head += bytes([127]) + struct.pack(">Q", len(payload))
+        self.sock.sendall(head + payload)
+
+    def send(self, message):
+        if self.closed:
+            raise WebSocketClosed()
+        try:
+            self._send_frame(_OP_TEXT, json.dumps(message, ensure_ascii=False).encode("utf-8"))
+        except OSError:
+            self.closed = True
+            raise WebSocketClosed()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._send_frame(_OP_CLOSE, struct.pack(">H", 1000))
+        except OSError:
+            pass
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server.owner
+        cpu_start = time.thread_time()
+        try:
+            path = self._handshake(server.connect_delay_s)
+            if path is None:
+                return
+            ws = WebSocketConnection(self.request)
+            if path.endswith("/iat"):
+                server.serve_iat(ws)
+            elif path.endswith("/tts"):
+                server.serve_tts(ws)
+            ws.close()
+        except (WebSocketClosed, OSError):
+            pass
+        finally:
+            server.add_cpu(time.thread_time() - cpu_start)
+
+    def _handshake(self, delay_s):
+        data = b""
+        while b"\r\n\r\n" not in data:
+            chunk = self.request.recv(4096)
+            if not chunk:
+                return None
+            data += chunk
+        lines = data.split(b"\r\n\r\n", 1)[0].decode("latin-1").split("\r\n")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        key = headers.get("sec-websocket-key", "")
+        accept = base64.b64encode(hashlib.sha1((key + _WS_GUID).encode()).digest()).decode()
+        if delay_s:
+            time.sleep(delay_s)
+        self.request.sendall(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                              f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+        return urlparse(lines[0].split(" ")[1]).path
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeXunfeiServer:
+    def __init__(self, host="127.0.0.1", port=0, text="明天北京天气怎么样", partial_ms=300, final_delay_s=0.15,
+                 first_chunk_delay_s=0.2, chunk_ms=40, rtf=0.3, chars_per_s=4.5, error_rate=0.0,
+                 connect_delay_s=0.0, speech_rms=500, samplerate=16000, seed=None):
+        self.text = text  # 听写返回的文本；回放驱动每轮按录音设置
+        self.partial_ms = partial_ms
+        self.final_delay_s = final_delay_s
+        self.first_chunk_delay_s = first_chunk_delay_s
+        self.chunk_ms = chunk_ms
+        self.rtf = rtf
+        self.chars_per_s = chars_per_s
+        self.error_rate = error_rate
+        self.connect_delay_s = connect_delay_s
+        self.speech_rms = speech_rms  # 静音期间不下发中间结果
+        self.samplerate = samplerate
+        self.random = random.Random(seed)
+        self.iat_sessions = 0
+        self.tts_sessions = 0
+        self.errors = 0
+        self.cpu_s = 0.0
+        self._cpu_lock = threading.Lock()
+        self._server = _TCPServer((host, port), _Handler)
+        self._server.owner = self
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address[:2]
+
+    def url(self, path):
+        host, port = self.address
+        return f"ws://{host}:{port}{path}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-xunfei", daemon=True)
+        self._thread.start()
+        logger.info(f"讯飞模拟服务已启动：{self.url('/v2/iat')}  {self.url('/v2/tts')}")
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def add_cpu(self, seconds):
+        with self._cpu_lock:
+            self.cpu_s += seconds
+
+    def stats(self):
+        return {"iat_sessions": self.iat_sessions, "tts_sessions": self.tts_sessions,
+                "errors": self.errors, "cpu_s": round(self.cpu_s, 3)}
+
+    def _fail(self):
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.errors += 1
+            return True
+        return False
+
+    # ---- 听写 ----
+
+    def _iat_result(self, text, status, sn):
+        words = [{"bg": 0, "cw": [{"w": ch, "sc": 0}]} for ch in text]
+        return {"code": 0, "message": "success", "sid": f"iat{self.iat_sessions:06d}",
+                "data": {"status": status, "result": {"sn": sn, "ls": status == 2, "pgs": "rpl",
+                                                      "rg": [1, max(1, sn - 1)], "ws": words}}}
+
+    def serve_iat(self, ws):
+        self.iat_sessions += 1
+        text = self.text
+        received = 0  # 开口后收到的字节数
+        next_partial = self.partial_ms * BYTES_PER_SECOND / 1000.0 if self.partial_ms else None
+        shown = 0
+        sn = 1
+        while True:
+            frame = json.loads(ws.recv())
+            data = frame.get("data", {})
+            audio = np.frombuffer(base64.b64decode(data.get("audio", "")), dtype=np.int16)
+            if received or (len(audio) and np.sqrt(np.mean(audio.astype(np.float32) ** 2)) >= self.speech_rms):
+                received += audio.nbytes
+            if data.get("status") == 2:
+                break
+            if next_partial is not None and received >= next_partial and shown < len(text) - 1:
+                next_partial += self.partial_ms * BYTES_PER_SECOND / 1000.0
+                shown += 1
+                ws.send(self._iat_result(text[:shown], 0 if sn == 1 else 1, sn))
+                sn += 1
+        time.sleep(self.final_delay_s)
+        if self._fail():
+            ws.send({"code": 10165, "message": "模拟错误：invalid handle", "sid": "iat-error"})
+            return
+        ws.send(self._iat_result(text, 2, sn))
+
+    # ---- 合成 ----
+
+    def _tone(self, seconds):
+        t = np.arange(int(seconds * self.samplerate)) / self.samplerate
+        return (np.sin(2 * np.pi * 440 * t) * 3000).astype(np.int16).tobytes()
+
+    def serve_tts(self, ws):
+        self.tts_sessions += 1
+        request = json.loads(ws.recv())
+        text = base64.b64decode(request.get("data", {}).get("text", "")).decode("utf-8")
+        started = time.monotonic()
+        time.sleep(self.first_chunk_delay_s)
+        if self._fail():
+            ws.send({"code": 10163, "message": "模拟错误：engine error", "sid": "tts-error"})
+            return
+        pcm = self._tone(max(0.2, len(text) / self.chars_per_s))
+        chunk_bytes = int(self.chunk_ms * BYTES_PER_SECOND / 1000) & ~1
+        sent_s = 0.0
+        for i in range(0, len(pcm), chunk_bytes):
+            chunk = pcm[i:i + chunk_bytes]
+            last = i + chunk_bytes >= len(pcm)
+            # 按合成速度节流：第 n 帧不早于 首帧时刻 + 已下发音频时长 × rtf
+            delay = started + self.first_chunk_delay_s + sent_s * self.rtf - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            ws.send({"code": 0, "message": "success", "sid": f"tts{self.tts_sessions:06d}",
+                     "data": {"audio": base64.b64encode(chunk).decode("ascii"), "status": 2 if last else 1,
+                              "ced": str(len(text))}})
+            sent_s += len(chunk) / BYTES_PER_SECOND
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地讯飞听写/流式合成模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--text", default="明天北京天气怎么样", help="听写固定返回的文本")
+    parser.add_argument("--partial-ms", type=int, default=300, help="每收到多少毫秒音频下发一次中间结果，0 为不下发")
+    parser.add_argument("--final-delay", type=float, default=0.15, help="收到尾帧到下发最终结果的秒数")
+    parser.add_argument("--first-chunk-delay", type=float, default=0.2, help="合成首帧延迟（秒）")
+    parser.add_argument("--rtf", type=float, default=0.3, help="合成耗时/音频时长")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server = FakeXunfeiServer(host=args.host, port=args.port, text=args.text, partial_ms=args.partial_ms,
+                              final_delay_s=args.final_delay, first_chunk_delay_s=args.first_chunk_delay,
+                              rtf=args.rtf, error_rate=args.error_rate).start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
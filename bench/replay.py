@@ -0,0 +1,361 @@
+"""端到端回放基准：录音 → Recorder → XunfeiASR.recognize_stream → DialogueRouter → XunfeiTTSStream → 播放端。
+
+讯飞与大模型换成本地模拟服务（bench/fake_xunfei.py、bench/fake_llm.py），不需要麦克风、音箱和云端账号。
+
+用法（仓库根目录）：
+    python -m bench.replay 录音1.wav 录音2.wav --runs 3
+    python -m bench.replay 录音*.wav --save-baseline bench/baseline.json     # 记为基线
+    python -m bench.replay 录音*.wav --baseline bench/baseline.json          # 与基线对比，有退化时退出码为 1
+    python -m bench.replay 录音.wav --llm-first-token 1.5 --tts-rtf 0.8 --error-rate 0.1
+
+- 录音（可多声道，走与真机相同的前端）按实时（--speed 倍速）逐块写入采集缓冲区，前面补 --lead-in 秒、
+  录完后一直补低噪声，和真麦克风一样靠 VAD 判断开口与说完
+- 同名 .txt 为该录音的识别文本（模拟服务原样返回），没有则用默认问题；多个录音在一次运行中是连续的多轮对话
+- 每轮用 utils.tracing 打点，按其 STAGES 统计各阶段 P50/P90；播放端按实时消费音频（--playback-speed 0 不限速）
+- CPU：进程 CPU 时间扣除模拟服务线程自身的部分，即流水线本身的开销
+- 录音前端、VAD、上下文与 system prompt 取自 --config（默认 config/config_example.yaml）
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+import numpy as np
+
+from asr.xunfei_asr import XunfeiASR
+from audio_in.capture import CaptureHub
+from audio_in.recorder import Recorder
+from audio_in.vad import create_vad, vad_endpoint_ms
+from bench.fake_llm import FakeLLMServer
+from bench.fake_xunfei import FakeXunfeiServer
+from dialogue.context_manager import create_context
+from dialogue.deepseek_adapter import DeepseekAdapter
+from dialogue.router import DialogueRouter
+from tts.speech_stream import ReplyReader, split_sentences, synthesize_sentences
+from tts.xunfei_stream import XunfeiTTSStream
+from utils.config_loader import load_config
+from utils.logger import logger
+from utils.tracing import STAGES, load_traces, percentile, stage_ms, tracer
+
+DEFAULT_TEXT = "明天北京天气怎么样"
+NOISE_STD = 10  # 补静音用的底噪（约 -70dBFS），全零会让自适应 VAD 的噪声底失真
+
+
+def load_capture(path):
+    """读取 16bit WAV，返回 ((帧数, 声道) int16 数组, 采样率)。"""
+    with wave.open(path, "rb") as wf:
+        if wf.getsampwidth() != 2:
+            raise ValueError(f"{path}: 只支持 16bit PCM WAV")
+        rate = wf.getframerate()
+        channels = wf.getnchannels()
+        pcm = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+    return pcm.reshape(-1, channels), rate
+
+
+def load_text(path):
+    txt = os.path.splitext(path)[0] + ".txt"
+    if os.path.exists(txt):
+        with open(txt, "r", encoding="utf-8") as f:
+            return f.read().strip() or DEFAULT_TEXT
+    return DEFAULT_TEXT
+
+
+class WavFeeder:
+    """
+    代替声卡采集线程：把录音按实时节奏逐块写入 CaptureHub 的缓冲区，前后补底噪直到 stop()。
+    speed 为 0 时不限速，但不超前 capture 订阅两块以上，按流水线能处理的最快速度送。
+    """
+
+    def __init__(self, hub, pcm, capture, speed=1.0, lead_in_s=0.5):
+        self.hub = hub
+        self.pcm = pcm
+        self.capture = capture
+        self.speed = speed
+        self.lead_in = int(lead_in_s * hub.samplerate)
+        self._stop = threading.Event()
+        self._thread = None
+        self._noise = np.random.default_rng(0)
+
+    def _blocks(self):
+        size, channels = self.hub.block_size, self.hub.channels
+        noise = lambda: self._noise.normal(0, NOISE_STD, (size, channels)).astype(np.int16)
+        for _ in range(self.lead_in // size):
+            yield noise()
+        for i in range(0, len(self.pcm) - size + 1, size):
+            yield self.pcm[i:i + size]
+        while True:
+            yield noise()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="replay-feeder", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+
+    def _run(self):
+        block_s = self.hub.block_size / self.hub.samplerate
+        started = time.monotonic()
+        for n, block in enumerate(self._blocks()):
+            if self._stop.is_set():
+                return
+            if self.speed:
+                delay = started + n * block_s / self.speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                while self.capture.depth() >= 2 and not self.capture.closed and not self._stop.is_set():
+                    time.sleep(0.001)
+            self.hub.ring.push(block, time.monotonic())
+
+
+class PlaybackSink:
+    """播放端替身：按实时节奏消费 PCM（speed 为 0 时不限速），打首个样点与播放结束的点，可写入 WAV。"""
+
+    def __init__(self, samplerate, speed=1.0):
+        self.samplerate = samplerate
+        self.speed = speed
+
+    def play(self, chunks, out_path=None):
+        pcm = []
+        started = None
+        played = 0.0
+        for chunk in chunks:
+            if started is None:
+                started = time.monotonic()
+                tracer.mark("audio.first_sample")
+            if out_path:
+                pcm.append(chunk)
+            played += len(chunk) / 2 / self.samplerate
+            if self.speed:
+                delay = started + played / self.speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+        tracer.mark("playback.end")
+        if out_path and pcm:
+            with wave.open(out_path, "wb") as wf:
+                wf.setnchannels(1)
+                wf.setsampwidth(2)
+                wf.setframerate(self.samplerate)
+                wf.writeframes(b"".join(pcm))
+        return played
+
+
+class ReplayPipeline:
+    """与 main.py 相同的对话链路，只是各端点换成本地模拟服务、麦克风与音箱换成文件。"""
+
+    def __init__(self, config, xunfei, llm, channels, capture_samplerate, args):
+        audio_cfg = config.get("audio_in", {})
+        vad_cfg = audio_cfg.get("vad", {})
+        samplerate = audio_cfg.get("samplerate", 16000)
+        block_size = audio_cfg.get("block_size", 1280)
+        self.xunfei = xunfei
+        self.args = args
+        self.hub = CaptureHub(samplerate=capture_samplerate, channels=channels, dtype="int16",
+                              block_size=int(block_size * capture_samplerate / samplerate),
+                              buffer_s=audio_cfg.get("buffer_s", 4.0))
+        self.hub._ready.set()  # 不启动采集线程，由 WavFeeder 直接写缓冲区
+        self.recorder = Recorder(
+            samplerate=samplerate, channels=channels, block_size=block_size,
+            max_record_time=audio_cfg.get("max_record_time", 15),
+            silence_threshold=audio_cfg.get("silence_threshold", 2000),
+            silence_duration=audio_cfg.get("silence_duration", 2.0),
+            capture_samplerate=capture_samplerate,
+            vad=create_vad(vad_cfg, samplerate=samplerate, silence_threshold=audio_cfg.get("silence_threshold", 2000)),
+            onset_ms=vad_cfg.get("onset_ms", 150), endpoint_ms=vad_endpoint_ms(vad_cfg),
+            hub=self.hub, frontend_cfg=audio_cfg.get("frontend", {}),
+        )
+        self.asr = XunfeiASR("bench", "bench", "bench", ws_url=xunfei.url("/v2/iat"))
+        ds_cfg = config.get("deepseek", {})
+        self.deepseek = DeepseekAdapter(api_key="bench", base_url=llm.base_url,
+                                        system_prompt=ds_cfg.get("system_prompt", ""))
+        self.dialogue = DialogueRouter(self.deepseek, codex_adapter=None, enabled=False)
+        self.context = create_context(config.get("context", {}), summarizer=self.deepseek.summarize)
+        self.tts = XunfeiTTSStream("bench", "bench", "bench", ws_url=xunfei.url("/v2/tts"))
+        self.sink = PlaybackSink(self.tts.samplerate, speed=args.playback_speed)
+
+    def turn(self, path, pcm, run):
+        """跑一轮，返回是否成功（识别出文本且朗读完成）。"""
+        self.xunfei.text = load_text(path)
+        name = os.path.basename(path)
+        tracer.begin("replay")
+        capture = self.recorder.open_capture("replay")
+        feeder = WavFeeder(self.hub, pcm, capture, speed=self.args.speed, lead_in_s=self.args.lead_in).start()
+        try:
+            user_text = self.asr.recognize_stream(self.recorder.record_stream(capture=capture))
+        finally:
+            feeder.stop()
+        if not user_text:
+            tracer.end(wav=name, run=run, ok=False, failed=self.asr.failed or "empty")
+            return False
+        self.context.append({"role": "user", "content": user_text})
+        reply = ReplyReader(self.dialogue.chat_stream(context=self.context.window()))
+        out_path = None
+        if self.args.out_dir:
+            out_path = os.path.join(self.args.out_dir, f"{os.path.splitext(name)[0]}.run{run}.reply.wav")
+        try:
+            self.sink.play(synthesize_sentences(split_sentences(reply), self.tts), out_path)
+            ok = True
+        except Exception as e:
+            logger.warning(f"回放朗读失败: {e}")
+            ok = False
+        self.context.append({"role": "assistant", "content": reply.wait(timeout=30)})
+        tracer.end(wav=name, run=run, ok=ok)
+        return ok
+
+    def close(self):
+        self.hub.close()
+
+
+# ---- 统计与基线 ----
+
+def summarize(records):
+    stages = {}
+    for name, start, end in STAGES:
+        values = [v for v in (stage_ms(r, start, end) for r in records) if v is not None]
+        if values:
+            stages[name] = {"n": len(values), "p50": round(percentile(values, 50), 1),
+                            "p90": round(percentile(values, 90), 1)}
+    return stages
+
+
+def print_report(result):
+    print(f"{'阶段':<16}{'次数':>6}{'P50':>9}{'P90':>9}  (ms)")
+    for name, s in result["stages"].items():
+        print(f"{name:<16}{s['n']:>6}{s['p50']:>9.0f}{s['p90']:>9.0f}")
+    cpu = result["cpu"]
+    print(f"轮数 {result['turns']}（失败 {result['failed']}），录音 {result['audio_s']:.1f}s，用时 {result['wall_s']:.1f}s")
+    print(f"流水线 CPU {cpu['pipeline_s']:.2f}s（平均占用 {cpu['utilization']:.0%} 单核，每轮 {cpu['per_turn_ms']:.0f}ms），"
+          f"模拟服务 {cpu['stubs_s']:.2f}s")
+    xunfei, llm = result["stubs"]["xunfei"], result["stubs"]["llm"]
+    print(f"模拟服务：听写{xunfei['iat_sessions']}次 合成{xunfei['tts_sessions']}次 大模型{llm['requests']}次，"
+          f"注入错误 讯飞{xunfei['errors']}次 大模型{llm['errors']}次")
+
+
+def compare(result, baseline, tolerance, min_ms):
+    """与基线逐项对比；P50 比基线慢 tolerance 以上且超过 min_ms 记为退化。返回退化项列表。"""
+    if baseline.get("settings") != result["settings"]:
+        print("注意：基线的模拟参数与本次不同，对比仅供参考")
+    regressions = []
+    print(f"\n与基线对比（{baseline.get('created', '?')}）：")
+    print(f"{'阶段':<16}{'基线P50':>9}{'本次P50':>9}{'变化':>9}")
+    rows = [(name, s["p50"], result["stages"][name]["p50"])
+            for name, s in baseline.get("stages", {}).items() if name in result["stages"]]
+    rows.append(("cpu/turn", baseline["cpu"]["per_turn_ms"], result["cpu"]["per_turn_ms"]))
+    for name, old, new in rows:
+        regressed = new > old * (1 + tolerance) and new - old > min_ms
+        if regressed:
+            regressions.append(name)
+        change = f"{(new - old) / old:+.0%}" if old else "-"
+        print(f"{name:<16}{old:>9.0f}{new:>9.0f}{change:>9}{'  退化' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端回放基准（本地模拟讯飞与大模型）")
+    parser.add_argument("wavs", nargs="+")
+    parser.add_argument("--config", default="config/config_example.yaml")
+    parser.add_argument("--runs", type=int, default=1, help="整组录音重复几遍（每遍是一段新对话）")
+    parser.add_argument("--speed", type=float, default=1.0, help="录音送入倍速，0 为不限速")
+    parser.add_argument("--playback-speed", type=float, default=1.0, help="播放端消费倍速，0 为不限速")
+    parser.add_argument("--lead-in", type=float, default=0.5, help="录音前补的底噪秒数")
+    parser.add_argument("--partial-ms", type=int, default=300)
+    parser.add_argument("--asr-final-delay", type=float, default=0.15)
+    parser.add_argument("--llm-first-token", type=float, default=0.5)
+    parser.add_argument("--llm-tps", type=float, default=30.0)
+    parser.add_argument("--tts-first-chunk", type=float, default=0.2)
+    parser.add_argument("--tts-rtf", type=float, default=0.3)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="讯飞与大模型模拟服务的出错比例")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out-dir", help="把每轮播放的音频写成 WAV")
+    parser.add_argument("--json", help="把本次结果写成 JSON")
+    parser.add_argument("--save-baseline", help="把本次结果存为基线")
+    parser.add_argument("--baseline", help="与该基线对比")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="P50 比基线慢多少比例算退化")
+    parser.add_argument("--min-ms", type=float, default=50.0, help="退化至少要慢这么多毫秒")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    captures = [(path, *load_capture(path)) for path in args.wavs]
+    channels, rate = captures[0][1].shape[1], captures[0][2]
+    if any(pcm.shape[1] != channels or r != rate for _, pcm, r in captures):
+        parser.error("所有录音的声道数与采样率须一致")
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+
+    settings = {k: getattr(args, k) for k in ("speed", "playback_speed", "lead_in", "partial_ms", "asr_final_delay",
+                                               "llm_first_token", "llm_tps", "tts_first_chunk", "tts_rtf",
+                                               "error_rate")}
+    trace_path = os.path.join(tempfile.mkdtemp(prefix="voicebox_replay_"), "traces.jsonl")
+    tracer.configure({"path": trace_path})
+    xunfei = FakeXunfeiServer(partial_ms=args.partial_ms, final_delay_s=args.asr_final_delay,
+                              first_chunk_delay_s=args.tts_first_chunk, rtf=args.tts_rtf,
+                              error_rate=args.error_rate, seed=args.seed).start()
+    llm = FakeLLMServer(first_token_delay_s=args.llm_first_token, tokens_per_s=args.llm_tps,
+                        error_rate=args.error_rate, seed=args.seed).start()
+
+    turns = failed = 0
+    audio_s = 0.0
+    wall_start = time.monotonic()
+    cpu_start = time.process_time()
+    try:
+        for run in range(args.runs):
+            pipeline = ReplayPipeline(config, xunfei, llm, channels, rate, args)
+            try:
+                for path, pcm, _ in captures:
+                    turns += 1
+                    audio_s += len(pcm) / rate
+                    if not pipeline.turn(path, pcm, run):
+                        failed += 1
+            finally:
+                pipeline.close()
+    finally:
+        wall_s = time.monotonic() - wall_start
+        cpu_s = time.process_time() - cpu_start
+        xunfei.close()
+        llm.close()
+        logger.complete()
+
+    stubs_s = xunfei.cpu_s + llm.cpu_s
+    pipeline_s = max(0.0, cpu_s - stubs_s)
+    result = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "wavs": [os.path.basename(p) for p in args.wavs],
+        "runs": args.runs,
+        "settings": settings,
+        "turns": turns,
+        "failed": failed,
+        "audio_s": round(audio_s, 2),
+        "wall_s": round(wall_s, 2),
+        "stages": summarize(load_traces(trace_path)),
+        "cpu": {"pipeline_s": round(pipeline_s, 3), "stubs_s": round(stubs_s, 3),
+                "utilization": round(pipeline_s / wall_s, 3) if wall_s else 0.0,
+                "per_turn_ms": round(pipeline_s * 1000 / max(1, turns), 1)},
+        "stubs": {"xunfei": xunfei.stats(), "llm": llm.stats()},
+    }
+    print()
+    print_report(result)
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        print(f"已保存基线：{args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.tolerance, args.min_ms)
+        if regressions:
+            print(f"有退化：{', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""音频浸泡测试：在虚拟音频设备上长时间运行 CaptureHub 与输出引擎，按时间表注入拔插、停滞、静音故障，
+检验重连逻辑，不需要声卡。
+
+用法（仓库根目录）：
+    python -m bench.soak_audio --duration 60
+    python -m bench.soak_audio --duration 600 --faults unplug@20:5,stall@60:4,silence@100:14,output-unplug@150:3
+    python -m bench.soak_audio 录音.wav --speed 4 --json
+
+- 故障写作 类型@开始秒:持续秒，类型为 unplug / stall / silence，加 output- 前缀作用于输出设备；
+  silence 持续时间须超过 --silence-s 才会被判定为静默拔线
+- 采集端：一个订阅者持续读取，遇到 DeviceUnavailable 后等设备就绪重新订阅；
+  统计每次故障的发现耗时（故障开始到订阅者收到断开）与恢复耗时（故障结束到重新订阅后收到音频）
+- 输出端：反复投递 1 秒提示音并等待播完，统计欠载、超时与输出流重开次数
+- 有故障之后采集始终没有恢复时退出码为 1
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+
+import numpy as np
+
+from audio_in.capture import CaptureHub
+from audio_out.engine import OutputEngine
+from utils.audio_backend import set_backend
+from utils.audio_device import DeviceUnavailable
+from utils.logger import logger
+from utils.virtual_audio import INPUT, OUTPUT, MemorySink, VirtualAudioBackend
+
+DEFAULT_FAULTS = "unplug@8:3,stall@20:4,silence@32:13,output-unplug@50:2"
+
+
+def parse_faults(spec):
+    """把 "unplug@8:3,output-stall@20:4" 解析为 VirtualAudioBackend.schedule() 的时间表。"""
+    faults = []
+    for item in filter(None, (s.strip() for s in (spec or "").split(","))):
+        kind, _, timing = item.partition("@")
+        at, _, duration = timing.partition(":")
+        device = INPUT
+        if kind.startswith("output-"):
+            device, kind = OUTPUT, kind[len("output-"):]
+        faults.append({"kind": kind, "at": float(at), "duration": float(duration) if duration else None,
+                       "device": device})
+    return faults
+
+
+def _tone(samplerate, seconds=1.0, freq=440.0):
+    t = np.arange(int(samplerate * seconds)) / samplerate
+    return (np.sin(2 * np.pi * freq * t) * 3000).astype(np.int16).tobytes()
+
+
+class CaptureProbe:
+    """采集端的订阅者：持续读取，断开后重新订阅，记录每次断开与恢复的时刻。"""
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.blocks = 0
+        self.lost = 0
+        self.disconnects = []  # 收到 DeviceUnavailable 的时刻
+        self.resumes = []  # 重新订阅后收到第一块的时刻
+        self.last_block_at = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="soak-capture", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=2.0)
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self.hub.wait_ready(timeout=0.5):
+                continue
+            sub = self.hub.subscribe("soak")
+            first = True
+            try:
+                while not self._stop.is_set():
+                    item = sub.read(timeout=0.5)
+                    if item is None:
+                        continue
+                    _, ts, lost = item
+                    self.blocks += 1
+                    self.lost += lost
+                    self.last_block_at = float(ts)
+                    if first and self.disconnects:
+                        self.resumes.append(ts)
+                    first = False
+            except DeviceUnavailable:
+                self.disconnects.append(time.monotonic())
+            finally:
+                sub.close()
+
+
+class PlaybackProbe:
+    """输出端：反复投递提示音并等待播完。"""
+
+    def __init__(self, engine, samplerate):
+        self.engine = engine
+        self.samplerate = samplerate
+        self.played = 0
+        self.timeouts = 0
+        self.errors = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="soak-playback", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=3.0)
+
+    def _run(self):
+        pcm = _tone(self.samplerate)
+        while not self._stop.is_set():
+            try:
+                handle = self.engine.enqueue([pcm[i:i + 3200] for i in range(0, len(pcm), 3200)],
+                                             src_samplerate=self.samplerate, tag="soak")
+            except Exception as e:
+                # 输出设备不在：与真机一样等一会儿再投递
+                self.errors += 1
+                logger.debug(f"投递失败：{e}")
+                self._stop.wait(0.5)
+                continue
+            if handle.wait(timeout=3.0):
+                self.played += 1
+            else:
+                self.timeouts += 1
+                self.engine.cancel(handle)
+            self._stop.wait(0.2)
+
+
+def _fault_report(backend, probe, started_at):
+    """按故障日志配对每次输入故障的开始/结束，算发现耗时与恢复耗时。"""
+    starts = {}
+    report = []
+    for at, kind, fault, phase in backend.fault_log:
+        if kind != INPUT:
+            continue
+        if phase == "start":
+            starts[fault] = at
+            continue
+        begin = starts.pop(fault, None)
+        if begin is None:
+            continue
+        # 静默拔线要等满 silence_s 才发现，重开可能早于故障结束：恢复耗时按 0 计
+        detected = next((t for t in probe.disconnects if t >= begin), None)
+        resumed = next((t for t in probe.resumes if t >= detected), None) if detected is not None else None
+        report.append({
+            "fault": fault,
+            "start_s": round(begin - started_at, 2),
+            "duration_s": round(at - begin, 2),
+            "detect_s": round(detected - begin, 2) if detected is not None else None,
+            "recover_s": round(max(0.0, resumed - at), 2) if resumed is not None else None,
+        })
+    return report
+
+
+def run(args):
+    backend = VirtualAudioBackend(input_name=args.device, input_channels=args.channels,
+                                  samplerate=args.samplerate, speed=args.speed, sink=MemorySink(),
+                                  loop=True)
+    for path in args.inputs:
+        backend.feed(path)
+    started_at = time.monotonic()
+    set_backend(backend)
+    hub = CaptureHub(samplerate=args.samplerate, channels=args.channels, dtype="int16", block_size=args.block_size,
+                     device=args.device, stall_s=args.stall_s, silence_s=args.silence_s,
+                     monitor_interval=args.monitor_interval)
+    engine = OutputEngine(samplerate=args.samplerate, channels=2, blocksize=512)
+    capture = CaptureProbe(hub)
+    playback = PlaybackProbe(engine, args.samplerate)
+    hub.start()
+    capture.start()
+    playback.start()
+    faults = parse_faults(args.faults)
+    backend.schedule(faults)
+    logger.info(f"浸泡测试开始：{args.duration}s，故障 {len(faults)} 个")
+    try:
+        time.sleep(args.duration)
+    except KeyboardInterrupt:
+        pass
+    elapsed = time.monotonic() - started_at
+    playback.stop()
+    capture.stop()
+    hub.close()
+    engine.close()
+    backend.close()
+
+    expected = elapsed * args.samplerate * (args.speed or 1.0) / args.block_size
+    faults_report = _fault_report(backend, capture, started_at)
+    result = {
+        "duration_s": round(elapsed, 1),
+        "capture": {
+            "blocks": capture.blocks,
+            "expected_blocks": int(expected) if args.speed else None,
+            "lost_blocks": capture.lost,
+            "disconnects": len(capture.disconnects),
+            "reopens": hub.reopens,
+            "overflows": hub.overflows,
+            "last_block_age_s": round(time.monotonic() - capture.last_block_at, 2) if capture.last_block_at else None,
+        },
+        "playback": dict(engine.stats(), played=playback.played, timeouts=playback.timeouts,
+                         enqueue_errors=playback.errors),
+        "backend": backend.stats(),
+        "faults": faults_report,
+    }
+    # 最后一次输入故障结束后必须重新收到过音频
+    ends = [t for t, kind, _, phase in backend.fault_log if kind == INPUT and phase == "end"]
+    result["recovered"] = not ends or (capture.last_block_at is not None and float(capture.last_block_at) > max(ends))
+    return result
+
+
+def print_report(result):
+    cap = result["capture"]
+    out = result["playback"]
+    print(f"\n运行 {result['duration_s']}s")
+    print(f"采集：{cap['blocks']} 块（预期约 {cap['expected_blocks']}），丢块 {cap['lost_blocks']}，"
+          f"断开 {cap['disconnects']} 次，重开 {cap['reopens']} 次，溢出 {cap['overflows']} 次")
+    print(f"输出：播完 {out['played']} 段，超时 {out['timeouts']}，投递失败 {out['enqueue_errors']}，"
+          f"欠载 {out['underruns']} 次，输出流打开 {result['backend']['opens'][OUTPUT]} 次")
+    print(f"设备列表刷新 {result['backend']['refreshes']} 次")
+    if result["faults"]:
+        print(f"\n{'故障':<10}{'开始s':>8}{'持续s':>8}{'发现s':>8}{'恢复s':>8}")
+        for f in result["faults"]:
+            cells = [f["start_s"], f["duration_s"], f["detect_s"], f["recover_s"]]
+            print(f"{f['fault']:<10}" + "".join(f"{'-' if c is None else c:>8}" for c in cells))
+    print("\n结果：" + ("采集已恢复" if result["recovered"] else "最后一次故障后采集没有恢复"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="虚拟音频设备上的采集/输出浸泡测试")
+    parser.add_argument("inputs", nargs="*", help="循环当作麦克风输入的 WAV；不给则只有底噪")
+    parser.add_argument("--duration", type=float, default=60.0, help="运行秒数")
+    parser.add_argument("--faults", default=DEFAULT_FAULTS, help="故障时间表，如 unplug@8:3,output-stall@20:4")
+    parser.add_argument("--speed", type=float, default=1.0, help="虚拟设备时钟倍速，0 为不限速")
+    parser.add_argument("--device", default="Virtual Mic", help="虚拟麦克风名称（CaptureHub 按它查找设备）")
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--samplerate", type=int, default=16000)
+    parser.add_argument("--block-size", type=int, default=1200)
+    parser.add_argument("--stall-s", type=float, default=2.0, help="读取停滞多少秒判定为断开")
+    parser.add_argument("--silence-s", type=float, default=10.0, help="持续全零多少秒判定为静默拔线（主程序默认不判定，这里开启以覆盖该逻辑；0 为关闭）")
+    parser.add_argument("--monitor-interval", type=float, default=1.0, help="设备监视间隔（秒）")
+    parser.add_argument("--json", action="store_true", help="输出 JSON")
+    args = parser.parse_args()
+    result = run(args)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print_report(result)
+    sys.exit(0 if result["recovered"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""熔断器：某个接口连续失败后暂时不再调用，按退避表定期放一次探测请求。
+
+- closed：正常调用；连续失败达到 failure_threshold 次后转 open
+- open：直接跳过（每跳过一次即省下一次注定失败的往返），到期后转 half_open
+- half_open：只放行一个探测请求；成功回到 closed 并重置退避，失败重新 open，退避升一级
+"""
+
+import threading
+import time
+
+from utils.logger import logger
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=1, backoff_s=(30, 120, 600, 1800)):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.backoff_s = list(backoff_s) or [60]
+        self.state = CLOSED
+        self.failures = 0  # 连续失败次数
+        self.level = 0  # 当前退避级别（backoff_s 下标）
+        self.open_until = 0.0
+        self.opened = 0  # 累计打开次数
+        self.skipped = 0  # 熔断期间跳过的调用数（即省下的往返次数）
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """本次是否应该调用；熔断期间返回 False 并计入 skipped。"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == OPEN and now >= self.open_until:
+                self.state = HALF_OPEN
+                self._probing = False
+                logger.info(f"熔断器[{self.name}]半开，放行一次探测请求")
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.skipped += 1
+            if self.skipped == 1 or self.skipped % 10 == 0:
+                remaining = max(0.0, self.open_until - now)
+                logger.info(f"熔断器[{self.name}]打开中（{remaining:.0f}秒后重试），跳过调用，累计省下{self.skipped}次往返")
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(f"熔断器[{self.name}]探测成功，恢复正常")
+            self.state = CLOSED
+            self.failures = 0
+            self.level = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state == HALF_OPEN:
+                    self.level = min(self.level + 1, len(self.backoff_s) - 1)
+                backoff = self.backoff_s[self.level]
+                self.state = OPEN
+                self.open_until = time.monotonic() + backoff
+                self.opened += 1
+                self._probing = False
+                logger.warning(f"熔断器[{self.name}]打开：连续失败{self.failures}次，{backoff}秒内不再调用")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "opened": self.opened,
+                "skipped": self.skipped,
+                "retry_in_s": round(max(0.0, self.open_until - time.monotonic()), 1) if self.state == OPEN else 0.0,
+            }
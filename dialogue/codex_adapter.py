@@ -7,12 +7,10 @@
 
 import os
 import shutil
-import subprocess
 
+from dialogue.codex_pool import CodexPool
 from utils.logger import logger
-
-# codex exec 会把最后一条消息写入这个文件，然后由我们读回
-_OUTPUT_FILE = "/tmp/voicebox_codex_last_msg.txt"
+from utils.tracing import tracer
 
 # 需要从子进程环境中清除的代理变量（沿用 run.sh 的直连策略）
 _PROXY_KEYS = ("http_proxy", "https_proxy", "all_proxy",
@@ -21,7 +19,8 @@ _PROXY_KEYS = ("http_proxy", "https_proxy", "all_proxy",
 
 class CodexAdapter:
     def __init__(self, model="deepseek-v4-flash", provider="deepseek",
-                 system_prompt="", timeout_s=120, working_dir=None):
+                 system_prompt="", timeout_s=120, working_dir=None,
+                 pool_size=1, max_concurrent=2, max_idle_s=600):
         self.model = model
         self.provider = provider
         self.system_prompt = system_prompt
@@ -30,57 +29,72 @@ class CodexAdapter:
         self.codex_bin = shutil.which("codex") or "codex"
         if self.codex_bin == "codex" and not shutil.which("codex"):
             logger.warning("未找到 codex 命令，复杂任务路由将自动降级为 DeepSeek")
+            pool_size = 0
+        env = os.environ.copy()
+        for key in _PROXY_KEYS:
+            env.pop(key, None)
+        # 预先启动的 codex exec 进程池：每次调用独立输出文件，可取消，并发有上限
+        self.pool = CodexPool(self._command, env=env, size=pool_size, max_concurrent=max_concurrent,
+                              max_idle_s=max_idle_s)
 
-    def chat(self, context):
-        """与 DeepseekAdapter.chat 同签名；失败返回 None。"""
-        prompt = self._build_prompt(context)
-        cmd = [
+    def _command(self, output_path):
+        # 提示词最后从标准输入写入（"-"），进程可以提前启动
+        return [
             self.codex_bin, "exec",
             "-s", "read-only",
             "-C", self.working_dir,
             "-c", f'model_provider="{self.provider}"',
             "-m", self.model,
-            "-o", _OUTPUT_FILE,
-            "--", prompt,
+            "-o", output_path,
+            "-",
         ]
-        env = os.environ.copy()
-        for key in _PROXY_KEYS:
-            env.pop(key, None)
+
+    def prewarm(self):
+        """后台预先启动空闲 codex 进程（快过期的换新），首个复杂任务免去冷启动。"""
+        self.pool.prewarm()
+
+    def cancel(self):
+        """结束进行中的 codex 调用（含其派生进程），chat() 随即返回 None。"""
+        self.pool.cancel()
+
+    def close(self):
+        self.pool.close()
+
+    def chat(self, context, timeout_s=None):
+        """与 DeepseekAdapter.chat 同签名；失败返回 None。timeout_s 覆盖默认超时（如路由的硬截止）。"""
+        timeout_s = timeout_s or self.timeout_s
+        tracer.mark("llm.request", backend="codex")
         try:
-            logger.info(f"Codex调用开始: model={self.model} timeout={self.timeout_s}s")
-            proc = subprocess.run(cmd, env=env, capture_output=True,
-                                  text=True, timeout=self.timeout_s)
-            if proc.returncode != 0:
-                logger.error(f"Codex退出码异常: {proc.returncode}，{proc.stderr[-300:]}")
-                return None
-            try:
-                with open(_OUTPUT_FILE, "r", encoding="utf-8") as f:
-                    text = f.read().strip()
-            except OSError:
-                logger.error("读取Codex输出文件失败")
-                return None
-            if not text:
-                logger.warning("Codex输出为空，降级处理")
-                return None
-            logger.info(f"Codex回复: {text[:150]}")
-            return text
-        except subprocess.TimeoutExpired:
-            logger.error(f"Codex调用超时({self.timeout_s}秒)，降级处理")
-            return None
+            logger.info(f"Codex调用开始: model={self.model} timeout={timeout_s}s")
+            text, error = self.pool.run(self._build_prompt(context), timeout_s)
         except FileNotFoundError:
             logger.error("找不到codex命令，降级处理")
             return None
         except Exception as e:
             logger.error(f"Codex调用异常: {e}，降级处理")
             return None
+        if text is None:
+            if error is None:
+                logger.info("Codex调用已取消")
+            else:
+                logger.error(f"Codex调用失败：{error}，降级处理")
+            return None
+        if not text:
+            logger.warning("Codex输出为空，降级处理")
+            return None
+        logger.info(f"Codex回复: {text[:150]}")
+        tracer.mark("llm.first_token")
+        tracer.mark("llm.done")
+        return text
 
     def _build_prompt(self, context):
         lines = []
         if self.system_prompt:
             lines.append(f"你是语音助手，请始终记住以下设定：{self.system_prompt}")
         lines.append("以下是最近的对话历史：")
-        for msg in context[-10:]:
-            role = "用户" if msg.get("role") == "user" else "助手"
+        # 上下文已由 ConversationContext 按 token 预算截取，system 消息是早期对话的摘要
+        for msg in context:
+            role = {"user": "用户", "system": "摘要"}.get(msg.get("role"), "助手")
             lines.append(f"{role}: {msg.get('content', '')}")
         lines.append("")
         lines.append(
@@ -0,0 +1,211 @@
+"""Codex 执行层：预先启动的 codex exec 工作进程池。
+
+- 每个工作进程启动时就带上全部参数并以 "-" 从标准输入读提示词，进程加载与配置解析在空闲时完成，
+  来请求时只需写入提示词；用掉一个就在后台补一个
+- 空闲超过 max_idle_s 的进程作废；每次唤醒时 prewarm() 把快到期的进程提前换新，长时间没人用也不会冷启动
+- 每个进程有自己的临时目录与输出文件（-o），并发调用（对冲、多个房间）互不覆盖
+- 同时运行的调用数有上限，超出时直接返回 None 交给上层降级
+- 分别记录启动耗时（Popen 到可写入，预热命中时不计入用户等待）与执行耗时（写入提示词到进程退出）
+"""
+
+import os
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+
+from utils.logger import logger
+
+_OUTPUT_NAME = "last_msg.txt"
+
+
+def _mean(values):
+    return round(sum(values) / len(values), 3) if values else 0.0
+
+
+class CodexWorker:
+    """一个已启动、等待提示词的 codex exec 进程。"""
+
+    def __init__(self, cmd_factory, env):
+        self.workdir = tempfile.mkdtemp(prefix="voicebox_codex_")
+        self.output_path = os.path.join(self.workdir, _OUTPUT_NAME)
+        started = time.monotonic()
+        try:
+            # 独立进程组：取消或超时时连同 codex 派生的子进程一起结束
+            self.proc = subprocess.Popen(cmd_factory(self.output_path), env=env, stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                         text=True, start_new_session=True)
+        except Exception:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+            raise
+        self.spawned_at = time.monotonic()
+        self.spawn_s = self.spawned_at - started
+        self.cancelled = False
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def kill(self):
+        if self.proc.poll() is not None:
+            return
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except OSError:
+            self.proc.kill()
+
+    def cleanup(self):
+        self.kill()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class CodexPool:
+    def __init__(self, cmd_factory, env=None, size=1, max_concurrent=2, max_idle_s=600, refresh_s=60):
+        self.cmd_factory = cmd_factory  # output_path -> 命令行列表
+        self.env = env
+        self.size = size  # 保持的空闲预热进程数；0 为按需启动
+        self.max_concurrent = max_concurrent
+        self.max_idle_s = max_idle_s  # 空闲超过这么久的预热进程换新（凭据、配置可能已变）
+        self.refresh_s = refresh_s  # prewarm() 时剩余寿命不足这么久的进程也提前换新，留给唤醒后的这次会话
+        self._idle = []
+        self._active = set()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._disabled = False  # codex 命令不存在时不再预热
+        self._refilling = False
+        self.warm_hits = 0
+        self.cold_spawns = 0
+        self.rejected = 0
+        self._spawn_s = []
+        self._exec_s = []
+
+    # ---- 预热 ----
+
+    def prewarm(self):
+        """后台补足空闲进程，并替换已过期或快过期的；唤醒时调用，让本次会话用上新鲜的预热进程。"""
+        with self._lock:
+            if self.size <= 0 or self._disabled or self._refilling:
+                return
+            self._refilling = True
+        threading.Thread(target=self._refill, name="codex-prewarm", daemon=True).start()
+
+    def _refill(self):
+        try:
+            self._refill_until_full()
+        finally:
+            self._refilling = False
+
+    def _refill_until_full(self):
+        while True:
+            with self._lock:
+                margin = min(self.refresh_s, self.max_idle_s / 2)
+                stale = [w for w in self._idle if not self._usable(w, margin)]
+                self._idle = [w for w in self._idle if w not in stale]
+                enough = self._disabled or len(self._idle) >= self.size
+            for worker in stale:
+                worker.cleanup()
+            if enough:
+                return
+            try:
+                worker = self._spawn()
+            except Exception as e:
+                self._disabled = True
+                logger.warning(f"Codex预热进程启动失败，改为按需启动: {e}")
+                return
+            with self._lock:
+                self._idle.append(worker)
+            logger.debug(f"Codex预热进程就绪（启动{worker.spawn_s * 1000:.0f}ms）")
+
+    def _usable(self, worker, margin_s=0.0):
+        return worker.alive() and time.monotonic() - worker.spawned_at < self.max_idle_s - margin_s
+
+    def _spawn(self):
+        worker = CodexWorker(self.cmd_factory, self.env)
+        self._spawn_s = (self._spawn_s + [worker.spawn_s])[-50:]
+        return worker
+
+    def _acquire(self):
+        """取一个预热进程，没有就现启动；返回 (worker, 是否预热命中)。"""
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop(0)
+                if self._usable(worker):
+                    self._active.add(worker)
+                    return worker, True
+                worker.cleanup()
+        worker = self._spawn()
+        with self._lock:
+            self._active.add(worker)
+        return worker, False
+
+    # ---- 调用 ----
+
+    def run(self, prompt, timeout_s):
+        """执行一次；返回 (输出文本, None) 或 (None, 失败原因)；被 cancel() 取消时返回 (None, None)。"""
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            return None, f"并发调用已达上限{self.max_concurrent}"
+        worker = None
+        try:
+            started = time.monotonic()
+            worker, warm = self._acquire()
+            if warm:
+                self.warm_hits += 1
+            else:
+                self.cold_spawns += 1
+            self.prewarm()
+            spawn_s = 0.0 if warm else time.monotonic() - started
+            exec_started = time.monotonic()
+            try:
+                _, stderr = worker.proc.communicate(input=prompt, timeout=timeout_s)
+            except subprocess.TimeoutExpired:
+                worker.kill()
+                worker.proc.communicate()
+                return None, f"超时({timeout_s}秒)"
+            if worker.cancelled:
+                return None, None
+            exec_s = time.monotonic() - exec_started
+            self._exec_s = (self._exec_s + [exec_s])[-50:]
+            logger.info(f"Codex执行完成：{'预热命中' if warm else '冷启动'}，启动{spawn_s:.2f}秒，执行{exec_s:.1f}秒")
+            if worker.proc.returncode != 0:
+                return None, f"退出码异常: {worker.proc.returncode}，{stderr[-300:]}"
+            try:
+                with open(worker.output_path, "r", encoding="utf-8") as f:
+                    return f.read().strip(), None
+            except OSError:
+                return None, "读取输出文件失败"
+        finally:
+            if worker is not None:
+                with self._lock:
+                    self._active.discard(worker)
+                worker.cleanup()
+            self._slots.release()
+
+    def cancel(self):
+        """结束所有进行中的调用（预热的空闲进程保留）。"""
+        with self._lock:
+            active = list(self._active)
+        for worker in active:
+            worker.cancelled = True
+            worker.kill()
+
+    def close(self):
+        """退出时结束全部进程并清理临时目录。"""
+        self._disabled = True
+        self.cancel()
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.cleanup()
+
+    def stats(self):
+        return {
+            "warm_hits": self.warm_hits,
+            "cold_spawns": self.cold_spawns,
+            "rejected": self.rejected,
+            "idle": len(self._idle),
+            "active": len(self._active),
+            "avg_spawn_s": _mean(self._spawn_s),
+            "avg_exec_s": _mean(self._exec_s),
+        }
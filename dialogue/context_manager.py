@@ -0,0 +1,168 @@
+"""多轮对话上下文：按 token 预算截取，较早的轮次折叠成摘要。
+
+- 每条消息写入时估算 token 数（中文约 0.6 token/字，其他字符约 0.3 token/字符，外加每条固定开销）
+- window() 给出本轮要发给大模型的上下文：[摘要块…] + 起点之后的完整轮次（用户/助手成对，不会切开一问一答），
+  总量不超过 budget_tokens；最新的用户问题总是在内
+- 前缀尽量逐字节不变，让 DeepSeek 的上下文缓存命中：摘要块只追加、不改写；截取起点只在超出预算时
+  一次性前移若干整轮（降到预算的 summarize_at 以下），之后几轮保持不动，而不是每轮滑动一条
+- 每轮回复记入后，若未摘要部分超过预算的 summarize_at 比例，后台线程把最近 keep_turns 轮之前的内容
+  总结成一个新的摘要块，不占用户等待时间；摘要生成前超出预算的旧轮次只是暂时不发
+- 每轮记录提示 token 估算与回复耗时，便于观察上下文长度对首字延迟的影响
+"""
+
+import re
+import threading
+
+from utils.logger import logger
+
+_CJK = re.compile(r"[　-〿㐀-鿿＀-￯]")
+MESSAGE_OVERHEAD_TOKENS = 4
+SUMMARY_PREFIX = "以下是之前对话的摘要，回答时可参考："
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数（DeepSeek 分词：一个汉字约 0.6 token，一个英文字符约 0.3 token）。"""
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return int(cjk * 0.6 + (len(text) - cjk) * 0.3) + 1
+
+
+class ConversationContext:
+    def __init__(self, summarizer=None, budget_tokens=1500, keep_turns=2, summarize_at=0.7):
+        self.summarizer = summarizer  # (已有摘要, [消息]) -> 这批消息的摘要块；None 时只截断不摘要
+        self.budget_tokens = budget_tokens
+        self.keep_turns = keep_turns  # 摘要时保留原文的最近轮数
+        self.summarize_at = summarize_at
+        self.messages = []
+        self._tokens = []  # 与 messages 一一对应的 token 估算
+        self.summaries = []  # 摘要块，只追加
+        self._summary_tokens = 0
+        self._folded = 0  # messages 中已并入摘要的条数
+        self._cut = 0  # 本轮上下文的起点（>= _folded），只在超出预算时整轮前移
+        self._generation = 0  # clear() 后丢弃进行中的摘要结果
+        self._summarizing = False
+        self._lock = threading.Lock()
+        self.last_prompt_tokens = 0
+        self.last_dropped = 0
+
+    def __len__(self):
+        return len(self.messages)
+
+    def append(self, message):
+        with self._lock:
+            self.messages.append(message)
+            self._tokens.append(estimate_tokens(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS)
+        if message.get("role") == "assistant":
+            # 一轮结束（回复已说出）后再考虑折叠，不占本轮等待时间
+            self.maybe_summarize()
+
+    def clear(self):
+        with self._lock:
+            self.messages = []
+            self._tokens = []
+            self.summaries = []
+            self._summary_tokens = 0
+            self._folded = 0
+            self._cut = 0
+            self._generation += 1
+
+    # ---- 本轮上下文 ----
+
+    def _turn_starts(self, start):
+        """从 start 起每个用户消息的位置（一轮 = 一条用户消息及其后的回复）。"""
+        return [i for i in range(start, len(self.messages)) if self.messages[i].get("role") == "user"]
+
+    @property
+    def summary(self):
+        return "\n".join(self.summaries)
+
+    def window(self, extra=None):
+        """本轮发给大模型的上下文（列表副本）；extra 为临时追加、不记入历史的消息。"""
+        with self._lock:
+            messages = self.messages + list(extra or [])
+            tokens = self._tokens + [estimate_tokens(m.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+                                     for m in extra or []]
+            budget = self.budget_tokens - self._summary_tokens
+            begin = max(self._cut, self._folded)
+            used = sum(tokens[begin:])
+            if used > budget:
+                # 超出预算：起点一次前移若干整轮，降到 summarize_at 以下，后面几轮前缀保持不变
+                starts = [i for i in range(begin + 1, len(messages)) if messages[i].get("role") == "user"]
+                for start in starts:
+                    if start > len(self.messages):
+                        break  # 临时追加的消息不参与确定起点
+                    used -= sum(tokens[begin:start])
+                    begin = start
+                    if used <= budget * self.summarize_at:
+                        break
+                self._cut = min(begin, len(self.messages))
+            context = [{"role": "system", "content": SUMMARY_PREFIX + block} for block in self.summaries]
+            context.extend(dict(m) for m in messages[begin:])
+            self.last_prompt_tokens = used + self._summary_tokens
+            self.last_dropped = begin - self._folded
+        if self.last_dropped:
+            logger.info(f"上下文超出预算{self.budget_tokens} tokens，暂不发送最早的{self.last_dropped}条（等待摘要）")
+        return context
+
+    def record_turn(self, latency_s):
+        """记录一轮的提示 token 估算与大模型回复耗时（流式为首个 token）。"""
+        logger.info(f"本轮提示约{self.last_prompt_tokens} tokens（历史{len(self.messages)}条，"
+                    f"摘要{self._summary_tokens} tokens），回复耗时{latency_s:.2f}秒")
+
+    # ---- 摘要 ----
+
+    def maybe_summarize(self):
+        with self._lock:
+            if self.summarizer is None or self._summarizing:
+                return
+            unfolded = sum(self._tokens[self._folded:])
+            if unfolded < self.budget_tokens * self.summarize_at:
+                return
+            starts = self._turn_starts(self._folded)
+            if len(starts) <= self.keep_turns:
+                return
+            upto = starts[-self.keep_turns] if self.keep_turns else len(self.messages)
+            batch = [dict(m) for m in self.messages[self._folded:upto]]
+            previous, generation = "\n".join(self.summaries), self._generation
+            # 摘要块累计超过预算一半时合并成一块（前缀只在这时变一次）
+            merge = self._summary_tokens > self.budget_tokens * 0.5
+            if merge:
+                batch = [{"role": "system", "content": block} for block in self.summaries] + batch
+                previous = ""
+            self._summarizing = True
+        threading.Thread(target=self._summarize, args=(previous, batch, upto, generation, merge),
+                         name="context-summary", daemon=True).start()
+
+    def _summarize(self, previous, batch, upto, generation, merge=False):
+        try:
+            summary = self.summarizer(previous, batch)
+        except Exception as e:
+            logger.warning(f"对话摘要生成失败: {e}")
+            summary = None
+        with self._lock:
+            self._summarizing = False
+            if not summary or generation != self._generation:
+                return
+            block = summary.strip()
+            block_tokens = estimate_tokens(SUMMARY_PREFIX + block) + MESSAGE_OVERHEAD_TOKENS
+            if merge:
+                self.summaries = []
+                self._summary_tokens = 0
+            self.summaries.append(block)
+            self._summary_tokens += block_tokens
+            folded_tokens = sum(self._tokens[self._folded:upto])
+            self._folded = upto
+            self._cut = max(self._cut, upto)
+        logger.info(f"已将{len(batch)}条早期对话（约{folded_tokens} tokens）折叠为{block_tokens} tokens的摘要块"
+                    f"（共{len(self.summaries)}块）")
+
+
+def create_context(cfg, summarizer=None):
+    cfg = cfg or {}
+    return ConversationContext(
+        summarizer=summarizer if cfg.get("summarize", True) else None,
+        budget_tokens=cfg.get("budget_tokens", 1500),
+        keep_turns=cfg.get("keep_turns", 2),
+        summarize_at=cfg.get("summarize_at", 0.7),
+    )
@@ -1,11 +1,32 @@
+import queue
+import threading
+import time
+
 from openai import OpenAI
+from dialogue.circuit_breaker import CircuitBreaker
 from utils.logger import logger
+from utils.tracing import tracer
 
+FALLBACK_REPLY = "对不起，我暂时无法回答你的问题。"
 REPLY_FORMAT_HINT = "回答要简短，最多3句话；不要使用任何星号、破折号、列表符号或换行；不要反问用户。"
+# HTTP keep-alive 空闲保持时间（秒）：默认 5 秒太短，唤醒时预热的连接等用户说完话就过期了
+KEEPALIVE_EXPIRY_S = 30
+
+
+def _keepalive_http_client():
+    try:
+        import httpx
+        from openai import DefaultHttpxClient
+    except ImportError:
+        return None
+    return DefaultHttpxClient(limits=httpx.Limits(
+        max_connections=100, max_keepalive_connections=20, keepalive_expiry=KEEPALIVE_EXPIRY_S))
+
 
 class DeepseekAdapter:
-    def __init__(self, api_key, base_url="https://api.deepseek.com", model="deepseek-chat", temperature=0.7, max_tokens=2048, system_prompt="", web_search=False):
-        self.client = OpenAI(api_key=api_key, base_url=base_url)
+    def __init__(self, api_key, base_url="https://api.deepseek.com", model="deepseek-chat", temperature=0.7, max_tokens=2048, system_prompt="", web_search=False,
+                 search_breaker=None, search_hedge_s=None):
+        self.client = OpenAI(api_key=api_key, base_url=base_url, http_client=_keepalive_http_client())
         self.model = model
         self.temperature = temperature
         self.max_tokens = max_tokens
@@ -13,42 +34,370 @@ class DeepseekAdapter:
         if system_prompt and REPLY_FORMAT_HINT not in system_prompt:
             self.system_prompt = system_prompt + " " + REPLY_FORMAT_HINT
         self.web_search = web_search
+        self.last_source = None  # 最近一次回答的来源："web_search" / "chat" / "error"（回答缓存据此判断能否存）
+        # /responses 联网搜索的熔断器：接口不可用时不必每轮先付一次失败的往返
+        self.search_breaker = search_breaker or CircuitBreaker("DeepSeek联网搜索")
+        # 对冲：联网搜索 search_hedge_s 秒内没回来就同时发普通对话，谁先给出有效回答用谁；None/0 关闭
+        self.search_hedge_s = search_hedge_s
+        self.hedges = 0  # 触发对冲的次数
+        self.hedge_wins = 0  # 对冲中普通对话先回来的次数
+        self._streams = set()  # 进行中的流式响应，cancel() 关闭它们以断开 HTTP 请求
+        # 上下文缓存（前缀缓存）统计：来自每次响应的 usage.prompt_cache_hit_tokens / prompt_cache_miss_tokens
+        self.cache_hit_tokens = 0
+        self.cache_miss_tokens = 0
+        self.cache_turns = 0
+        self._streams_lock = threading.Lock()
 
     def _build_messages(self, context):
-        # 保证 system prompt 始终在最前面
-        messages = context[-20:]  # 取最近20条
+        # 上下文长度由 ConversationContext 按 token 预算控制（整轮截取），这里不再按条数截断；
+        # 固定的 system prompt 在最前面，上下文里的 system 消息（只追加的摘要块）紧随其后，
+        # 前缀逐字节稳定才能命中 DeepSeek 的上下文缓存；不修改调用方的消息
+        messages = list(context)
         if self.system_prompt:
-            # 判断是否已经有system prompt，没有则插入
-            if not messages or messages[0].get("role") != "system":
-                messages = [{"role": "system", "content": self.system_prompt}] + messages
-            # 如果已经有system，建议替换成新的system
-            elif messages[0].get("role") == "system":
-                messages[0]["content"] = self.system_prompt
+            messages = [{"role": "system", "content": self.system_prompt}] + messages
         return messages
 
+    def summarize(self, previous, messages, max_chars=200):
+        """把一批早期对话总结成一个摘要块（供 ConversationContext 在后台调用）；失败抛出异常。
+        previous 为已有摘要，仅作参考，新块不重复其内容；messages 中的 system 消息是待合并的旧摘要块。"""
+        labels = {"user": "用户", "system": "摘要"}
+        lines = [f"{labels.get(m.get('role'), '助手')}: {m.get('content', '')}" for m in messages]
+        prompt = (f"已有摘要（仅供参考，不要重复）：{previous or '无'}\n待总结的内容：\n" + "\n".join(lines) +
+                  f"\n请把待总结的内容概括成一段不超过{max_chars}字的中文摘要，"
+                  "保留用户的偏好、提到的人名地名数字和未完成的事，只输出摘要本身。")
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.3,
+            max_tokens=max_chars * 2,
+            stream=False
+        )
+        return response.choices[0].message.content.strip()
+
+    def cancel(self):
+        """断开进行中的流式请求（如路由对冲中另一方已胜出），读流的一方随即结束。"""
+        with self._streams_lock:
+            streams = list(self._streams)
+        for response in streams:
+            try:
+                response.close()
+            except Exception as e:
+                logger.debug(f"关闭DeepSeek流式响应失败: {e}")
+
+    def _open_stream(self, messages):
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=self.temperature,
+            max_tokens=self.max_tokens,
+            stream=True,
+            stream_options={"include_usage": True},  # 最后一个分片带 usage（含缓存命中 token 数）
+        )
+        with self._streams_lock:
+            self._streams.add(response)
+        return response
+
+    def _close_stream(self, response):
+        with self._streams_lock:
+            self._streams.discard(response)
+        response.close()
+
+    def _record_usage(self, usage, latency_s):
+        """记录一轮的提示缓存命中情况；latency_s 为回复耗时（流式为首个 token）。"""
+        if usage is None:
+            return
+        hit = getattr(usage, "prompt_cache_hit_tokens", None)
+        miss = getattr(usage, "prompt_cache_miss_tokens", None)
+        if hit is None or miss is None:
+            # 非 DeepSeek 的 OpenAI 兼容服务：缓存命中数在 prompt_tokens_details.cached_tokens
+            prompt = getattr(usage, "prompt_tokens", 0) or 0
+            hit = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", 0) or 0
+            miss = max(0, prompt - hit)
+        self.cache_hit_tokens += hit
+        self.cache_miss_tokens += miss
+        self.cache_turns += 1
+        total = self.cache_hit_tokens + self.cache_miss_tokens
+        latency = f"，耗时{latency_s:.2f}秒" if latency_s is not None else ""
+        logger.info(f"DeepSeek提示缓存：命中{hit}/{hit + miss} tokens（{hit / max(1, hit + miss):.0%}）{latency}；"
+                    f"累计{self.cache_turns}轮命中率{self.cache_hit_tokens / max(1, total):.0%}")
+
+    def cache_stats(self):
+        total = self.cache_hit_tokens + self.cache_miss_tokens
+        return {
+            "turns": self.cache_turns,
+            "hit_tokens": self.cache_hit_tokens,
+            "miss_tokens": self.cache_miss_tokens,
+            "hit_ratio": round(self.cache_hit_tokens / total, 3) if total else 0.0,
+        }
+
+    def search_stats(self):
+        """联网搜索的熔断与对冲统计。"""
+        stats = self.search_breaker.stats()
+        stats.update(hedges=self.hedges, hedge_wins=self.hedge_wins)
+        return stats
+
+    def warm(self):
+        """预热到 DeepSeek 的 HTTP keep-alive 连接（GET /models，不计费），后续对话直接复用。"""
+        self.client.models.list()
+        return True
+
     def chat(self, context):
+        tracer.mark("llm.request", backend="deepseek")
+        reply = self._chat(context)
+        tracer.mark("llm.first_token")
+        tracer.mark("llm.done")
+        return reply
+
+    def _chat(self, context):
         messages = self._build_messages(context)
 
         # 联网搜索模式：优先走 /responses + web_search，失败自动降级为普通对话
+        # 每轮只问一次熔断器：再问一次会把同一轮重复计入 skipped
+        allowed = self.web_search and self.search_breaker.allow()
+        if allowed and self.search_hedge_s:
+            return self._chat_hedged(messages)
         if self.web_search:
-            reply = self._chat_with_search(messages)
+            reply = self._search(messages, allowed=True) if allowed else None
             if reply is not None:
+                self.last_source = "web_search"
                 return reply
             logger.warning("DeepSeek联网搜索不可用，降级为普通对话")
 
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=self.temperature,
-                max_tokens=self.max_tokens,
-                stream=False
-            )
-            logger.info(f"DeepSeek回复: {response.choices[0].message.content}")
-            return response.choices[0].message.content.strip()
+            reply = self._complete(messages)
+            self.last_source = "chat"
+            return reply
         except Exception as e:
             logger.error(f"DeepSeek接口异常: {e}")
-            return "对不起，我暂时无法回答你的问题。"
+            self.last_source = "error"
+            return FALLBACK_REPLY
+
+    def _complete(self, messages):
+        """普通对话（非流式）；失败抛出异常。"""
+        started = time.monotonic()
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=self.temperature,
+            max_tokens=self.max_tokens,
+            stream=False
+        )
+        self._record_usage(getattr(response, "usage", None), time.monotonic() - started)
+        logger.info(f"DeepSeek回复: {response.choices[0].message.content}")
+        return response.choices[0].message.content.strip()
+
+    def _search(self, messages, allowed=False):
+        """经熔断器调用联网搜索；熔断中或失败返回 None。allowed 为真表示调用方已经过 allow()。"""
+        if not allowed and not self.search_breaker.allow():
+            return None
+        reply = self._chat_with_search(messages)
+        if reply is None:
+            self.search_breaker.record_failure()
+        else:
+            self.search_breaker.record_success()
+        return reply
+
+    def _chat_hedged(self, messages):
+        """联网搜索先发，超过 search_hedge_s 仍无结果时再发普通对话，取先到的有效回答。"""
+        results = queue.Queue()
+
+        def run(kind, fn):
+            try:
+                results.put((kind, fn(messages)))
+            except Exception as e:
+                logger.error(f"DeepSeek接口异常: {e}")
+                results.put((kind, None))
+
+        started = time.monotonic()
+        threading.Thread(target=run, args=("web_search", lambda m: self._search(m, allowed=True)), daemon=True).start()
+        pending = 1
+        plain_started = False
+        hedged = False
+        deadline = started + self.search_hedge_s
+        while pending:
+            try:
+                kind, reply = results.get(timeout=None if plain_started else max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                kind, reply = None, None
+            else:
+                pending -= 1
+                if reply:
+                    self.last_source = kind
+                    if kind == "chat" and hedged:
+                        self.hedge_wins += 1
+                    logger.info(f"DeepSeek对冲：采用{'联网搜索' if kind == 'web_search' else '普通对话'}结果，"
+                                f"耗时{time.monotonic() - started:.1f}秒")
+                    return reply
+            if not plain_started:
+                # 联网搜索超时或失败：发普通对话
+                plain_started = True
+                pending += 1
+                if kind is None:
+                    hedged = True
+                    self.hedges += 1
+                    logger.info(f"联网搜索{self.search_hedge_s}秒未返回，同时发起普通对话（累计对冲{self.hedges}次）")
+                threading.Thread(target=run, args=("chat", self._complete), daemon=True).start()
+        self.last_source = "error"
+        return FALLBACK_REPLY
+
+    def chat_stream(self, context):
+        """
+        流式对话：生成器，逐段 yield 回复文本（token）。
+        联网搜索模式下 /responses 一次性返回，整段 yield；失败降级为流式普通对话。
+        """
+        tracer.mark("llm.request", backend="deepseek")
+        for token in self._chat_stream(context):
+            tracer.mark("llm.first_token")
+            yield token
+        tracer.mark("llm.done")
+
+    def _chat_stream(self, context):
+        messages = self._build_messages(context)
+
+        # 每轮只问一次熔断器：再问一次会把同一轮重复计入 skipped
+        allowed = self.web_search and self.search_breaker.allow()
+        if allowed and self.search_hedge_s:
+            yield from self._chat_stream_hedged(messages)
+            return
+        if self.web_search:
+            reply = self._search(messages, allowed=True) if allowed else None
+            if reply is not None:
+                self.last_source = "web_search"
+                yield reply
+                return
+            logger.warning("DeepSeek联网搜索不可用，降级为普通对话")
+
+        parts = []
+        first_token_s = None
+        try:
+            started = time.monotonic()
+            response = self._open_stream(messages)
+            try:
+                for chunk in response:
+                    if getattr(chunk, "usage", None):
+                        self._record_usage(chunk.usage, first_token_s)
+                    if not chunk.choices:
+                        continue
+                    token = chunk.choices[0].delta.content
+                    if token:
+                        if first_token_s is None:
+                            first_token_s = time.monotonic() - started
+                        parts.append(token)
+                        yield token
+            finally:
+                # 正常结束、出错或被上层关闭（打断、对冲落败）都立即断开连接
+                self._close_stream(response)
+            logger.info(f"DeepSeek流式回复: {''.join(parts)}")
+            self.last_source = "chat"
+        except Exception as e:
+            logger.error(f"DeepSeek流式接口异常: {e}")
+            self.last_source = "error"
+            if not parts:
+                yield FALLBACK_REPLY
+
+    def _chat_stream_hedged(self, messages):
+        """
+        流式对冲：联网搜索先发，search_hedge_s 内未返回就同时开普通对话流。
+        普通对话出首个 token 前搜索先回来则关掉对话流、用搜索结果；否则一路用对话流，迟到的搜索结果丢弃。
+        """
+        events = queue.Queue()
+        stop = threading.Event()
+        opened_streams = []  # 对话流的响应；落败或被关闭时直接断开，不等下一个分片
+
+        def search():
+            try:
+                events.put(("search", self._search(messages, allowed=True)))
+            except Exception as e:
+                logger.error(f"DeepSeek联网搜索异常: {e}")
+                events.put(("search", None))
+
+        def stream():
+            try:
+                opened = time.monotonic()
+                first_token_s = None
+                response = self._open_stream(messages)
+                opened_streams.append(response)
+                try:
+                    if stop.is_set():
+                        return
+                    for chunk in response:
+                        if stop.is_set():
+                            return
+                        if getattr(chunk, "usage", None):
+                            self._record_usage(chunk.usage, first_token_s)
+                        if first_token_s is None and chunk.choices and chunk.choices[0].delta.content:
+                            first_token_s = time.monotonic() - opened
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            events.put(("token", chunk.choices[0].delta.content))
+                finally:
+                    self._close_stream(response)
+                events.put(("end", None))
+            except Exception as e:
+                events.put(("error", e))
+
+        started = time.monotonic()
+        threading.Thread(target=search, name="deepseek-search", daemon=True).start()
+        stream_state = "idle"  # idle / running / done（结束或失败）
+        search_done = False
+        parts = []
+        try:
+            while True:
+                waiting_hedge = stream_state == "idle" and not search_done
+                try:
+                    kind, value = events.get(timeout=self.search_hedge_s if waiting_hedge else None)
+                except queue.Empty:
+                    self.hedges += 1
+                    logger.info(f"联网搜索{self.search_hedge_s}秒未返回，同时发起普通对话（累计对冲{self.hedges}次）")
+                    kind, value = "start", None
+                if kind == "search":
+                    search_done = True
+                    if value and not parts:
+                        # 搜索先到（对话流还没出字）：用搜索结果，关掉对话流
+                        stop.set()
+                        self.last_source = "web_search"
+                        logger.info(f"DeepSeek对冲：采用联网搜索结果，耗时{time.monotonic() - started:.1f}秒")
+                        yield value
+                        return
+                    if stream_state == "idle":
+                        logger.warning("DeepSeek联网搜索不可用，降级为普通对话")
+                        kind = "start"
+                    elif stream_state == "done":
+                        self.last_source = "error"
+                        yield FALLBACK_REPLY
+                        return
+                elif kind == "token":
+                    if not parts and not search_done:
+                        self.hedge_wins += 1
+                        logger.info(f"DeepSeek对冲：普通对话先出字（{time.monotonic() - started:.1f}秒），不再等联网搜索")
+                    parts.append(value)
+                    yield value
+                elif kind == "end":
+                    stream_state = "done"
+                    if parts or search_done:
+                        logger.info(f"DeepSeek流式回复: {''.join(parts)}")
+                        self.last_source = "chat" if parts else "error"
+                        if not parts:
+                            yield FALLBACK_REPLY
+                        return
+                elif kind == "error":
+                    logger.error(f"DeepSeek流式接口异常: {value}")
+                    stream_state = "done"
+                    if parts or search_done:
+                        self.last_source = "error"
+                        if not parts:
+                            yield FALLBACK_REPLY
+                        return
+                if kind == "start":
+                    stream_state = "running"
+                    threading.Thread(target=stream, name="deepseek-stream", daemon=True).start()
+        finally:
+            stop.set()
+            # 搜索胜出或上层关闭：立即断开对话流（同路由对冲的 _cancel_default），不让它继续生成计费
+            for response in opened_streams:
+                try:
+                    self._close_stream(response)
+                except Exception as e:
+                    logger.debug(f"关闭DeepSeek流式响应失败: {e}")
 
     def _chat_with_search(self, messages):
         """调用 DeepSeek 官方网页搜索接口（/responses + web_search），失败返回 None。"""
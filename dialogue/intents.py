@@ -0,0 +1,296 @@
+"""本地意图快速通道：简单指令（几点、星期几、音量、定时、停止）在本地直接回答，不走大模型。
+
+- 每个意图注册若干正则（命名分组即槽位），注册时编译；整句匹配（fullmatch），
+  自动容忍"请/帮我"等前缀和"了/吧/呢"等语气词，长句直接跳过，避免把真正的问题截走
+- 处理函数 handler(slots, text) 返回要说的话；返回 None 表示放弃，交回大模型
+- 每次命中记录匹配耗时与"比走大模型省下的时间"（按最近大模型回复耗时的滑动平均估算）
+"""
+
+import random
+import re
+import threading
+import time
+import unicodedata
+
+from utils.logger import logger
+
+_PUNCT = re.compile(r"[\s，。！？、；：,.!?;:~…\"'“”‘’（）()]+")
+# 与 response_cache._LEAD 同一套句首客套词，两层规范化一致
+_PREFIX = r"(?:请问|请你?|麻烦你?|帮我|给我|你知道|你知不知道|告诉我|我想知道|我想问|你)*"
+_SUFFIX = r"(?:了|吧|呢|啊|呀|嘛|哈|啦|好吗|可以吗|行吗)*"
+
+
+class IntentResult:
+    def __init__(self, name, reply, slots=None, end=False):
+        self.name = name
+        self.reply = reply
+        self.slots = slots or {}
+        self.end = end  # 为真时结束本次多轮对话（如"停止"）
+        self.match_ms = 0.0
+
+
+class IntentMatcher:
+    def __init__(self, max_len=24, llm_latency_s=1.5):
+        self.max_len = max_len  # 超过这个长度的话不尝试本地意图
+        self.llm_latency_s = llm_latency_s  # 大模型回复耗时滑动平均（秒），用于估算省下的时间
+        self._intents = []  # [(name, [compiled], handler, end)]
+        self.turns = 0
+        self.hits = {}
+        self.saved_s = {}
+
+    def register(self, name, patterns, handler, end=False):
+        """注册意图：patterns 为正则列表（命名分组作为槽位传给 handler）。后注册的同名意图排在后面。"""
+        compiled = [re.compile(_PREFIX + p + _SUFFIX) for p in patterns]
+        self._intents.append((name, compiled, handler, end))
+
+    @staticmethod
+    def normalize(text):
+        text = unicodedata.normalize("NFKC", text or "").lower()
+        return _PUNCT.sub("", text)
+
+    def match(self, text):
+        """匹配一句话；命中返回 IntentResult，否则返回 None。"""
+        started = time.perf_counter()
+        self.turns += 1
+        norm = self.normalize(text)
+        if not norm or len(norm) > self.max_len:
+            return None
+        for name, compiled, handler, end in self._intents:
+            for pattern in compiled:
+                m = pattern.fullmatch(norm)
+                if m is None:
+                    continue
+                slots = {k: v for k, v in m.groupdict().items() if v is not None}
+                match_ms = (time.perf_counter() - started) * 1000
+                try:
+                    reply = handler(slots, norm)
+                except Exception as e:
+                    logger.warning(f"意图[{name}]处理失败，交给大模型: {e}")
+                    return None
+                if reply is None:
+                    continue
+                result = IntentResult(name, reply, slots, end)
+                result.match_ms = match_ms
+                self._record(name, time.perf_counter() - started)
+                return result
+        return None
+
+    def farewell(self, replies):
+        """结束语：从预置句子中随机选一句，不再为告别请求大模型（本轮已在 match 中计数）。"""
+        started = time.perf_counter()
+        text = random.choice(replies) if replies else "好的，下次再见。"
+        self._record("farewell", time.perf_counter() - started)
+        return text
+
+    def observe_llm(self, seconds):
+        """记录一次大模型回复耗时（到首段文字），更新估算基准。"""
+        self.llm_latency_s += 0.2 * (seconds - self.llm_latency_s)
+
+    def _record(self, name, elapsed_s):
+        saved = max(0.0, self.llm_latency_s - elapsed_s)
+        self.hits[name] = self.hits.get(name, 0) + 1
+        self.saved_s[name] = self.saved_s.get(name, 0.0) + saved
+        total = sum(self.hits.values())
+        logger.info(
+            f"本地意图[{name}]命中：耗时{elapsed_s * 1000:.2f}ms，约省{saved:.1f}秒"
+            f"（该意图累计{self.hits[name]}次/省{self.saved_s[name]:.1f}秒，总命中率{total}/{self.turns}）"
+        )
+
+    def stats(self):
+        total = sum(self.hits.values())
+        return {
+            "turns": self.turns,
+            "hit_rate": total / self.turns if self.turns else 0.0,
+            "intents": {name: {"hits": n, "saved_s": round(self.saved_s[name], 2)} for name, n in self.hits.items()},
+        }
+
+
+# ---- 中文数字与时长 ----
+
+_CN_DIGITS = {"零": 0, "〇": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_CN_UNITS = {"十": 10, "百": 100}
+NUM = r"[0-9零〇一二两三四五六七八九十百]+"
+
+
+def parse_number(s):
+    """解析阿拉伯数字或一百以内常见中文数字（"十五"、"二十"、"一百"）；无法解析返回 None。"""
+    if s.isdigit():
+        return int(s)
+    total, digit = 0, None
+    for ch in s:
+        if ch in _CN_DIGITS:
+            digit = _CN_DIGITS[ch]
+        elif ch in _CN_UNITS:
+            total += (1 if digit is None else digit) * _CN_UNITS[ch]
+            digit = None
+        else:
+            return None
+    return total + (digit or 0)
+
+
+_DURATION = re.compile(r"(?:(?P<h>" + NUM + r")个?(?P<half>半)?(?:小时|钟头))?(?:(?P<m>" + NUM + r")分钟?)?"
+                       r"(?:(?P<s>" + NUM + r")秒钟?)?")
+
+
+def parse_duration(s):
+    """"五分钟"、"一个半小时"、"90秒"、"半小时" → 秒数；无法解析返回 None。"""
+    if s in ("半小时", "半个小时", "半个钟头"):
+        return 1800
+    m = _DURATION.fullmatch(s)
+    if m is None or not any(m.group(k) for k in ("h", "m", "s")):
+        return None
+    seconds = 0
+    for key, unit in (("h", 3600), ("m", 60), ("s", 1)):
+        if m.group(key):
+            n = parse_number(m.group(key))
+            if n is None:
+                return None
+            seconds += n * unit
+    if m.group("half") and m.group("h"):
+        seconds += 1800
+    return seconds or None
+
+
+def speak_duration(seconds):
+    h, rest = divmod(seconds, 3600)
+    m, s = divmod(rest, 60)
+    parts = [f"{h}小时" if h else "", f"{m}分钟" if m else "", f"{s}秒" if s else ""]
+    return "".join(parts)
+
+
+# ---- 内置意图 ----
+
+_WEEKDAYS = "一二三四五六日"
+_DAY_OFFSETS = {"今天": 0, "明天": 1, "后天": 2, "昨天": -1}
+
+
+def _period(hour):
+    if hour < 5:
+        return "凌晨"
+    if hour < 8:
+        return "早上"
+    if hour < 12:
+        return "上午"
+    if hour < 13:
+        return "中午"
+    if hour < 18:
+        return "下午"
+    return "晚上"
+
+
+def handle_time(slots, text):
+    now = time.localtime()
+    hour12 = now.tm_hour % 12 or 12
+    minute = f"{now.tm_min}分" if now.tm_min else "整"
+    return f"现在是{_period(now.tm_hour)}{hour12}点{minute}。"
+
+
+def handle_date(slots, text):
+    day = slots.get("day", "今天")
+    t = time.localtime(time.time() + _DAY_OFFSETS.get(day, 0) * 86400)
+    return f"{day}是{t.tm_mon}月{t.tm_mday}日，星期{_WEEKDAYS[t.tm_wday]}。"
+
+
+class VolumeIntent:
+    """音量调节：大一点/小一点按 step 调整，也可直接"音量调到 60"；静音/取消静音。"""
+
+    def __init__(self, get_volume, set_volume, step=15):
+        self.get_volume = get_volume
+        self.set_volume = set_volume
+        self.step = step
+        self._before_mute = None
+
+    def patterns(self):
+        return [
+            r"(?:把)?(?:声音|音量)(?:调|开)?(?P<dir>大|小|高|低)(?:一)?(?:点|些)?",
+            r"(?:调|开)?(?P<dir>大|小)(?:一)?(?:点|些)?声(?:音|点)?",
+            r"(?P<dir>大|小)声(?:一)?(?:点|些)",
+            r"(?:把)?(?:声音|音量)(?:调|设)?(?:到|成|为)(?P<level>" + NUM + r")(?:%|分)?",
+            r"(?P<mute>静音|取消静音)",
+        ]
+
+    def __call__(self, slots, text):
+        if "mute" in slots:
+            if slots["mute"] == "静音":
+                self._before_mute = self.get_volume()
+                self.set_volume(0)
+                return "已静音。"
+            volume = self.set_volume(self._before_mute or 60)
+            return f"已取消静音，音量{volume}。"
+        if "level" in slots:
+            level = parse_number(slots["level"])
+            if level is None:
+                return None
+            return f"音量已调到{self.set_volume(level)}。"
+        current = self.get_volume()
+        delta = self.step if slots["dir"] in ("大", "高") else -self.step
+        volume = self.set_volume(current + delta)
+        if volume == current:
+            return "已经是最大音量了。" if delta > 0 else "已经是最小音量了。"
+        return f"好的，音量{volume}。"
+
+
+class TimerIntent:
+    """倒计时：到点调用 on_fire(提示语)。可同时有多个，"取消定时"全部取消。"""
+
+    def __init__(self, on_fire, max_s=24 * 3600):
+        self.on_fire = on_fire
+        self.max_s = max_s
+        self._timers = []
+        self._lock = threading.Lock()
+
+    def patterns(self):
+        dur = r"(?P<dur>[0-9零〇一二两三四五六七八九十百半个小时钟头分秒]+)"
+        return [
+            r"(?P<cancel>取消|关掉|停止|关闭)(?:所有的?)?(?:定时|计时|倒计时|闹钟)(?:器)?",
+            r"(?:设|定)?(?:一个|个)?" + dur + r"(?:的)?(?:定时|计时|倒计时)(?:器)?",
+            r"(?:定时|计时|倒计时)" + dur,
+            dur + r"(?:以)?后(?:提醒|叫)我(?P<what>.{0,10})",
+        ]
+
+    def __call__(self, slots, text):
+        if "cancel" in slots:
+            with self._lock:
+                timers, self._timers = self._timers, []
+            for t in timers:
+                t.cancel()
+            return f"已取消{len(timers)}个定时。" if timers else "现在没有定时。"
+        seconds = parse_duration(slots.get("dur", ""))
+        if seconds is None or seconds > self.max_s:
+            return None
+        what = slots.get("what", "")
+        message = f"{speak_duration(seconds)}到了" + (f"，该{what}了。" if what else "。")
+        timer = threading.Timer(seconds, self._fire, args=(message,))
+        timer.daemon = True
+        with self._lock:
+            self._timers.append(timer)
+        timer.start()
+        return f"好的，{speak_duration(seconds)}后提醒你。"
+
+    def _fire(self, message):
+        with self._lock:
+            self._timers = [t for t in self._timers if t.is_alive() and t is not threading.current_thread()]
+        logger.info(f"定时到点：{message}")
+        try:
+            self.on_fire(message)
+        except Exception as e:
+            logger.error(f"定时提醒播放失败: {e}")
+
+
+def create_intents(cfg, get_volume, set_volume, on_timer):
+    """按配置创建带内置意图的匹配器；cfg["enabled"] 为假时返回 None。"""
+    cfg = cfg or {}
+    if not cfg.get("enabled", True):
+        return None
+    matcher = IntentMatcher(max_len=cfg.get("max_len", 24))
+    matcher.register("stop", [r"(?:停止|停下|别说|不要说|闭嘴|安静)(?:一下)?", r"(?:算了|没事了)"], lambda slots, text: "", end=True)
+    matcher.register("time", [r"(?:现在)?(?:是)?几点(?:钟)?", r"现在(?:是)?(?:什么)?时间", r"(?:报|说)(?:一下)?时间"], handle_time)
+    matcher.register("date", [
+        r"(?P<day>今天|明天|后天|昨天)(?:是)?(?:星期几|周几|礼拜几|几号|几月几号|几月几日|什么日子)",
+        r"(?:现在|今天)?(?:是)?(?:几月几号|几月几日|星期几|周几)",
+    ], handle_date)
+    volume = VolumeIntent(get_volume, set_volume, step=cfg.get("volume_step", 15))
+    matcher.register("volume", volume.patterns(), volume)
+    timer = TimerIntent(on_timer)
+    matcher.register("timer", timer.patterns(), timer)
+    return matcher
@@ -0,0 +1,356 @@
+"""大模型回答缓存：反复被问到的非时效性问题（名词解释、菜谱、讲个笑话）直接用上次的回答。
+
+- 查询规范化：全角半角、大小写、标点、句首客套词/句尾语气词、繁简、中文数字 → 阿拉伯数字
+- 默认只精确匹配规范化后的问题；开启 similarity 后，字符二元组相似度（Dice 系数）够高、
+  且两句只差客套词/语气词（如"的""一下"）时才算近似问法，差一个实词（中国/美国）不算
+- 每条带 TTL（可按问题正则单独设置）；看起来有时效性的问题（今天、最新、天气、价格……）不查不存，
+  走了联网搜索或出错的回答不存
+- 只缓存会话中的首个问题：追问依赖上下文，同样的字面问题答案可能不同
+- 磁盘上一个紧凑的 JSON 索引，超过条数上限按最近最少使用（LRU）淘汰；命中只更新内存，
+  最多每 save_interval_s 秒落盘一次，退出时 flush()
+"""
+
+import difflib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+
+from dialogue.intents import NUM, parse_number
+from utils.logger import logger
+
+try:
+    import opencc
+    _T2S = opencc.OpenCC("t2s").convert
+except ImportError:
+    # 没装 opencc 时用常见繁体字对照表兜底（覆盖日常问句里最常见的字）
+    _T2S_TABLE = str.maketrans(
+        "麼麽為會個們來這說話時間問題東車長門開關電腦機記語讀寫學習書頭腳體氣髮飯麵雞魚鳥點號碼幾種樣實現發"
+        "後覺應該給聽見買賣錢價對錯請讓謝還進過邊遠風雲雨熱湯燒燉煮鹹甜們嗎麼筆紙視網頁務業產醫藥國歷紀"
+        "義愛戀親歡樂聲響圖畫劇詞談論觀變態隨當從區廣場內兩萬與專單雙轉輪飛彈臺灣華傳統計數據庫",
+        "么么为会个们来这说话时间问题东车长门开关电脑机记语读写学习书头脚体气发饭面鸡鱼鸟点号码几种样实现发"
+        "后觉应该给听见买卖钱价对错请让谢还进过边远风云雨热汤烧炖煮咸甜们吗么笔纸视网页务业产医药国历纪"
+        "义爱恋亲欢乐声响图画剧词谈论观变态随当从区广场内两万与专单双转轮飞弹台湾华传统计数据库",
+    )
+
+    def _T2S(text):
+        return text.translate(_T2S_TABLE)
+
+_PUNCT = re.compile(r"[\s，。！？、；：,.!?;:~…\"'“”‘’（）()《》<>【】\[\]\-—_*#]+")
+# 客套词/语气词只在句首句尾去掉（同 intents 的 _PREFIX/_SUFFIX），句中的字可能是问题本身的一部分
+_LEAD = re.compile(r"^(?:请问|麻烦你?|请你|请|帮我|给我|你知道|你知不知道|告诉我|我想知道|我想问|能不能|可以)+")
+_TAIL = re.compile(r"(?:一下|可以吗|好吗|行吗|呢|吗|吧|啊|呀|嘛|哈|啦)+$")
+# 近似匹配时允许两句之间不同的部分：只能是客套词/语气词（规范化后"一下"已变成"1下"）
+_FILLER = re.compile(r"(?:请问|麻烦你?|请你|请|帮我|给我|你知道|你知不知道|告诉我|我想知道|我想问|能不能|可以"
+                     r"|一下|1下|好吗|行吗|的|了|呢|吗|吧|啊|呀|嘛|哈|啦)+")
+_NUMBERS = re.compile(NUM)
+# 有时效性的问题：答案会随时间变化，缓存只会答错
+DEFAULT_FRESHNESS = (r"今天|明天|昨天|后天|今年|明年|去年|现在|目前|当前|最近|最新|刚刚|刚才|实时|这周|本周|下周|上周"
+                     r"|这个月|本月|天气|气温|新闻|热搜|股价|股票|汇率|比分|赛程|价格|多少钱|几点|日期|星期|疫情|油价|金价")
+
+
+def normalize_query(text):
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = _T2S(text)
+    text = _PUNCT.sub("", text)
+    text = _TAIL.sub("", _LEAD.sub("", text))
+    return _NUMBERS.sub(_to_digits, text)
+
+
+def _to_digits(m):
+    n = parse_number(m.group())
+    return str(n) if n is not None else m.group()
+
+
+def _filler_only(a, b):
+    """两句规范化后的问题是否只差客套词/语气词。"""
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    for op, i1, i2, j1, j2 in matcher.get_opcodes():
+        if op == "equal":
+            continue
+        for part in (a[i1:i2], b[j1:j2]):
+            if part and not _FILLER.fullmatch(part):
+                return False
+    return True
+
+
+def _bigrams(text):
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class ResponseCache:
+    def __init__(self, path, max_entries=2000, ttl_s=7 * 86400, similarity=0.0, ttl_rules=None,
+                 freshness_pattern=DEFAULT_FRESHNESS, max_query_len=60, save_interval_s=60.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.similarity = similarity  # 近似匹配阈值（字符二元组 Dice 系数）；<=0 只做精确匹配（默认）
+        self.ttl_rules = [(re.compile(r["pattern"]), r["ttl_s"]) for r in (ttl_rules or [])]
+        self.freshness = re.compile(freshness_pattern) if freshness_pattern else None
+        self.max_query_len = max_query_len
+        self.save_interval_s = save_interval_s  # 命中后的索引落盘间隔；写入新回答时立即落盘
+        self.hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.saved_s = 0.0  # 命中省下的大模型耗时（按未命中时的平均耗时估算）
+        self._miss_latency = []  # 最近未命中时大模型回答的耗时
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # 串行化写文件，写文件时不占 _lock
+        self._dirty = False
+        self._version = 0  # 每次取快照加一，避免旧快照覆盖新快照
+        self._written = 0
+        self._saved_at = time.monotonic()
+        self._entries = self._load()
+        self._grams = {}  # 二元组 → 规范化问题集合（近似匹配的倒排索引）
+        for key in self._entries:
+            self._index_grams(key)
+
+    # ---- 持久化 ----
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        now = time.time()
+        return {k: v for k, v in entries.items() if v.get("expires", 0) > now}
+
+    def _snapshot(self):
+        """复制一份待落盘的索引（调用方持有锁）。"""
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self._version += 1
+        return self._version, {k: dict(v) for k, v in self._entries.items()}
+
+    def _save(self, snapshot):
+        version, entries = snapshot
+        with self._save_lock:
+            if version <= self._written:
+                return
+            self._written = version
+            self._write(entries)
+
+    def _write(self, entries):
+        tmp = self.path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(entries, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning(f"回答缓存写入失败: {e}")
+
+    def flush(self):
+        """把命中后尚未落盘的改动（使用时间、命中次数）写回磁盘。"""
+        with self._lock:
+            if not self._dirty:
+                return
+            snapshot = self._snapshot()
+        self._save(snapshot)
+
+    def _index_grams(self, key):
+        for g in _bigrams(key):
+            self._grams.setdefault(g, set()).add(key)
+
+    def _drop(self, key):
+        self._entries.pop(key, None)
+        for g in _bigrams(key):
+            keys = self._grams.get(g)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._grams[g]
+
+    # ---- 查询 ----
+
+    def cacheable(self, query):
+        """是否参与缓存：过长或有时效性的问题直接绕过。"""
+        if not query or len(query) > self.max_query_len:
+            return False
+        if self.freshness is not None and self.freshness.search(_T2S(query)):
+            return False
+        return True
+
+    def lookup(self, query):
+        """命中返回缓存的回答，否则返回 None。"""
+        started = time.perf_counter()
+        if not self.cacheable(query):
+            self.bypassed += 1
+            return None
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            fuzzy = False
+            if entry is None and self.similarity > 0:
+                key, entry = self._nearest(key)
+                fuzzy = entry is not None
+            if entry is not None and entry["expires"] <= now:
+                self._drop(key)
+                self._dirty = True
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            entry["last_used"] = now
+            entry["hits"] = entry.get("hits", 0) + 1
+            self.hits += 1
+            self.fuzzy_hits += fuzzy
+            saved = self._avg_miss_latency()
+            self.saved_s += saved
+            # 命中只改了使用时间，不必每次重写整个索引；攒到间隔再落盘
+            self._dirty = True
+            snapshot = None
+            if time.monotonic() - self._saved_at >= self.save_interval_s:
+                snapshot = self._snapshot()
+        if snapshot is not None:
+            self._save(snapshot)
+        logger.info(f"回答缓存{'近似' if fuzzy else ''}命中：{query} → {entry['q']}（查找{(time.perf_counter() - started) * 1000:.2f}ms，"
+                    f"约省{saved:.1f}秒；命中{self.hits}/未命中{self.misses}/绕过{self.bypassed}）")
+        return entry["a"]
+
+    def _nearest(self, key):
+        grams = _bigrams(key)
+        if not grams:
+            return key, None
+        counts = {}
+        for g in grams:
+            for other in self._grams.get(g, ()):
+                counts[other] = counts.get(other, 0) + 1
+        scored = []
+        for other, shared in counts.items():
+            score = 2.0 * shared / (len(grams) + len(_bigrams(other)))
+            if score >= self.similarity:
+                scored.append((score, other))
+        # 二元组重合度高不代表同一个问题（中国/美国有多少个省份）：只差客套词/语气词才算
+        for _, other in sorted(scored, reverse=True):
+            if _filler_only(key, other):
+                return other, self._entries.get(other)
+        return key, None
+
+    def _avg_miss_latency(self):
+        return sum(self._miss_latency) / len(self._miss_latency) if self._miss_latency else 0.0
+
+    # ---- 写入 ----
+
+    def store(self, query, answer, latency_s=None):
+        """写入一条回答；latency_s 为本次大模型耗时，用于估算命中省下的时间。"""
+        if latency_s is not None:
+            self._miss_latency = (self._miss_latency + [latency_s])[-50:]
+        if not answer or not self.cacheable(query):
+            return
+        key = normalize_query(query)
+        ttl = self.ttl_s
+        for pattern, rule_ttl in self.ttl_rules:
+            if pattern.search(key):
+                ttl = rule_ttl
+                break
+        if ttl <= 0:
+            return
+        now = time.time()
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = {"q": query, "a": answer, "created": now, "expires": now + ttl, "last_used": now}
+            self._index_grams(key)
+            self._evict()
+            snapshot = self._snapshot()
+        self._save(snapshot)
+        logger.debug(f"回答缓存写入：{query}（TTL {ttl / 3600:.1f}小时）")
+
+    def _evict(self):
+        """过期条目先删，仍超出上限时按最近使用时间淘汰（调用方持有锁）。"""
+        now = time.time()
+        for key in [k for k, v in self._entries.items() if v["expires"] <= now]:
+            self._drop(key)
+        overflow = len(self._entries) - self.max_entries
+        if overflow > 0:
+            for key, _ in sorted(self._entries.items(), key=lambda kv: kv[1]["last_used"])[:overflow]:
+                self._drop(key)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "fuzzy_hits": self.fuzzy_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "saved_s": round(self.saved_s, 1),
+            "avg_miss_latency_s": round(self._avg_miss_latency(), 2),
+        }
+
+
+class CachedChatAdapter:
+    """包装 DeepseekAdapter：同样提供 chat / chat_stream；会话首问命中缓存时不请求大模型。"""
+
+    def __init__(self, adapter, cache):
+        self.adapter = adapter
+        self.cache = cache
+
+    def __getattr__(self, name):
+        # warm/model 等属性透传给底层适配器
+        return getattr(self.adapter, name)
+
+    @staticmethod
+    def _first_question(context):
+        """只有会话首问参与缓存：返回该问题文本，否则返回 None。"""
+        turns = [m for m in context or [] if m.get("role") != "system"]
+        if len(turns) == 1 and turns[0].get("role") == "user":
+            return turns[0].get("content", "")
+        return None
+
+    def _cacheable_answer(self):
+        # 走了联网搜索的回答带时效，出错时的兜底话术也不能存
+        return getattr(self.adapter, "last_source", "chat") == "chat"
+
+    def chat(self, context):
+        query = self._first_question(context)
+        if query is not None:
+            answer = self.cache.lookup(query)
+            if answer is not None:
+                return answer
+        started = time.monotonic()
+        reply = self.adapter.chat(context)
+        if query is not None and self._cacheable_answer():
+            self.cache.store(query, reply, time.monotonic() - started)
+        return reply
+
+    def chat_stream(self, context):
+        query = self._first_question(context)
+        if query is not None:
+            answer = self.cache.lookup(query)
+            if answer is not None:
+                yield answer
+                return
+        started = time.monotonic()
+        parts = []
+        for token in self.adapter.chat_stream(context):
+            parts.append(token)
+            yield token
+        # 完整收完才写入；中途被关闭（如用户打断）时不会走到这里
+        if query is not None and self._cacheable_answer():
+            self.cache.store(query, "".join(parts).strip(), time.monotonic() - started)
+
+
+def create_response_cache(cfg):
+    """按配置创建回答缓存；未启用返回 None。"""
+    cfg = cfg or {}
+    if not cfg.get("enabled", False):
+        return None
+    return ResponseCache(
+        cfg.get("path", "audio_out/tts_cache/responses.json"),
+        max_entries=cfg.get("max_entries", 2000),
+        ttl_s=cfg.get("ttl_s", 7 * 86400),
+        similarity=cfg.get("similarity", 0.0),
+        ttl_rules=cfg.get("ttl_rules"),
+        freshness_pattern=cfg.get("freshness_pattern", DEFAULT_FRESHNESS),
+        max_query_len=cfg.get("max_query_len", 60),
+        save_interval_s=cfg.get("save_interval_s", 60.0),
+    )
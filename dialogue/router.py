@@ -1,31 +1,305 @@
-"""对话路由：普通对话走 DeepSeek，复杂任务走 Codex，Codex 失败自动降级。"""
+"""对话路由：普通对话走 DeepSeek，复杂任务走 Codex，Codex 失败自动降级。
+
+- 按后端记录滚动延迟与失败率；Codex 最近 P90 超出口语交互预算（latency_budget_s）时直接走 DeepSeek，
+  每隔 probe_interval_s 放一次 Codex 重新测量
+- Codex 有硬截止时间 deadline_s：到点结束子进程，改用 DeepSeek
+- hedge 为真时 DeepSeek 与 Codex 并行：Codex 在截止前答出就用 Codex 并断开 DeepSeek 请求，
+  否则结束 Codex 子进程、直接用已在路上的 DeepSeek 回答，用户不必再多等一轮
+"""
+
+import queue
+import threading
+import time
+from collections import deque
 
 from utils.logger import logger
 
 
+class LatencyStats:
+    """单个后端的滚动延迟与失败统计，外加累计延迟直方图（写日志用）。"""
+
+    BUCKETS_S = (0.5, 1, 2, 4, 8, 16, 32, 64)
+
+    def __init__(self, name, window=20):
+        self.name = name
+        self._samples = deque(maxlen=window)  # (耗时秒, 是否成功)
+        self.calls = 0
+        self.failures = 0
+        self.histogram = [0] * (len(self.BUCKETS_S) + 1)
+
+    def record(self, seconds, ok=True):
+        # 失败（超时、被取消）也记下耗时：让用户干等的正是这些
+        self._samples.append((seconds, ok))
+        self.calls += 1
+        self.failures += not ok
+        for i, bound in enumerate(self.BUCKETS_S):
+            if seconds < bound:
+                self.histogram[i] += 1
+                break
+        else:
+            self.histogram[-1] += 1
+        logger.info(f"{self.name}{'' if ok else '失败，'}耗时{seconds:.1f}秒；{self.summary()}")
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, q):
+        if not self._samples:
+            return 0.0
+        values = sorted(s for s, _ in self._samples)
+        return values[min(len(values) - 1, int(q / 100.0 * len(values)))]
+
+    def failure_rate(self):
+        if not self._samples:
+            return 0.0
+        return sum(1 for _, ok in self._samples if not ok) / len(self._samples)
+
+    def summary(self):
+        labels = [f"<{b}s" for b in self.BUCKETS_S] + [f">={self.BUCKETS_S[-1]}s"]
+        hist = " ".join(f"{label}:{n}" for label, n in zip(labels, self.histogram) if n)
+        return (f"最近{len(self._samples)}次 P50 {self.percentile(50):.1f}s P90 {self.percentile(90):.1f}s "
+                f"失败率{self.failure_rate():.0%}；累计{self.calls}次分布 [{hist}]")
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "p50_s": round(self.percentile(50), 2),
+            "p90_s": round(self.percentile(90), 2),
+            "failure_rate": round(self.failure_rate(), 2),
+            "histogram": dict(zip([str(b) for b in self.BUCKETS_S] + ["inf"], self.histogram)),
+        }
+
+
 class DialogueRouter:
     def __init__(self, default_adapter, codex_adapter,
-                 enabled=False, triggers=None, min_length=40):
+                 enabled=False, triggers=None, min_length=40,
+                 latency_budget_s=None, min_samples=3, window=20, probe_interval_s=300,
+                 hedge=False, deadline_s=None):
         self.default_adapter = default_adapter
         self.codex_adapter = codex_adapter
         self.enabled = enabled
         self.triggers = triggers or []
         self.min_length = min_length
+        self.latency_budget_s = latency_budget_s  # Codex 最近 P90 超过它就跳过；None 不限制
+        self.min_samples = min_samples  # 样本不足时不据此跳过
+        self.probe_interval_s = probe_interval_s  # 跳过期间每隔这么久仍放一次 Codex 以更新统计
+        self.hedge = hedge
+        self.deadline_s = deadline_s  # Codex 硬截止（秒）；None 用 Codex 自己的 timeout_s
+        self.latency = {
+            "codex": LatencyStats("Codex", window),
+            "default": LatencyStats("DeepSeek", window),
+        }
+        self._last_codex_at = 0.0
+        self.codex_skipped = 0
 
     def chat(self, context):
         """与各适配器同签名；内部决定走 DeepSeek 还是 Codex。"""
-        if not context or context[-1].get("role") != "user":
-            return self.default_adapter.chat(context)
-        user_text = context[-1].get("content", "")
-        if self.enabled and self._should_route(user_text):
+        if not self._use_codex(context):
+            return self._default_chat(context)
+        logger.info("命中复杂任务路由，尝试调用Codex")
+        if self.hedge:
+            return self._chat_hedged(context)
+        reply = self._codex_chat(context)
+        if reply:
+            return reply
+        logger.warning("Codex未返回有效结果，降级到DeepSeek")
+        return self._default_chat(context)
+
+    def chat_stream(self, context):
+        """流式版本：Codex 不支持流式，命中时整段 yield；其余走默认适配器的 chat_stream。"""
+        if self._use_codex(context):
             logger.info("命中复杂任务路由，尝试调用Codex")
-            reply = self.codex_adapter.chat(context)
+            if self.hedge:
+                yield from self._chat_stream_hedged(context)
+                return
+            reply = self._codex_chat(context)
             if reply:
-                return reply
+                yield reply
+                return
             logger.warning("Codex未返回有效结果，降级到DeepSeek")
-        return self.default_adapter.chat(context)
+        yield from self._default_stream(context)
+
+    def stats(self):
+        return {name: s.stats() for name, s in self.latency.items()}
+
+    # ---- 路由决策 ----
+
+    def _use_codex(self, context):
+        if not self.enabled or not context or context[-1].get("role") != "user":
+            return False
+        if not self._should_route(context[-1].get("content", "")):
+            return False
+        return self._codex_healthy()
 
     def _should_route(self, user_text):
         if len(user_text) >= self.min_length:
             return True
         return any(t in user_text for t in self.triggers)
+
+    def _codex_healthy(self):
+        """Codex 最近 P90 在预算内（或样本不足）才走 Codex；超预算时定期放一次探测。"""
+        stats = self.latency["codex"]
+        if self.latency_budget_s is None or len(stats) < self.min_samples:
+            return True
+        p90 = stats.percentile(90)
+        if p90 <= self.latency_budget_s and stats.failure_rate() < 0.5:
+            return True
+        if time.monotonic() - self._last_codex_at >= self.probe_interval_s:
+            logger.info(f"Codex最近P90 {p90:.1f}秒超出预算{self.latency_budget_s}秒，放一次探测")
+            return True
+        self.codex_skipped += 1
+        logger.info(f"Codex最近P90 {p90:.1f}秒、失败率{stats.failure_rate():.0%}，超出预算{self.latency_budget_s}秒，"
+                    f"本轮直接走DeepSeek（累计跳过{self.codex_skipped}次）")
+        return False
+
+    # ---- 单后端调用（带计时） ----
+
+    def _codex_chat(self, context):
+        started = self._last_codex_at = time.monotonic()
+        reply = self.codex_adapter.chat(context, timeout_s=self.deadline_s)
+        self.latency["codex"].record(time.monotonic() - started, ok=bool(reply))
+        return reply
+
+    def _default_chat(self, context):
+        started = time.monotonic()
+        reply = self.default_adapter.chat(context)
+        self.latency["default"].record(time.monotonic() - started, ok=bool(reply))
+        return reply
+
+    def _default_stream(self, context):
+        """默认适配器的流式回复；记录到首个 token 的耗时。"""
+        started = time.monotonic()
+        if not hasattr(self.default_adapter, "chat_stream"):
+            yield self._default_chat(context)
+            return
+        first = True
+        for token in self.default_adapter.chat_stream(context):
+            if first:
+                first = False
+                self.latency["default"].record(time.monotonic() - started)
+            yield token
+        if first:
+            self.latency["default"].record(time.monotonic() - started, ok=False)
+
+    def _cancel_default(self):
+        cancel = getattr(self.default_adapter, "cancel", None)
+        if cancel is not None:
+            cancel()
+
+    # ---- 对冲 ----
+
+    def _start_codex(self, context, events):
+        def run():
+            try:
+                events.put(("codex", self._codex_chat(context)))
+            except Exception as e:
+                logger.error(f"Codex调用异常: {e}")
+                events.put(("codex", None))
+
+        threading.Thread(target=run, name="router-codex", daemon=True).start()
+
+    def _codex_deadline(self):
+        return time.monotonic() + (self.deadline_s or self.codex_adapter.timeout_s)
+
+    def _chat_hedged(self, context):
+        """Codex 与 DeepSeek 同时请求；Codex 截止前答出用 Codex，否则结束它、用 DeepSeek。"""
+        events = queue.Queue()
+
+        def run_default():
+            try:
+                events.put(("default", self._default_chat(context)))
+            except Exception as e:
+                logger.error(f"DeepSeek调用异常: {e}")
+                events.put(("default", None))
+
+        self._start_codex(context, events)
+        threading.Thread(target=run_default, name="router-default", daemon=True).start()
+        deadline = self._codex_deadline()
+        codex_pending, default_reply = True, None
+        default_done = False
+        while codex_pending or not default_done:
+            timeout = max(0.0, deadline - time.monotonic()) if codex_pending else None
+            try:
+                kind, reply = events.get(timeout=timeout)
+            except queue.Empty:
+                logger.warning(f"Codex超过硬截止{self.deadline_s or self.codex_adapter.timeout_s}秒，结束子进程，改用DeepSeek")
+                self.codex_adapter.cancel()
+                codex_pending = False
+                continue
+            if kind == "codex":
+                codex_pending = False
+                if reply:
+                    logger.info("对冲：采用Codex回答，丢弃DeepSeek回答")
+                    self._cancel_default()
+                    return reply
+                logger.warning("Codex未返回有效结果，采用DeepSeek回答")
+            else:
+                default_done, default_reply = True, reply
+        return default_reply
+
+    def _chat_stream_hedged(self, context):
+        """
+        流式对冲：DeepSeek 的 token 先缓存起来等 Codex；Codex 截止前答出就断开 DeepSeek 流、整段 yield Codex，
+        否则结束 Codex 子进程，先吐出缓存的 token，再接着转发 DeepSeek 流。
+        """
+        events = queue.Queue()
+        stop = threading.Event()
+
+        def pump():
+            tokens = self._default_stream(context)
+            try:
+                for token in tokens:
+                    if stop.is_set():
+                        break
+                    events.put(("token", token))
+            except Exception as e:
+                logger.error(f"DeepSeek流式调用异常: {e}")
+            finally:
+                tokens.close()
+                events.put(("end", None))
+
+        self._start_codex(context, events)
+        threading.Thread(target=pump, name="router-default", daemon=True).start()
+        deadline = self._codex_deadline()
+        buffered = []
+        codex_pending = True
+        default_done = False
+        try:
+            while True:
+                try:
+                    kind, value = events.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    logger.warning(f"Codex超过硬截止{self.deadline_s or self.codex_adapter.timeout_s}秒，结束子进程，改用DeepSeek")
+                    self.codex_adapter.cancel()
+                    codex_pending = False
+                    break
+                if kind == "codex":
+                    codex_pending = False
+                    if value:
+                        logger.info(f"对冲：采用Codex回答，断开DeepSeek流（已缓存{len(buffered)}段）")
+                        stop.set()
+                        self._cancel_default()
+                        yield value
+                        return
+                    logger.warning("Codex未返回有效结果，采用DeepSeek回答")
+                    break
+                if kind == "token":
+                    buffered.append(value)
+                else:
+                    default_done = True
+            yield from buffered
+            while not default_done:
+                kind, value = events.get()
+                if kind == "codex":
+                    continue  # 已被取消的 Codex 迟到的结果
+                if kind == "end":
+                    break
+                yield value
+        finally:
+            # 正常结束或被上层关闭（如用户打断）：两边都不再需要
+            stop.set()
+            if codex_pending:
+                self.codex_adapter.cancel()
+            if not default_done:
+                self._cancel_default()
@@ -1,32 +1,48 @@
+import atexit
 import os
-import re
 import time
+from urllib.parse import urlparse
 from utils.initializer import ensure_initialized
 from asr.xunfei_asr import XunfeiASR
+from asr.selector import create_asr
 from dialogue.codex_adapter import CodexAdapter
+from dialogue.circuit_breaker import CircuitBreaker
 from dialogue.deepseek_adapter import DeepseekAdapter
+from dialogue.context_manager import create_context
 from dialogue.router import DialogueRouter
+from dialogue.intents import create_intents
+from dialogue.response_cache import CachedChatAdapter, create_response_cache
 from tts.xunfei_stream import XunfeiTTSStream
-from audio_out.player import play_audio, play_audio_stream, wait_until_idle
+from tts.tts_cache import CachedTTSStream, TTSCache
+from tts.selector import create_tts
+from tts.speech_stream import ReplyReader, clean_for_speech, split_sentences, synthesize_sentences
+from audio_out.player import configure_engine, get_engine, get_volume, play_audio, play_audio_stream, set_echo_reference, \
+    set_volume, wait_until_idle
+from audio_out.earcons import EarconBank
 from endword.endword_detector import EndwordDetector
+from audio_in.capture import CaptureHub
 from audio_in.recorder import Recorder
+from audio_in.vad import create_vad, vad_endpoint_ms
+from audio_in.aec import FarEndBuffer, create_aec
+from audio_in.barge_in import BargeInListener
+from utils.audio_backend import create_backend, set_backend
 from utils.config_loader import load_config
 from utils.logger import logger
+from utils.tracing import tracer
 from utils.audio_device import DeviceUnavailable
+from utils.warmup import Warmup
 from wakeword.wakeword_detector import WakewordDetector
 
 
-def clean_for_speech(text):
-    """去掉不适合朗读的符号（markdown/星号/列表符等），压缩空白。"""
-    text = re.sub(r"[*#`>_~\[\](){}]", "", text)
-    text = re.sub(r"^\s*[-•·]\s*", "", text, flags=re.M)
-    text = re.sub(r"\s+", " ", text)
-    return text.strip()
-
-
 def main():
     logger.info("==== 智能语音音箱主流程启动 ====")
     config = load_config()
+    # 逐轮延迟追踪：写 logs/traces.jsonl，python -m utils.tracing 查看各阶段分位数
+    tracer.configure(config.get("tracing", {}))
+    # 音频后端须在打开任何音频流之前选定；type: virtual 时用 WAV 当麦克风、播放写入文件，不需要声卡
+    audio_backend = create_backend(config.get("audio_backend", {}), input_name=config["audio_in"].get("device"))
+    set_backend(audio_backend)
+    atexit.register(audio_backend.close)
 
     welcome_audio_path = config.get("welcome_audio_path", "audio_out/welcome.mp3")
     # 幂等初始化：缺少的欢迎音/错误提示音会自动生成，已存在的跳过
@@ -37,7 +53,11 @@ def main():
         api_key=config["xunfei_asr"]["api_key"],
         api_secret=config["xunfei_asr"]["api_secret"],
         hotwords=config["xunfei_asr"].get("hotwords", ""),
+        send_speed=config["xunfei_asr"].get("send_speed", 1.0),
+        ws_url=config["xunfei_asr"].get("ws_url", "wss://iat-api.xfyun.cn/v2/iat"),
     )
+    # 识别入口：按 asr.policy 在讯飞与本地 sherpa-onnx 之间选择（断网时本地兜底）
+    recognizer = create_asr(config.get("asr", {}), asr, samplerate=config["audio_in"]["samplerate"])
     deepseek = DeepseekAdapter(
         api_key=config["deepseek"]["api_key"],
         base_url=config["deepseek"].get("api_url", "https://api.deepseek.com"),
@@ -45,7 +65,9 @@ def main():
         temperature=config["deepseek"].get("temperature", 0.7),
         max_tokens=config["deepseek"].get("max_tokens", 2048),
         system_prompt=config["deepseek"].get("system_prompt", ""),
-        web_search=config["deepseek"].get("web_search", False)
+        web_search=config["deepseek"].get("web_search", False),
+        search_breaker=CircuitBreaker("DeepSeek联网搜索", **config["deepseek"].get("search_breaker", {})),
+        search_hedge_s=config["deepseek"].get("search_hedge_s"),
     )
     codex_cfg = config.get("codex", {})
     codex = CodexAdapter(
@@ -53,24 +75,88 @@ def main():
         provider=codex_cfg.get("provider", "deepseek"),
         system_prompt=config["deepseek"].get("system_prompt", ""),
         timeout_s=codex_cfg.get("timeout_s", 120),
+        pool_size=codex_cfg.get("pool_size", 1) if codex_cfg.get("enabled", False) else 0,
+        max_concurrent=codex_cfg.get("max_concurrent", 2),
+        max_idle_s=codex_cfg.get("max_idle_s", 600),
     )
+    # 预先启动 codex 进程，首个复杂任务免去冷启动；退出时结束空闲进程
+    codex.prewarm()
+    atexit.register(codex.close)
+    # 回答缓存：反复被问到的非时效性问题直接用上次的回答，不再请求 DeepSeek
+    response_cache = create_response_cache(config.get("response_cache", {}))
+    if response_cache is not None:
+        atexit.register(response_cache.flush)
     dialogue = DialogueRouter(
-        default_adapter=deepseek,
+        default_adapter=CachedChatAdapter(deepseek, response_cache) if response_cache else deepseek,
         codex_adapter=codex,
         enabled=codex_cfg.get("enabled", False),
         triggers=codex_cfg.get("triggers", []),
         min_length=codex_cfg.get("min_length", 40),
+        latency_budget_s=codex_cfg.get("latency_budget_s"),
+        min_samples=codex_cfg.get("min_samples", 3),
+        probe_interval_s=codex_cfg.get("probe_interval_s", 300),
+        hedge=codex_cfg.get("hedge", False),
+        deadline_s=codex_cfg.get("deadline_s"),
     )
-    tts_stream = XunfeiTTSStream(
+    xunfei_tts = XunfeiTTSStream(
         app_id=config["xunfei"]["app_id"],
         api_key=config["xunfei"]["api_key"],
         api_secret=config["xunfei"]["api_secret"],
         vcn=config["xunfei"].get("vcn", "x4_yezi"),
         speed=config["xunfei"].get("speed", 50),
         volume=config["xunfei"].get("volume", 50),
-        pitch=config["xunfei"].get("pitch", 50)
+        pitch=config["xunfei"].get("pitch", 50),
+        ws_url=config["xunfei"].get("ws_url", "wss://tts-api.xfyun.cn/v2/tts"),
+    )
+    tts_stream = xunfei_tts
+    pcm_cache_cfg = config.get("tts_pcm_cache", {})
+    if pcm_cache_cfg.get("enabled", False):
+        # 常说的话（告别语、兜底回复、短回答）命中本地 PCM 缓存，不再连接讯飞
+        pcm_cache = TTSCache(
+            cache_dir=pcm_cache_cfg.get("dir", "audio_out/tts_cache/pcm"),
+            max_bytes=int(pcm_cache_cfg.get("max_mb", 64) * 1024 * 1024),
+            max_text_len=pcm_cache_cfg.get("max_text_len", 60),
+            save_interval_s=pcm_cache_cfg.get("save_interval_s", 60.0),
+        )
+        atexit.register(pcm_cache.flush)
+        tts_stream = CachedTTSStream(tts_stream, pcm_cache)
+    # 合成入口：按 tts.policy 在讯飞与本地 sherpa-onnx 之间选择（讯飞首帧超出预算时本句改用本地）
+    tts_stream = create_tts(config.get("tts", {}), tts_stream)
+    # 连接预热：唤醒后趁提示音播放，提前建好 ASR/TTS websocket 与 DeepSeek keep-alive 连接
+    warm_cfg = config.get("warmup", {})
+    ws_ttl_s = warm_cfg.get("ws_ttl_s", 8)  # 讯飞约 10 秒无数据断开，须短于它
+    warmup = Warmup(
+        hosts=[urlparse(asr.ws_url).hostname, urlparse(xunfei_tts.ws_url).hostname,
+               urlparse(config["deepseek"].get("api_url", "https://api.deepseek.com")).hostname],
+        enabled=warm_cfg.get("enabled", True),
     )
+    warmup.register("asr", asr.open_connection, ttl_s=ws_ttl_s)
+    warmup.register("tts", xunfei_tts.open_connection, ttl_s=ws_ttl_s, refill_on_take=True)
+    # DeepSeek 预热的是客户端内部的连接池，warm() 返回值不是连接，不计入节省
+    warmup.register("llm", deepseek.warm, ttl_s=warm_cfg.get("http_ttl_s", 25), reusable=False)
+    asr.warmup = warmup
+    xunfei_tts.warmup = warmup
+
     endword_detector = EndwordDetector(keywords=config["endwords"])
+    vad_cfg = config["audio_in"].get("vad", {})
+    # 回声消除：播放的实际输出作为参考写入共享缓冲区，录音侧按时间戳对齐后减掉
+    aec_cfg = config["audio_in"].get("aec", {})
+    far_end = FarEndBuffer(samplerate=44100) if aec_cfg.get("enabled", False) else None
+    set_echo_reference(far_end)
+    # 共享麦克风采集：唤醒词、录音、打断监听共用进程内唯一一条输入流
+    samplerate = config["audio_in"]["samplerate"]
+    capture_samplerate = config["audio_in"].get("capture_samplerate") or samplerate
+    preroll_cfg = config.get("wakeword", {}).get("preroll", {})
+    hub = CaptureHub(
+        samplerate=capture_samplerate,
+        channels=config["audio_in"]["channels"],
+        dtype=config["audio_in"]["dtype"],
+        block_size=int(config["audio_in"]["block_size"] * capture_samplerate / samplerate),
+        device=config["audio_in"]["device"],
+        buffer_s=config["audio_in"].get("buffer_s", 4.0),
+        silence_s=config["audio_in"].get("silent_unplug_s"),
+    )
+    hub.start()
     recorder = Recorder(
         samplerate=config["audio_in"]["samplerate"],
         channels=config["audio_in"]["channels"],
@@ -80,44 +166,169 @@ def main():
         silence_threshold=config["audio_in"].get("silence_threshold", 2000),
         silence_duration=config["audio_in"].get("silence_duration", 2.0),
         device=config["audio_in"]["device"],
+        capture_samplerate=config["audio_in"].get("capture_samplerate"),
+        vad=create_vad(vad_cfg, samplerate=config["audio_in"]["samplerate"],
+                       silence_threshold=config["audio_in"].get("silence_threshold", 2000)),
+        onset_ms=vad_cfg.get("onset_ms", 150),
+        endpoint_ms=vad_endpoint_ms(vad_cfg),
+        aec=create_aec(aec_cfg, far_end, samplerate=config["audio_in"]["samplerate"]),
+        hub=hub,
+        frontend_cfg=config["audio_in"].get("frontend", {}),
     )
 
-    conversation_history = []
+    # 多轮对话上下文：按 token 预算整轮截取，早期轮次在后台折叠成摘要
+    conversation_history = create_context(config.get("context", {}), summarizer=deepseek.summarize)
 
     output_device = config.get("audio_out", {}).get("device")
+    set_volume(config.get("audio_out", {}).get("volume", 100))
+    if config.get("audio_out", {}).get("engine", False):
+        # 常驻输出引擎：整个进程只打开一次输出流，避免每句话重新开关设备
+        configure_engine(device=output_device)
 
     tts_cache_dir=config["tts_cache_dir"]
+    # 欢迎音与错误提示音启动时解码进内存，播放不再每次启动 mpg123/afplay 进程
+    earcons = EarconBank(engine=get_engine())
+    earcons.load("welcome", welcome_audio_path)
+    for tag in config.get("error_prompts", {}):
+        earcons.load(tag, os.path.join(tts_cache_dir, f"{tag}.mp3"))
+
     def play_standard_error(tag):
+        for t in (tag, "error_system"):
+            if t in earcons:
+                earcons.play(t)
+                return
         err_file = os.path.join(tts_cache_dir, f"{tag}.mp3")
         if os.path.exists(err_file):
             play_audio(err_file, device=output_device)
         else:
             play_audio(os.path.join(tts_cache_dir, "error_system.mp3"), device=output_device)
 
+    pending_capture = []  # 交给下一轮录音的采集订阅（打断或"唤醒词+指令"时，游标已在用户开口处）
+
+    def speak_interruptible(play):
+        """执行播放的同时监听用户打断；被打断返回 "interrupted"，否则返回播放结果。"""
+        if barge is None:
+            return play()
+
+        def interrupt():
+            # 一个回调周期内停播，同时断开进行中的 TTS 连接，不再为没人听的音频付费
+            get_engine().cancel()
+            tts_stream.cancel()
+
+        barge.start(interrupt)
+        try:
+            result = play()
+        finally:
+            handover = barge.stop()
+        if handover is not None:
+            pending_capture.append(handover)
+            return "interrupted"
+        return result
+
     def speak_text(text, retries=1):
-        """合成并播放一句话；失败自动重试，仍失败返回 False。"""
+        """合成并播放一句话；失败自动重试，仍失败返回 False，被用户打断返回 "interrupted"。"""
         for attempt in range(retries + 1):
             try:
                 audio_gen = tts_stream.synthesize_stream(text)
-                if play_audio_stream(audio_gen, device=output_device, samplerate=44100, channels=2, dtype='int16'):
-                    return True
+                result = speak_interruptible(lambda: play_audio_stream(
+                    audio_gen, device=output_device, samplerate=44100, channels=2, dtype='int16',
+                    src_samplerate=tts_stream.samplerate))
+                if result:
+                    return result
             except Exception as e:
                 logger.warning(f"语音合成/播放失败（第{attempt+1}次）: {e}")
         return False
 
+    def announce(text):
+        """主动播报（如定时提醒）：不在对话中，不监听打断，直接合成播放。"""
+        play_audio_stream(tts_stream.synthesize_stream(text), device=output_device, samplerate=44100, channels=2,
+                          dtype='int16', src_samplerate=tts_stream.samplerate)
+
+    # 本地意图：几点、星期几、音量、定时、停止等简单指令本地直接回答，不走大模型
+    intents_cfg = config.get("intents", {})
+    intents = create_intents(intents_cfg, get_volume, set_volume, on_timer=announce)
+
+    # 流式对话：大模型边生成，TTS 边逐句合成，播放一条连续音频流
+    stream_reply = config["deepseek"].get("stream", False)
+
+    def speak_reply_stream(context):
+        """流式回复并朗读；返回 (完整回复文本, 播放结果)，被用户打断时播放结果为 "interrupted"。"""
+        started = time.monotonic()
+
+        def on_first_token():
+            conversation_history.record_turn(time.monotonic() - started)
+            if intents is not None:
+                intents.observe_llm(time.monotonic() - started)
+
+        # 回复由独立线程读完，与朗读进度无关：朗读失败或提前结束时历史记录仍是完整回复
+        reply = ReplyReader(dialogue.chat_stream(context=context), on_first=on_first_token)
+        audio_gen = synthesize_sentences(split_sentences(reply), tts_stream)
+        ok = False
+        try:
+            ok = speak_interruptible(lambda: play_audio_stream(
+                audio_gen, device=output_device, samplerate=44100, channels=2, dtype='int16',
+                    src_samplerate=tts_stream.samplerate))
+        except Exception as e:
+            logger.warning(f"流式朗读失败: {e}")
+        if ok == "interrupted":
+            # 用户已打断：不再等剩余回复，历史记录以已生成部分为准
+            reply.stop()
+            return reply.text, ok
+        return reply.wait(timeout=30), ok
+
     def on_wakeword_detected():
+        # 提示音播放期间后台预热各连接
+        warmup.begin_session()
+        # 空闲太久的 codex 预热进程已作废（max_idle_s），趁唤醒换新，免得本次复杂任务冷启动
+        codex.prewarm()
         try:
-            play_audio(config["welcome_audio_path"], device=output_device)
+            span = wakeword_detector.last_keyword_span
+            if preroll_cfg.get("enabled", True) and span is not None:
+                # 一口气说"唤醒词+指令"：指令已在采集缓冲区里，跳过欢迎音直接从唤醒词结束处送 ASR
+                capture = recorder.speech_follows(span, listen_ms=preroll_cfg.get("listen_ms", 300))
+                if capture is not None:
+                    pending_capture.append(capture)
+            if pending_capture:
+                logger.info("唤醒词后紧接着说了指令，跳过欢迎提示音")
+            else:
+                with tracer.span("chime"):
+                    if "welcome" in earcons:
+                        earcons.play("welcome", since=wakeword_detector.last_detected_at)
+                    else:
+                        play_audio(config["welcome_audio_path"], device=output_device)
             logger.info("已唤醒，进入多轮对话...")
             blank_count = 1
+            first_turn = True
     
             while True:   # 增加循环
-                # 等音箱把话说完再开始下一轮录音，避免录到自己
-                wait_until_idle(timeout_s=60)
-                audio_blocks = recorder.record_stream()
-                user_text = asr.recognize_stream(audio_blocks)
+                if not first_turn:
+                    # 多轮中的下一轮：上一轮的 trace 写出，新开一条
+                    tracer.begin("followup")
+                first_turn = False
+                if recorder.aec is None:
+                    # 没有回声消除：等音箱把话说完再开始下一轮录音，避免录到自己
+                    wait_until_idle(timeout_s=60)
+                warmup.report_turn()
+                warmup.prepare("asr", "llm")
+                if pending_capture:
+                    # 刚被打断或唤醒词后紧接着说话：接管已定位到开口处的采集，缓冲区里的开头先送，不丢字
+                    audio_blocks = recorder.record_stream(capture=pending_capture.pop())
+                else:
+                    audio_blocks = recorder.record_stream()
+                user_text = recognizer.recognize_stream(audio_blocks)
                 logger.info(f"用户语音识别结果: {user_text}")
+                if user_text.strip():
+                    # 大模型生成期间备好 TTS 连接
+                    warmup.prepare("tts")
+                    warmup.take("llm")
     
+                if not user_text.strip() and recognizer.last_backend == "cloud" and asr.failed == "connect":
+                    # 连不上讯飞又没有本地模型：提示服务不可用，而不是让用户重说
+                    play_standard_error("error_asr")
+                    break
+
+                intent = intents.match(user_text) if intents is not None and user_text.strip() else None
+
                 if not user_text.strip():
                     logger.debug("识别结果为空，提示用户重说。")
                     play_standard_error("error_no_input")
@@ -129,25 +340,57 @@ def main():
                         blank_count = 1
                         break    # 多次为空直接退出
     
+                elif intent is not None and intent.end:
+                    logger.info(f"本地意图[{intent.name}]：结束对话，清空历史对话。")
+                    if intent.reply:
+                        speak_text(intent.reply)
+                    conversation_history.clear()
+                    break
+
                 elif endword_detector.is_end(user_text):
                     logger.info("检测到结束词，清空历史对话。")
-                    tmp_context = conversation_history + [{"role": "user", "content": user_text}]
-                    tmp_context.append({
-                        "role": "user",
-                        "content": "请根据以上整段对话，用一句自然、简短的中文结束语向我告别。不要提出新问题，不要额外延伸。"
-                    })
-                    farewell_text = deepseek.chat(context=tmp_context).strip()
-                    if not farewell_text:
-                        farewell_text = "好的，下次再见。"
-                    farewell_text = clean_for_speech(farewell_text)
+                    if intents is not None:
+                        # 预置结束语，不再为一句告别往返大模型
+                        farewell_text = intents.farewell(intents_cfg.get("farewells", []))
+                    else:
+                        tmp_context = conversation_history.window(extra=[
+                            {"role": "user", "content": user_text},
+                            {
+                                "role": "user",
+                                "content": "请根据以上整段对话，用一句自然、简短的中文结束语向我告别。不要提出新问题，不要额外延伸。"
+                            },
+                        ])
+                        farewell_text = deepseek.chat(context=tmp_context).strip()
+                        if not farewell_text:
+                            farewell_text = "好的，下次再见。"
+                        farewell_text = clean_for_speech(farewell_text)
                     speak_text(farewell_text)
                     conversation_history.clear()
                     break       # 跳出多轮对话，回到唤醒监听
     
+                elif intent is not None:
+                    # 本地意图直接回答；问答仍记入历史，后续追问大模型也能接上
+                    conversation_history.append({"role": "user", "content": user_text})
+                    conversation_history.append({"role": "assistant", "content": intent.reply})
+                    logger.info(f"本地意图回复: {intent.reply}")
+                    if not speak_text(intent.reply):
+                        play_standard_error("error_tts")
+
                 else:
                     logger.debug("进入多轮对话处理。")
                     conversation_history.append({"role": "user", "content": user_text})
-                    reply_text = dialogue.chat(context=conversation_history)
+                    if stream_reply:
+                        reply_text, ok = speak_reply_stream(conversation_history.window())
+                        conversation_history.append({"role": "assistant", "content": reply_text})
+                        logger.info(f"AI回复文本: {reply_text}")
+                        if not ok:
+                            play_standard_error("error_tts")
+                        continue
+                    started = time.monotonic()
+                    reply_text = dialogue.chat(context=conversation_history.window())
+                    conversation_history.record_turn(time.monotonic() - started)
+                    if intents is not None:
+                        intents.observe_llm(time.monotonic() - started)
                     conversation_history.append({"role": "assistant", "content": reply_text})
                     logger.info(f"AI回复文本: {reply_text}")
                     reply_text = clean_for_speech(reply_text)
@@ -171,6 +414,12 @@ def main():
                 play_standard_error("error_tts")
             else:
                 play_standard_error("error_system")
+        finally:
+            tracer.end()
+            warmup.report_turn()
+            warmup.end_session()
+            while pending_capture:
+                pending_capture.pop().close()
 
 
     # ==== 配置并启动唤醒词检测 ====
@@ -181,14 +430,29 @@ def main():
             "keywords_file",
             os.path.join(wake_cfg["model_dir"], "keywords_custom.txt"),
         ),
-        "audio_device_index": wake_cfg.get("audio_device_index"),
-        "channels": config["audio_in"]["channels"],
+        "hub": hub,
+        "pipeline_factory": lambda: recorder.make_pipeline(dtype="float32", aec=False),
         "keywords_score": wake_cfg.get("keywords_score", 1.0),
         "keywords_threshold": wake_cfg.get("keywords_threshold", 0.25),
         "num_threads": wake_cfg.get("num_threads", 2),
     }
     wakeword_detector = WakewordDetector(**args)
 
+    # 语音打断：播放期间继续听麦克风，需要常驻输出引擎才能即时停播
+    barge_cfg = config.get("barge_in", {})
+    barge = None
+    if barge_cfg.get("enabled", False):
+        if get_engine() is None:
+            logger.warning("语音打断需要启用 audio_out.engine，已忽略 barge_in 配置")
+        else:
+            barge = BargeInListener(
+                recorder,
+                mode=barge_cfg.get("mode", "kws"),
+                spotter_factory=wakeword_detector.create_spotter,
+                min_speech_ms=barge_cfg.get("min_speech_ms", 400),
+                margin_db=barge_cfg.get("margin_db", 18.0),
+            )
+
     # 启动唤醒词监听，检测到后进入对话主流程
     while True:
         wakeword_detector.start(on_wakeword_detected)
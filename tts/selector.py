@@ -0,0 +1,133 @@
+"""TTS 后端选择：讯飞云端 + sherpa-onnx 本地，对外仍是 synthesize_stream(text)。
+
+- cloud：只用讯飞（原行为）
+- local：只用本地模型，不需要网络
+- fallback：先请求讯飞，first_chunk_budget_s 内没拿到首帧（连不上、超时、报错）就放弃这一句，改用本地合成
+各后端采样率可以不同，这里统一重采样到 samplerate 再下发，播放端按 samplerate 播放即可。
+"""
+
+import queue
+import threading
+import time
+
+import numpy as np
+
+from tts.sherpa_tts import create_local_tts
+from tts.speech_stream import SynthesisCancelled
+from utils.logger import logger
+from utils.resample import make_resampler
+
+POLICIES = ("cloud", "local", "fallback")
+
+_END = object()
+
+
+class TTSSelector:
+    def __init__(self, cloud, local=None, policy="fallback", first_chunk_budget_s=1.0, samplerate=16000):
+        if policy not in POLICIES:
+            raise ValueError(f"未知的TTS策略: {policy}，可选 {POLICIES}")
+        if local is None and policy != "cloud":
+            logger.warning(f"TTS策略 {policy} 需要本地模型，未加载，改为只用讯飞")
+            policy = "cloud"
+        self.cloud = cloud
+        self.local = local
+        self.policy = policy
+        self.first_chunk_budget_s = first_chunk_budget_s
+        self.samplerate = samplerate  # 下发 PCM 的统一采样率
+        self.fallbacks = 0  # 改用本地合成的句数
+
+    def cancel(self):
+        """中止所有后端进行中的合成（如用户打断）。"""
+        self.cloud.cancel()
+        if self.local is not None:
+            self.local.cancel()
+
+    def _resampled(self, backend, chunks):
+        """把后端输出重采样到统一采样率；采样率一致时原样透传。"""
+        resampler = make_resampler(getattr(backend, "samplerate", 16000), self.samplerate)
+        for chunk in chunks:
+            if resampler is None:
+                yield chunk
+            else:
+                yield resampler.process(np.frombuffer(chunk, dtype=np.int16)).tobytes()
+
+    def synthesize_stream(self, text):
+        if self.policy == "local":
+            yield from self._resampled(self.local, self.local.synthesize_stream(text))
+            return
+        if self.policy == "cloud":
+            yield from self._resampled(self.cloud, self.cloud.synthesize_stream(text))
+            return
+        yield from self._with_fallback(text)
+
+    def _with_fallback(self, text):
+        """后台线程拉讯飞的帧；首帧超出预算或出错时放弃讯飞，本句改用本地合成。"""
+        frames = queue.Queue()
+        stop = threading.Event()
+        done = threading.Event()
+
+        def pump():
+            audio_gen = self.cloud.synthesize_stream(text)
+            try:
+                for chunk in audio_gen:
+                    if stop.is_set():
+                        break
+                    frames.put(chunk)
+                frames.put(_END)
+            except Exception as e:
+                frames.put(e)
+            finally:
+                audio_gen.close()
+                done.set()
+
+        started = time.monotonic()
+        threading.Thread(target=pump, name="tts-cloud", daemon=True).start()
+        try:
+            try:
+                first = frames.get(timeout=self.first_chunk_budget_s)
+            except queue.Empty:
+                first = None
+                reason = f"首帧超出预算{self.first_chunk_budget_s}秒"
+            else:
+                if isinstance(first, SynthesisCancelled):
+                    # 被外部取消（打断）：不是讯飞出错，不改用本地合成
+                    raise first
+                if isinstance(first, Exception):
+                    reason = f"合成失败（{first}）"
+                    first = None
+            if first is None:
+                stop.set()
+                self.cloud.cancel()
+                self.fallbacks += 1
+                logger.warning(f"讯飞TTS{reason}，本句改用本地合成（累计{self.fallbacks}句）")
+                yield from self._resampled(self.local, self.local.synthesize_stream(text))
+                return
+            logger.debug(f"讯飞TTS首帧 {(time.monotonic() - started) * 1000:.0f}ms")
+            yield from self._resampled(self.cloud, self._drain(first, frames))
+        finally:
+            stop.set()
+            if not done.is_set():
+                # 外部提前关闭（如打断）：后台可能正阻塞在接收上，断开连接让它退出
+                self.cloud.cancel()
+
+    def _drain(self, first, frames):
+        chunk = first
+        while chunk is not _END:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+            chunk = frames.get()
+
+
+def create_tts(cfg, cloud):
+    """按配置组装合成入口：cloud 为（可能带缓存的）XunfeiTTSStream，本地模型按 cfg["sherpa"] 加载。"""
+    cfg = cfg or {}
+    policy = cfg.get("policy", "cloud")
+    local = create_local_tts(cfg.get("sherpa")) if policy != "cloud" else None
+    return TTSSelector(
+        cloud,
+        local,
+        policy=policy,
+        first_chunk_budget_s=cfg.get("first_chunk_budget_s", 1.0),
+        samplerate=cfg.get("samplerate", getattr(cloud, "samplerate", 16000)),
+    )
@@ -0,0 +1,143 @@
+"""本地离线 TTS（sherpa-onnx VITS / Matcha），与 XunfeiTTSStream 同样提供 synthesize_stream(text)。
+
+- 合成在后台线程进行，sherpa 每合成完一个分句就回调一次，这里立即按帧 yield，长句不必等整段合成完
+- 输出为模型自身采样率（samplerate 属性，VITS 中文模型多为 16k/22.05k/44.1k）的单声道 int16 PCM，
+  需要统一采样率时由上层（tts.selector）重采样
+"""
+
+import glob
+import os
+import queue
+import threading
+
+import numpy as np
+import sherpa_onnx
+
+from tts.speech_stream import SynthesisCancelled
+from utils.logger import logger
+from utils.resample import make_resampler
+from utils.tracing import tracer
+
+_END = object()
+_CHUNK_SAMPLES = 2048  # 回调一次给出整句，按约 100ms 分帧下发，播放端缓冲更平滑
+
+
+def _optional(path):
+    return path if os.path.exists(path) else ""
+
+
+class SherpaTTS:
+    def __init__(self, model_dir, model_type="vits", model=None, vocoder=None, sid=0, speed=1.0, num_threads=2):
+        self.model_dir = model_dir
+        self.model_type = model_type
+        self.sid = sid
+        self.speed = speed
+        self._cancel = threading.Event()
+        tokens = os.path.join(model_dir, "tokens.txt")
+        lexicon = _optional(os.path.join(model_dir, "lexicon.txt"))
+        dict_dir = _optional(os.path.join(model_dir, "dict"))
+        data_dir = _optional(os.path.join(model_dir, "espeak-ng-data"))
+        if model is None:
+            candidates = sorted(glob.glob(os.path.join(model_dir, "*.onnx")))
+            if not candidates:
+                raise FileNotFoundError(f"模型目录 {model_dir} 中找不到 .onnx 模型")
+            model = candidates[0]
+        elif not os.path.isabs(model):
+            model = os.path.join(model_dir, model)
+        if model_type == "matcha":
+            if not vocoder:
+                raise ValueError("Matcha 模型需要指定 vocoder（如 vocos-22khz-univ.onnx）")
+            model_config = sherpa_onnx.OfflineTtsModelConfig(
+                matcha=sherpa_onnx.OfflineTtsMatchaModelConfig(
+                    acoustic_model=model, vocoder=vocoder, lexicon=lexicon, tokens=tokens,
+                    data_dir=data_dir, dict_dir=dict_dir,
+                ),
+                num_threads=num_threads,
+            )
+        else:
+            model_config = sherpa_onnx.OfflineTtsModelConfig(
+                vits=sherpa_onnx.OfflineTtsVitsModelConfig(
+                    model=model, lexicon=lexicon, tokens=tokens, data_dir=data_dir, dict_dir=dict_dir,
+                ),
+                num_threads=num_threads,
+            )
+        # 中文模型自带的数字/日期/电话读法规则
+        rule_fsts = ",".join(sorted(glob.glob(os.path.join(model_dir, "*.fst"))))
+        self.tts = sherpa_onnx.OfflineTts(sherpa_onnx.OfflineTtsConfig(
+            model=model_config, rule_fsts=rule_fsts, max_num_sentences=1,
+        ))
+        self.samplerate = self.tts.sample_rate
+        logger.info(f"本地TTS模型已加载：{model_type}，{os.path.basename(model)}，{self.samplerate}Hz")
+
+    def cancel(self):
+        """中止进行中的合成（如用户打断）：当前分句合成完后即停止，不再下发。"""
+        self._cancel.set()
+
+    def synthesize_stream(self, text):
+        """生成器：逐帧 yield samplerate 单声道 int16 PCM（bytes）。"""
+        self._cancel.clear()
+        frames = queue.Queue()
+        stop = threading.Event()
+        errors = []
+
+        def on_samples(samples, progress):
+            if stop.is_set() or self._cancel.is_set():
+                return 0
+            pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+            for i in range(0, len(pcm), _CHUNK_SAMPLES):
+                frames.put(pcm[i:i + _CHUNK_SAMPLES].tobytes())
+            return 1
+
+        def worker():
+            try:
+                self.tts.generate(text, sid=self.sid, speed=self.speed, callback=on_samples)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                frames.put(_END)
+
+        threading.Thread(target=worker, name="sherpa-tts", daemon=True).start()
+        try:
+            while True:
+                chunk = frames.get()
+                if chunk is _END:
+                    break
+                tracer.mark("tts.first_chunk", backend="sherpa")
+                yield chunk
+        finally:
+            stop.set()
+        if errors:
+            raise RuntimeError(f"本地TTS合成异常：{errors[0]}")
+        if self._cancel.is_set():
+            raise SynthesisCancelled("本地TTS合成已取消")
+
+    def synthesize_pcm(self, text, samplerate=None):
+        """整段合成，返回 int16 PCM（bytes）；samplerate 与模型不同时重采样（生成离线提示音用）。"""
+        audio = self.tts.generate(text, sid=self.sid, speed=self.speed)
+        pcm = (np.clip(np.asarray(audio.samples, dtype=np.float32), -1.0, 1.0) * 32767).astype(np.int16)
+        resampler = make_resampler(self.samplerate, samplerate) if samplerate else None
+        return (resampler.process(pcm) if resampler else pcm).tobytes()
+
+
+def create_local_tts(cfg):
+    """按配置创建本地 TTS；未配置或模型缺失时返回 None。"""
+    cfg = cfg or {}
+    model_dir = cfg.get("model_dir")
+    if not model_dir:
+        return None
+    if not os.path.isdir(model_dir):
+        logger.warning(f"本地TTS模型目录不存在：{model_dir}")
+        return None
+    try:
+        return SherpaTTS(
+            model_dir,
+            model_type=cfg.get("model_type", "vits"),
+            model=cfg.get("model"),
+            vocoder=cfg.get("vocoder"),
+            sid=cfg.get("sid", 0),
+            speed=cfg.get("speed", 1.0),
+            num_threads=cfg.get("num_threads", 2),
+        )
+    except Exception as e:
+        logger.warning(f"本地TTS模型加载失败：{e}")
+        return None
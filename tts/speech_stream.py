@@ -0,0 +1,183 @@
+"""流式朗读：把大模型逐字吐出的文本切成可朗读的短句，边合成边播放。
+
+时间线：首句凑够就立即送 TTS，后续句子在前一句播放期间合成，
+播放端拿到的是一条连续的 PCM 流，首个声音只取决于第一句的生成速度。
+"""
+
+import queue
+import re
+import threading
+import time
+
+from utils.logger import logger
+
+# 强断句：句号/问号/感叹号/分号/换行，遇到即切
+_STRONG_BREAKS = set("。！？!?；;\n")
+# 弱断句：逗号/顿号/冒号，凑够最短长度才切（首句阈值更低，尽快出声）
+_WEAK_BREAKS = set("，,、：:")
+
+_END = object()
+
+
+class SynthesisCancelled(RuntimeError):
+    """合成被 cancel() 中止（如用户打断），不是合成失败：流式朗读遇到它不再合成后续分句。"""
+
+
+def clean_for_speech(text):
+    """去掉不适合朗读的符号（markdown/星号/列表符等），压缩空白。"""
+    text = re.sub(r"[*#`>_~\[\](){}]", "", text)
+    text = re.sub(r"^\s*[-•·]\s*", "", text, flags=re.M)
+    text = re.sub(r"\s+", " ", text)
+    return text.strip()
+
+
+def split_sentences(tokens, first_min_chars=4, min_chars=12, max_chars=80):
+    """
+    生成器：把 token 流切成清洗后的短句。
+    - 强标点处必切；弱标点处在已积累够 min_chars（首句 first_min_chars）时切
+    - 超过 max_chars 仍无标点时强制切，避免长句拖慢出声
+    """
+    buf = []
+    size = 0
+    emitted = 0
+
+    def flush():
+        nonlocal size, emitted
+        text = clean_for_speech("".join(buf))
+        buf.clear()
+        size = 0
+        if text:
+            emitted += 1
+            return text
+        return None
+
+    for token in tokens:
+        if not token:
+            continue
+        for ch in token:
+            buf.append(ch)
+            size += 1
+            threshold = first_min_chars if emitted == 0 else min_chars
+            if ch in _STRONG_BREAKS or (ch in _WEAK_BREAKS and size >= threshold) or size >= max_chars:
+                text = flush()
+                if text:
+                    yield text
+    text = flush()
+    if text:
+        yield text
+
+
+def synthesize_sentences(sentences, tts):
+    """
+    生成器：后台线程逐句调用 tts.synthesize_stream，前台按顺序 yield PCM 帧。
+    后台线程同时负责拉取上游 token（即大模型生成），因此生成、合成、播放三者并行。
+    单句合成失败只跳过该句；合成被取消（SynthesisCancelled）时不再合成后续分句；
+    一个声音都没合成出来时抛出异常，交给上层重试/报错。
+    外部关闭生成器（如播放失败）时，后台线程会尽快停下并关闭进行中的 TTS 连接。
+    """
+    audio_queue = queue.Queue()
+    stop = threading.Event()
+    errors = []
+
+    def worker():
+        try:
+            for sentence in sentences:
+                if stop.is_set():
+                    break
+                logger.debug(f"流式朗读，合成分句: {sentence}")
+                audio_gen = tts.synthesize_stream(sentence)
+                try:
+                    for chunk in audio_gen:
+                        if stop.is_set():
+                            break
+                        audio_queue.put(chunk)
+                except SynthesisCancelled:
+                    logger.info("合成已取消，不再朗读后续分句")
+                    break
+                except Exception as e:
+                    logger.warning(f"分句合成失败，跳过: {e}")
+                    errors.append(e)
+                finally:
+                    audio_gen.close()
+        except Exception as e:
+            logger.error(f"流式朗读上游异常: {e}")
+            errors.append(e)
+        finally:
+            audio_queue.put(_END)
+
+    started = time.monotonic()
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    produced = 0
+    try:
+        while True:
+            chunk = audio_queue.get()
+            if chunk is _END:
+                break
+            if produced == 0:
+                logger.info(f"流式朗读首帧音频就绪，耗时 {(time.monotonic() - started) * 1000:.0f}ms")
+            produced += 1
+            yield chunk
+    finally:
+        stop.set()
+        thread.join(timeout=5)
+    if produced == 0 and errors:
+        raise RuntimeError(f"流式朗读未合成任何音频: {errors[-1]}")
+
+
+class ReplyReader:
+    """
+    后台线程把大模型的 token 流读完：text 始终是已收到的全文，与朗读进度无关。
+    迭代本对象得到同样的 token 流（交给 split_sentences），上游异常在迭代时原样抛出；
+    朗读提前结束时 wait() 等上游读完（保证对话历史完整），被打断时 stop() 放弃剩余回复。
+    """
+
+    def __init__(self, tokens, on_first=None):
+        self._tokens = tokens
+        self._on_first = on_first  # 收到首个 token 时回调（记录首字延迟等）
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._parts = []
+        self._thread = threading.Thread(target=self._run, name="reply-reader", daemon=True)
+        self._thread.start()
+
+    @property
+    def text(self):
+        return "".join(self._parts).strip()
+
+    def _run(self):
+        try:
+            for token in self._tokens:
+                if self._stop.is_set():
+                    break
+                if not self._parts and self._on_first is not None:
+                    self._on_first()
+                self._parts.append(token)
+                self._queue.put(token)
+        except Exception as e:
+            self._queue.put(e)
+        finally:
+            close = getattr(self._tokens, "close", None)
+            if close is not None:
+                close()
+            self._queue.put(_END)
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def stop(self):
+        """不再读取剩余回复（下一个 token 到达时关闭上游）。"""
+        self._stop.set()
+
+    def wait(self, timeout=None):
+        """等上游读完，返回全文；超时返回已收到部分。"""
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning("大模型回复仍未读完，历史记录以已收到部分为准。")
+        return self.text
@@ -0,0 +1,220 @@
+"""TTS PCM 磁盘缓存：按内容寻址，常说的话（告别语、兜底回复、短回答）只合成一次。
+
+缓存键 = (规范化文本, vcn, speed, volume, pitch, auf)；
+未命中时边流式播放边把 PCM 帧写入磁盘（tee），合成完整才落盘生效；
+命中时直接 mmap 读取 PCM 文件回放，不再连接讯飞。
+总大小超过上限时按最近最少使用（LRU）淘汰。
+命中只在内存里更新使用时间，索引最多每 save_interval_s 秒落盘一次（写入/淘汰时立即落盘），退出时 flush()。
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import threading
+import time
+import unicodedata
+
+from utils.logger import logger
+from utils.tracing import tracer
+
+_INDEX_FILE = "index.json"
+# 回放分帧：1280 字节 = 16k 单声道 16bit 的 40ms，与讯飞下发的帧长一致
+_REPLAY_CHUNK = 1280
+
+
+def normalize_text(text):
+    """规范化缓存文本：全角转半角（NFKC）、压缩空白、去首尾空格。"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return " ".join(text.split())
+
+
+class TTSCache:
+    def __init__(self, cache_dir, max_bytes=64 * 1024 * 1024, max_text_len=60, save_interval_s=60.0):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_text_len = max_text_len
+        self.save_interval_s = save_interval_s
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # 串行化写文件，写文件时不占 _lock（命中在播放起点上）
+        self._dirty = False
+        self._version = 0  # 每次取快照加一，避免旧快照覆盖新快照
+        self._written = 0
+        self._saved_at = time.monotonic()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index = self._load_index()
+
+    def _load_index(self):
+        path = os.path.join(self.cache_dir, _INDEX_FILE)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        # 丢弃文件已不存在的条目（如手动清理过目录）
+        return {k: v for k, v in index.items() if os.path.exists(self._path(k))}
+
+    def _snapshot(self):
+        """复制一份待落盘的索引（调用方持有锁）。"""
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self._version += 1
+        return self._version, {k: dict(v) for k, v in self._index.items()}
+
+    def _save_index(self, snapshot):
+        version, index = snapshot
+        with self._save_lock:
+            if version <= self._written:
+                return
+            self._written = version
+            self._write_index(index)
+
+    def _write_index(self, index):
+        path = os.path.join(self.cache_dir, _INDEX_FILE)
+        tmp = path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(index, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"TTS缓存索引写入失败: {e}")
+
+    def flush(self):
+        """把命中后尚未落盘的使用时间写回索引。"""
+        with self._lock:
+            if not self._dirty:
+                return
+            snapshot = self._snapshot()
+        self._save_index(snapshot)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pcm")
+
+    def make_key(self, text, tts):
+        parts = [normalize_text(text), tts.vcn, tts.speed, tts.volume, tts.pitch, tts.auf]
+        raw = json.dumps(parts, ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def cacheable(self, text):
+        text = normalize_text(text)
+        return 0 < len(text) <= self.max_text_len
+
+    @property
+    def total_bytes(self):
+        return sum(entry["size"] for entry in self._index.values())
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._index),
+                "bytes": self.total_bytes,
+            }
+
+    def lookup(self, key):
+        """命中返回 PCM 文件路径并刷新最近使用时间；未命中返回 None。"""
+        snapshot = None
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None or not os.path.exists(self._path(key)):
+                if self._index.pop(key, None) is not None:
+                    self._dirty = True
+                self.misses += 1
+                return None
+            entry["last_used"] = time.time()
+            self.hits += 1
+            # 命中在播放起点上：只标记待写，攒到间隔再落盘，不在这里同步重写整个索引
+            self._dirty = True
+            if time.monotonic() - self._saved_at >= self.save_interval_s:
+                snapshot = self._snapshot()
+        if snapshot is not None:
+            self._save_index(snapshot)
+        return self._path(key)
+
+    def replay(self, path):
+        """生成器：mmap 读取缓存的 PCM，按帧 yield。"""
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for offset in range(0, size, _REPLAY_CHUNK):
+                    yield mm[offset:offset + _REPLAY_CHUNK]
+
+    def tee(self, key, text, audio_generator):
+        """生成器：透传合成帧并同时写入临时文件；完整结束才提交到缓存，中途失败/关闭则丢弃。"""
+        part_path = self._path(key) + f".{threading.get_ident()}.part"
+        completed = False
+        try:
+            with open(part_path, "wb") as f:
+                for chunk in audio_generator:
+                    f.write(chunk)
+                    yield chunk
+            completed = True
+        finally:
+            if completed:
+                self._commit(key, text, part_path)
+            else:
+                try:
+                    os.remove(part_path)
+                except OSError:
+                    pass
+
+    def _commit(self, key, text, part_path):
+        size = os.path.getsize(part_path)
+        if size == 0:
+            os.remove(part_path)
+            return
+        os.replace(part_path, self._path(key))
+        with self._lock:
+            self._index[key] = {"size": size, "last_used": time.time(), "text": normalize_text(text)}
+            self._evict()
+            snapshot = self._snapshot()
+        self._save_index(snapshot)
+        logger.debug(f"TTS缓存写入: {text}（{size}字节）")
+
+    def _evict(self):
+        """按最近使用时间淘汰，直到总大小不超过上限（调用方持有锁）。"""
+        total = self.total_bytes
+        for key, entry in sorted(self._index.items(), key=lambda kv: kv[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            total -= entry["size"]
+            del self._index[key]
+            logger.debug(f"TTS缓存淘汰: {entry.get('text', key)}")
+
+
+class CachedTTSStream:
+    """包装 XunfeiTTSStream：与其同样提供 synthesize_stream(text)，命中缓存时不联网。"""
+
+    def __init__(self, tts, cache):
+        self.tts = tts
+        self.cache = cache
+
+    def __getattr__(self, name):
+        # vcn/speed/auf 等属性透传给底层 TTS
+        return getattr(self.tts, name)
+
+    def synthesize_stream(self, text):
+        if not self.cache.cacheable(text):
+            yield from self.tts.synthesize_stream(text)
+            return
+        key = self.cache.make_key(text, self.tts)
+        path = self.cache.lookup(key)
+        if path is not None:
+            stats = self.cache.stats()
+            logger.info(f"TTS缓存命中: {text}（命中{stats['hits']}/未命中{stats['misses']}）")
+            tracer.mark("tts.first_chunk", backend="cache")
+            yield from self.cache.replay(path)
+            return
+        logger.debug(f"TTS缓存未命中: {text}")
+        yield from self.cache.tee(key, text, self.tts.synthesize_stream(text))
@@ -3,19 +3,20 @@ import hashlib
 import base64
 import hmac
 import json
-from urllib.parse import urlencode
-import time
+from urllib.parse import urlencode, urlparse
 import ssl
 from wsgiref.handlers import format_date_time
 from datetime import datetime
 from time import mktime
 import threading
-from collections import deque
+from tts.speech_stream import SynthesisCancelled
+from utils.logger import logger
+from utils.tracing import tracer
 
 class XunfeiTTSStream:
     def __init__(self, app_id, api_key, api_secret, vcn="x4_yezi",
                  aue="raw", auf="audio/L16;rate=16000", sfl=1, speed=50,
-                 volume=50, pitch=50):
+                 volume=50, pitch=50, ws_url="wss://tts-api.xfyun.cn/v2/tts"):
         self.app_id = app_id
         self.api_key = api_key
         self.api_secret = api_secret
@@ -26,14 +27,21 @@ class XunfeiTTSStream:
         self.speed = speed
         self.volume = volume
         self.pitch = pitch
+        self.ws_url = ws_url  # 可指向本地模拟服务（bench/fake_xunfei.py）
+        self.samplerate = int(auf.rsplit("rate=", 1)[-1]) if "rate=" in auf else 16000  # 下发 PCM 的采样率
+        self.warmup = None  # 可选：utils.warmup.Warmup，预先建好的连接从这里取
+        self._active = set()  # 进行中的合成连接，供 cancel() 从其他线程强制关闭
+        self._active_lock = threading.Lock()
+        self._cancelled = set()  # 被 cancel() 断开的连接：其合成报 SynthesisCancelled 而不是失败
 
     def _create_url(self):
-        url = 'wss://tts-api.xfyun.cn/v2/tts'
+        url = self.ws_url
+        parsed = urlparse(url)
         now = datetime.now()
         date = format_date_time(mktime(now.timetuple()))
-        signature_origin = f"host: tts-api.xfyun.cn\n"
+        signature_origin = f"host: {parsed.netloc}\n"
         signature_origin += f"date: {date}\n"
-        signature_origin += "GET /v2/tts HTTP/1.1"
+        signature_origin += f"GET {parsed.path or '/'} HTTP/1.1"
         signature_sha = hmac.new(self.api_secret.encode('utf-8'), signature_origin.encode('utf-8'),
                                  digestmod=hashlib.sha256).digest()
         signature_sha = base64.b64encode(signature_sha).decode('utf-8')
@@ -42,87 +50,90 @@ class XunfeiTTSStream:
         v = {
             "authorization": authorization,
             "date": date,
-            "host": "tts-api.xfyun.cn"
+            "host": parsed.netloc
         }
         url = url + '?' + urlencode(v)
         return url
 
+    def open_connection(self):
+        """建立并鉴权一条 TTS websocket 连接（预热与正常合成共用）。"""
+        return websocket.create_connection(self._create_url(), sslopt={"cert_reqs": ssl.CERT_NONE})
+
+    def _connect(self):
+        ws = self.warmup.take("tts") if self.warmup is not None else None
+        return ws if ws is not None else self.open_connection()
+
+    def cancel(self):
+        """立即关闭所有进行中的合成连接（如用户打断）；阻塞在接收上的生成器随即抛出异常结束。"""
+        with self._active_lock:
+            sockets = list(self._active)
+            self._cancelled.update(sockets)
+        for ws in sockets:
+            try:
+                ws.abort()
+            except Exception:
+                pass
+        if sockets:
+            logger.info(f"已取消 {len(sockets)} 个进行中的TTS合成")
+
+    def _build_request(self, text):
+        return {
+            "common": {"app_id": self.app_id},
+            "business": {
+                "aue": self.aue,
+                "auf": self.auf,
+                "vcn": self.vcn,
+                "tte": "utf8",
+                "sfl": self.sfl,
+                "speed": self.speed,
+                "volume": self.volume,
+                "pitch": self.pitch
+            },
+            "data": {
+                "status": 2,
+                "text": str(base64.b64encode(text.encode('utf-8')), "utf8")
+            }
+        }
+
     def synthesize_stream(self, text):
         """
         生成器：每次 yield 一帧 PCM 音频数据（bytes），最后自动结束
+        外部提前关闭生成器时会立即关闭 websocket，不再继续接收（也不再产生费用）。
         """
-        ws_url = self._create_url()
-        audio_queue = deque()
-        done = threading.Event()
-        error = []
-
-        def on_message(ws, message):
-            try:
+        try:
+            ws = self._connect()
+        except Exception as e:
+            raise RuntimeError(f"讯飞TTS流式合成异常：TTS websocket错误: {e}") from e
+        with self._active_lock:
+            self._active.add(ws)
+        try:
+            ws.send(json.dumps(self._build_request(text)))
+            while True:
+                message = ws.recv()
+                if not message:
+                    raise RuntimeError("讯飞TTS流式合成异常：连接提前关闭")
                 msg = json.loads(message)
-                code = msg["code"]
-                if code != 0:
-                    error.append(msg.get("message", "未知错误"))
-                    done.set()
-                    ws.close()
-                    return
+                if msg["code"] != 0:
+                    raise RuntimeError("讯飞TTS流式合成异常：" + msg.get("message", "未知错误"))
                 audio_data = msg["data"].get("audio")
-                status = msg["data"].get("status", 0)
                 if audio_data:
-                    audio = base64.b64decode(audio_data)
-                    audio_queue.append(audio)
-                if status == 2:
-                    done.set()
-                    ws.close()
-            except Exception as e:
-                error.append(f"解析TTS返回时异常: {e}")
-                done.set()
+                    tracer.mark("tts.first_chunk", backend="xunfei")
+                    yield base64.b64decode(audio_data)
+                if msg["data"].get("status", 0) == 2:
+                    break
+        except Exception as e:
+            with self._active_lock:
+                cancelled = ws in self._cancelled
+            if cancelled:
+                raise SynthesisCancelled("讯飞TTS合成已取消") from e
+            if isinstance(e, websocket.WebSocketException):
+                raise RuntimeError(f"讯飞TTS流式合成异常：TTS websocket错误: {e}") from e
+            raise
+        finally:
+            with self._active_lock:
+                self._active.discard(ws)
+                self._cancelled.discard(ws)
+            try:
                 ws.close()
-
-        def on_error(ws, err):
-            error.append(f"TTS websocket错误: {err}")
-            done.set()
-            ws.close()
-
-        def on_close(ws, *args):
-            done.set()
-
-        def on_open(ws):
-            def run(*_):
-                d = {
-                    "common": {"app_id": self.app_id},
-                    "business": {
-                        "aue": self.aue,
-                        "auf": self.auf,
-                        "vcn": self.vcn,
-                        "tte": "utf8",
-                        "sfl": self.sfl,
-                        "speed": self.speed,
-                        "volume": self.volume,
-                        "pitch": self.pitch
-                    },
-                    "data": {
-                        "status": 2,
-                        "text": str(base64.b64encode(text.encode('utf-8')), "utf8")
-                    }
-                }
-                ws.send(json.dumps(d))
-            threading.Thread(target=run, daemon=True).start()
-
-        ws = websocket.WebSocketApp(
-            ws_url,
-            on_message=on_message,
-            on_error=on_error,
-            on_close=on_close
-        )
-        ws.on_open = on_open
-
-        threading.Thread(target=ws.run_forever, kwargs={"sslopt": {"cert_reqs": ssl.CERT_NONE}}).start()
-
-        # 每收到一帧就yield，done后退出
-        while not done.is_set() or audio_queue:
-            if audio_queue:
-                yield audio_queue.popleft()
-            else:
-                time.sleep(0.01)
-        if error:
-            raise RuntimeError("讯飞TTS流式合成异常：" + "; ".join(error))
+            except Exception:
+                pass
@@ -0,0 +1,74 @@
+"""音频后端：采集、播放与设备查询的唯一入口，可换成虚拟设备在没有声卡的机器上跑。
+
+- 后端对外是 sounddevice 的一个子集：query_devices / check_input_settings / InputStream / OutputStream，
+  外加 terminate / initialize（刷新设备列表）；CaptureHub、输出引擎、流式播放、设备工具都经 get_backend() 调用
+- 默认后端 SoundDeviceBackend 首次使用时才导入 sounddevice，没有 PortAudio 的机器也能导入各模块
+- 虚拟后端见 utils/virtual_audio.py：WAV 文件当麦克风、播放写入 WAV/内存，可模拟拔插与读取停滞
+"""
+
+import threading
+
+from utils.logger import logger
+
+_backend = None
+_lock = threading.Lock()
+
+
+class SoundDeviceBackend:
+    """真实声卡（PortAudio）。"""
+
+    name = "sounddevice"
+
+    def __init__(self):
+        import sounddevice
+        self._sd = sounddevice
+
+    def query_devices(self, device=None, kind=None):
+        return self._sd.query_devices(device=device, kind=kind)
+
+    def check_input_settings(self, device=None, **kwargs):
+        return self._sd.check_input_settings(device=device, **kwargs)
+
+    def InputStream(self, **kwargs):
+        return self._sd.InputStream(**kwargs)
+
+    def OutputStream(self, **kwargs):
+        return self._sd.OutputStream(**kwargs)
+
+    def terminate(self):
+        self._sd._terminate()
+
+    def initialize(self):
+        self._sd._initialize()
+
+    def close(self):
+        pass
+
+
+def get_backend():
+    """当前音频后端；未设置时用真实声卡。"""
+    global _backend
+    with _lock:
+        if _backend is None:
+            _backend = SoundDeviceBackend()
+        return _backend
+
+
+def set_backend(backend):
+    """切换音频后端（须在打开任何音频流之前）；返回之前的后端。"""
+    global _backend
+    with _lock:
+        previous, _backend = _backend, backend
+    return previous
+
+
+def create_backend(cfg, input_name=None):
+    """按配置创建后端：type 为 sounddevice（默认）或 virtual；input_name 为虚拟麦克风冒充的设备名。"""
+    cfg = cfg or {}
+    kind = cfg.get("type", "sounddevice")
+    if kind == "virtual":
+        from utils.virtual_audio import create_virtual_backend
+        backend = create_virtual_backend(cfg, input_name=input_name)
+        logger.info(f"使用虚拟音频设备：输入={backend.input_name} 输出={cfg.get('output') or '内存'}")
+        return backend
+    return SoundDeviceBackend()
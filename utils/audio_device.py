@@ -1,11 +1,15 @@
 """音频设备工具：按名称关键词查找麦克风，支持未接入时自动等待。"""
+import os
+import sys
 import time
 
-import sounddevice as sd
-
+from utils.audio_backend import get_backend
 from utils.logger import logger
 
 DEFAULT_POLL_INTERVAL = 3.0
+RESTART_LIMIT = 3
+
+_stream_owners = []  # 持有常驻音频流的组件（如输出引擎），刷新设备列表/重启前须先让它们关闭流
 
 
 class DeviceUnavailable(Exception):
@@ -19,12 +23,12 @@ def find_input_device(keyword):
         return None
     if isinstance(keyword, int):
         try:
-            sd.check_input_settings(device=keyword)
+            get_backend().check_input_settings(device=keyword)
             return keyword
         except Exception:
             return None
     try:
-        devices = sd.query_devices()
+        devices = get_backend().query_devices()
     except Exception as e:
         logger.error(f"查询音频设备失败: {e}")
         return None
@@ -32,21 +36,49 @@ def find_input_device(keyword):
     for idx, dev in enumerate(devices):
         name = dev.get("name", "")
         if dev.get("max_input_channels", 0) > 0 and lower_keyword in str(name).lower():
-            return idx
+            return dev.get("index", idx)
     return None
 
 
+def register_stream_owner(owner):
+    """注册持有常驻音频流的组件：owner.suspend() 在空闲时关闭自己的流并暂停重开、返回 True，
+    正在播放时返回 False；owner.resume() 恢复。"""
+    _stream_owners.append(owner)
+
+
+def _suspend_streams():
+    """让所有登记的组件关闭音频流；有组件正在使用时恢复已暂停的，返回 None。"""
+    suspended = []
+    for owner in _stream_owners:
+        if not owner.suspend():
+            for done in reversed(suspended):
+                done.resume()
+            return None
+        suspended.append(owner)
+    return suspended
+
+
 def refresh_audio_devices():
     """安全刷新音频设备列表（重新初始化音频引擎），让新插入的设备可见、清除幽灵条目。
-    注意：必须在没有任何活动音频流、没有后台音频线程时调用——本项目的调用点都满足该条件。"""
+    重新初始化要求没有任何活动音频流：先让登记的组件（输出引擎、流式播放）关闭输出流，
+    输入流由调用方（CaptureHub 重连循环）保证已关闭；有组件正在播放时本次跳过，返回 False。"""
+    suspended = _suspend_streams()
+    if suspended is None:
+        logger.debug("正在播放，推迟刷新音频设备列表")
+        return False
     try:
-        sd._terminate()
-    except Exception:
-        pass
-    try:
-        sd._initialize()
-    except Exception:
-        pass
+        try:
+            get_backend().terminate()
+        except Exception:
+            pass
+        try:
+            get_backend().initialize()
+        except Exception:
+            pass
+    finally:
+        for owner in reversed(suspended):
+            owner.resume()
+    return True
 
 
 def wait_for_input_device(keyword, poll_interval=DEFAULT_POLL_INTERVAL, refresh_every=10):
@@ -63,3 +95,30 @@ def wait_for_input_device(keyword, poll_interval=DEFAULT_POLL_INTERVAL, refresh_
         if count % refresh_every == 0:
             refresh_audio_devices()
         time.sleep(poll_interval)
+
+
+def self_restart():
+    """原地重启进程（PID 不变），重新加载音频引擎；带次数上限防循环。"""
+    count = int(os.environ.get("VOICEBOX_RESTART_COUNT", "0")) + 1
+    os.environ["VOICEBOX_RESTART_COUNT"] = str(count)
+    if count > RESTART_LIMIT:
+        logger.warning("已达到自动重启上限，转入安静等待。")
+        return False
+    # 先关闭输出流再 exec，新进程才能干净地重新打开设备；正在播放时不打断，下一轮失败时再试
+    suspended = _suspend_streams()
+    if suspended is None:
+        os.environ["VOICEBOX_RESTART_COUNT"] = str(count - 1)
+        logger.info("正在播放，推迟自动重启。")
+        return False
+    logger.warning(f"连续打开失败，自动重启程序以重新加载音频引擎（第{count}次）...")
+    script = os.path.abspath(sys.argv[0])
+    if not os.path.exists(script):
+        script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+    try:
+        os.execv(sys.executable, [sys.executable, script])
+    except OSError as e:
+        logger.error(f"自动重启失败：{e}")
+        for owner in reversed(suspended):
+            owner.resume()
+        return False
+    return True
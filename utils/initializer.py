@@ -1,10 +1,16 @@
 import os
 from tts.xunfei_adapter import XunfeiTTS
+from tts.sherpa_tts import create_local_tts
+from audio_out.earcons import EARCON_SAMPLERATE
 from utils.logger import logger
 
+
 def ensure_initialized(config):
     """
     初始化欢迎音频和所有错误提示音频（如本地不存在则生成），所有内容从 config 读取。
+    讯飞不可用（断网、鉴权失败）时改用本地 TTS 直接生成同名 .pcm，离线也能开机；
+    .pcm 可能只是 EarconBank 的解码缓存，不能代表源文件存在，因此缺 MP3 时每次启动都先向讯飞重新生成，
+    讯飞仍不可用才沿用已有的 .pcm。
     """
     # 1. 确保输出目录存在
     audio_out_dir = config.get("audio_out_dir", "audio_out")
@@ -23,15 +29,37 @@ def ensure_initialized(config):
         pitch=config["xunfei"].get("pitch", 50),
         tts_out_dir=audio_out_dir
     )
+    local = []  # 本地 TTS 只在讯飞失败时才加载
+
+    def generate(text, prefix, out_path):
+        try:
+            tmp_file = tts.synthesize(text, filename_prefix=prefix)
+            os.replace(tmp_file, out_path)
+            return out_path
+        except Exception as e:
+            logger.warning(f"讯飞TTS生成失败（{prefix}）：{e}，尝试本地TTS")
+        pcm_path = os.path.splitext(out_path)[0] + ".pcm"
+        if os.path.exists(pcm_path):
+            logger.info(f"沿用已有的提示音：{pcm_path}")
+            return pcm_path
+        if not local:
+            local.append(create_local_tts(config.get("tts", {}).get("sherpa")))
+        if local[0] is None:
+            raise RuntimeError("讯飞TTS不可用且未配置本地TTS模型")
+        with open(pcm_path, "wb") as f:
+            f.write(local[0].synthesize_pcm(text, EARCON_SAMPLERATE))
+        return pcm_path
 
     # 3. 检查欢迎音频
     welcome_audio_path = config.get("welcome_audio_path", "audio_out/welcome.mp3")
     if not os.path.exists(welcome_audio_path):
         welcome_text = config.get("welcome_text", "你好，我是智能语音助手。")
         logger.info("未发现本地欢迎语音，将用TTS生成。")
-        welcome_file = tts.synthesize(welcome_text, filename_prefix="welcome")
-        os.replace(welcome_file, welcome_audio_path)
-        logger.info(f"欢迎语音生成并保存到：{welcome_audio_path}")
+        try:
+            saved = generate(welcome_text, "welcome", welcome_audio_path)
+            logger.info(f"欢迎语音生成并保存到：{saved}")
+        except Exception as e:
+            logger.error(f"生成欢迎语音失败：{e}")
     else:
         logger.debug(f"本地欢迎语音已存在：{welcome_audio_path}")
     
@@ -44,9 +72,8 @@ def ensure_initialized(config):
             continue
         try:
             logger.info(f"生成错误提示音：{tag}")
-            tmp_file = tts.synthesize(text, filename_prefix=f"err_{tag}")
-            os.replace(tmp_file, out_path)
-            logger.info(f"错误提示音已生成：{out_path}")
+            saved = generate(text, f"err_{tag}", out_path)
+            logger.info(f"错误提示音已生成：{saved}")
         except Exception as e:
             logger.error(f"生成错误提示音失败（{tag}）：{e}")
 
@@ -0,0 +1,103 @@
+"""流式多相（polyphase）重采样器：播放（16k→44.1k）与录音（48k→16k）共用。
+
+- 有理数比 up/down（如 441/160），加窗 sinc 原型滤波器在构造时一次性算好并拆成多相
+- 跨块保留滤波器历史与相位，块与块之间无相位跳变、无接缝
+- 输入/输出缓冲区预分配复用；同一块长与相位的下标表缓存复用，不再每块重建
+"""
+
+from math import ceil, gcd
+
+import numpy as np
+
+_INDEX_CACHE_LIMIT = 64
+
+
+class PolyphaseResampler:
+    def __init__(self, up, down, zero_crossings=8, beta=8.0, rolloff=0.95, max_block=4096):
+        g = gcd(up, down)
+        self.up = up // g
+        self.down = down // g
+        # 每相抽头数：降采样时按比例加长，保证抗混叠效果
+        self.taps_per_phase = 2 * zero_crossings * max(1, ceil(self.down / self.up))
+        self._taps = self._design(beta, rolloff)
+        self._history = self.taps_per_phase - 1
+        self._pos = 0  # 下一个输出样点在"上采样域"中相对当前块起点的位置
+        self._xbuf = np.zeros(self._history + max_block, dtype=np.float32)
+        self._out = np.empty(self._max_out(max_block), dtype=np.float32)
+        self._out_i16 = np.empty_like(self._out, dtype=np.int16)
+        self._index_cache = {}
+
+    def _design(self, beta, rolloff):
+        """设计原型低通并拆成 (up, taps_per_phase) 的多相矩阵（抽头已反序，便于与窗口直接点乘）。"""
+        n = self.up * self.taps_per_phase
+        cutoff = rolloff * 0.5 / max(self.up, self.down)  # 相对上采样域采样率
+        t = np.arange(n) - (n - 1) / 2.0
+        proto = 2 * cutoff * np.sinc(2 * cutoff * t) * np.kaiser(n, beta)
+        proto *= self.up / proto.sum()  # 每相直流增益为 1
+        phases = proto.reshape(self.taps_per_phase, self.up).T
+        return np.ascontiguousarray(phases[:, ::-1], dtype=np.float32)
+
+    def _max_out(self, length):
+        return (self.up * length) // self.down + 2
+
+    def _ensure_capacity(self, length):
+        if self._xbuf.size < self._history + length:
+            xbuf = np.zeros(self._history + length, dtype=np.float32)
+            xbuf[:self._history] = self._xbuf[:self._history]
+            self._xbuf = xbuf
+            self._out = np.empty(self._max_out(length), dtype=np.float32)
+            self._out_i16 = np.empty_like(self._out, dtype=np.int16)
+
+    def _indices(self, length, pos):
+        key = (length, pos)
+        cached = self._index_cache.get(key)
+        if cached is not None:
+            return cached
+        t = np.arange(pos, self.up * length, self.down)
+        windows = (t // self.up)[:, None] + np.arange(self.taps_per_phase)[None, :]
+        taps = self._taps[t % self.up]
+        next_pos = int(t[-1] + self.down - self.up * length) if t.size else pos - self.up * length
+        if len(self._index_cache) >= _INDEX_CACHE_LIMIT:
+            self._index_cache.clear()
+        cached = (windows, taps, next_pos)
+        self._index_cache[key] = cached
+        return cached
+
+    def process(self, block):
+        """
+        重采样一块单声道音频；int16 输入返回 int16，其他返回 float32。
+        返回值是内部预分配缓冲区的视图，下次调用前有效，需要保留请自行 copy。
+        """
+        block = np.asarray(block)
+        length = block.size
+        is_int16 = block.dtype == np.int16
+        if length == 0:
+            return (self._out_i16 if is_int16 else self._out)[:0]
+        self._ensure_capacity(length)
+        h = self._history
+        xbuf = self._xbuf
+        xbuf[h:h + length] = block
+        windows, taps, self._pos = self._indices(length, self._pos)
+        count = windows.shape[0]
+        out = self._out[:count]
+        np.einsum("nk,nk->n", taps, xbuf[windows], out=out)
+        # 保留最后 history 个样点作为下一块的滤波器历史
+        xbuf[:h] = xbuf[length:length + h]
+        if not is_int16:
+            return out
+        out_i16 = self._out_i16[:count]
+        np.clip(out, -32768, 32767, out=out)
+        np.rint(out, out=out)
+        out_i16[:] = out
+        return out_i16
+
+    def reset(self):
+        self._xbuf[:self._history] = 0
+        self._pos = 0
+
+
+def make_resampler(src_rate, dst_rate, **kwargs):
+    """采样率相同返回 None（调用方直通），否则返回对应比例的流式重采样器。"""
+    if not src_rate or not dst_rate or int(src_rate) == int(dst_rate):
+        return None
+    return PolyphaseResampler(int(dst_rate), int(src_rate), **kwargs)
@@ -0,0 +1,204 @@
+"""轻量级逐轮延迟追踪：回答"这 4 秒花在哪了"。
+
+- 每轮对话一条 trace：begin() 开始（唤醒或多轮中的下一轮），各模块 mark() 打点，end() 写出
+- 打点用单调时钟，记录相对本轮开始的毫秒偏移；同名打点只记第一次（首个分片、首个 token）
+- 写入 logs/traces.jsonl（每行一个 JSON，按大小轮转），与普通日志分开：用 loguru 的 TRACE 级别，
+  控制台（INFO）和普通日志文件（DEBUG）都不会收到
+- 命令行统计各阶段 P50/P90/P99：
+    python -m utils.tracing                      # 最近 24 小时
+    python -m utils.tracing --since 2h --path logs/traces.jsonl
+
+各模块的打点名：
+    wake.detected  chime.start  chime.end  mic.open  speech.onset  speech.endpoint
+    asr.first_partial  asr.final  llm.request  llm.first_token  llm.done
+    tts.first_chunk  audio.first_sample  playback.end
+"""
+
+import argparse
+import glob
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from utils.logger import LOG_DIR, logger
+
+TRACE_PATH = os.path.join(LOG_DIR, "traces.jsonl")
+
+# 统计的阶段：(名称, 起点打点, 终点打点)
+STAGES = [
+    ("wake→mic", "wake.detected", "mic.open"),
+    ("chime", "chime.start", "chime.end"),
+    ("wait_speech", "mic.open", "speech.onset"),
+    ("speaking", "speech.onset", "speech.endpoint"),
+    ("asr_partial", "speech.onset", "asr.first_partial"),
+    ("asr_final", "speech.endpoint", "asr.final"),
+    ("asr→llm", "asr.final", "llm.request"),
+    ("llm_first_token", "llm.request", "llm.first_token"),
+    ("llm_done", "llm.request", "llm.done"),
+    ("tts_first_chunk", "llm.first_token", "tts.first_chunk"),
+    ("first_audio", "tts.first_chunk", "audio.first_sample"),
+    ("response", "speech.endpoint", "audio.first_sample"),
+    ("playback", "audio.first_sample", "playback.end"),
+]
+
+
+class Trace:
+    def __init__(self, trace_id, kind, started):
+        self.id = trace_id
+        self.kind = kind
+        self.started = started  # 单调时钟
+        self.wall = time.time() - (time.monotonic() - started)
+        self.marks = {}  # 名称 -> 相对毫秒
+        self.attrs = {}
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self._current = None
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._sink = None
+
+    def configure(self, cfg=None):
+        """按配置启用；cfg 为 tracing 配置段，enabled 为假时所有打点都是空操作。"""
+        cfg = cfg or {}
+        self.enabled = cfg.get("enabled", True)
+        if not self.enabled or self._sink is not None:
+            return
+        self._sink = logger.add(
+            cfg.get("path", TRACE_PATH),
+            level="TRACE",
+            format="{extra[trace_json]}",
+            filter=lambda record: "trace_json" in record["extra"],
+            rotation=cfg.get("rotation", "10 MB"),
+            retention=cfg.get("retention", 5),
+            encoding="utf-8",
+            enqueue=True,
+        )
+
+    def begin(self, kind, at=None):
+        """开始新一轮；上一轮还没 end() 时先把它写出。at 为单调时钟时间戳，可回填（如唤醒词实际检测时刻）。"""
+        if not self.enabled:
+            return
+        with self._lock:
+            previous = self._current
+            self._current = Trace(next(self._ids), kind, at if at is not None else time.monotonic())
+        if previous is not None:
+            self._emit(previous)
+
+    def mark(self, name, at=None, **attrs):
+        """打点（本轮同名只记第一次）；没有进行中的一轮时忽略。attrs 记入本轮属性（如 backend）。"""
+        trace = self._current
+        if trace is None:
+            return
+        offset = ((at if at is not None else time.monotonic()) - trace.started) * 1000
+        with self._lock:
+            if name not in trace.marks:
+                trace.marks[name] = round(offset, 1)
+                for key, value in attrs.items():
+                    trace.attrs[f"{name.split('.')[0]}.{key}"] = value
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """name.start / name.end 两个打点。"""
+        self.mark(f"{name}.start", **attrs)
+        try:
+            yield
+        finally:
+            self.mark(f"{name}.end")
+
+    def end(self, **attrs):
+        with self._lock:
+            trace, self._current = self._current, None
+        if trace is not None:
+            trace.attrs.update(attrs)
+            self._emit(trace)
+
+    def _emit(self, trace):
+        record = {
+            "id": trace.id,
+            "kind": trace.kind,
+            "ts": round(trace.wall, 3),
+            "marks": dict(sorted(trace.marks.items(), key=lambda kv: kv[1])),
+        }
+        if trace.attrs:
+            record["attrs"] = trace.attrs
+        logger.bind(trace_json=json.dumps(record, ensure_ascii=False)).log("TRACE", "trace")
+        response = stage_ms(record, "speech.endpoint", "audio.first_sample")
+        if response is not None:
+            logger.info(f"本轮响应延迟（说完到出声）{response:.0f}ms")
+
+
+tracer = Tracer()
+
+
+# ---- 统计 ----
+
+def stage_ms(record, start, end):
+    marks = record.get("marks", {})
+    if start in marks and end in marks and marks[end] >= marks[start]:
+        return marks[end] - marks[start]
+    return None
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100.0 * len(values)))]
+
+
+def load_traces(path, since_s=None):
+    """读取 path 及其轮转出的旧文件；since_s 为只看最近多少秒。"""
+    root, ext = os.path.splitext(path)
+    files = sorted(set(glob.glob(path) + glob.glob(f"{root}.*{ext}")))
+    cutoff = time.time() - since_s if since_s else 0
+    records = []
+    for name in files:
+        with open(name, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("ts", 0) >= cutoff:
+                    records.append(record)
+    return records
+
+
+def _parse_duration(text):
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    if text[-1] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text)
+
+
+def report(records):
+    lines = [f"{'阶段':<16}{'次数':>6}{'P50':>9}{'P90':>9}{'P99':>9}  (ms)"]
+    for name, start, end in STAGES:
+        values = [v for v in (stage_ms(r, start, end) for r in records) if v is not None]
+        if not values:
+            continue
+        lines.append(f"{name:<16}{len(values):>6}{percentile(values, 50):>9.0f}"
+                     f"{percentile(values, 90):>9.0f}{percentile(values, 99):>9.0f}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按阶段统计语音交互各轮延迟")
+    parser.add_argument("--path", default=TRACE_PATH)
+    parser.add_argument("--since", default="24h", help="时间窗口，如 30m、2h、7d；0 为全部")
+    parser.add_argument("--kind", help="只看某类轮次：wake / followup")
+    args = parser.parse_args()
+    records = load_traces(args.path, _parse_duration(args.since))
+    if args.kind:
+        records = [r for r in records if r.get("kind") == args.kind]
+    print(f"{len(records)} 轮（{args.path}，最近 {args.since}）")
+    if records:
+        print(report(records))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,530 @@
+"""虚拟音频设备：没有声卡时代替 sounddevice，用于回放测试、CI 与拔插/停滞的浸泡测试。
+
+- 麦克风：排队的 WAV（可多声道，采样率与声道数按打开的输入流自动转换）依次当作输入，放完后输出低底噪，
+  loop 为真时循环；像一盘磁带，只在被读取时前进，设备断开期间的音频不会丢
+- 播放：输出写入 WavSink（WAV 文件）或 MemorySink（内存），回调式输出流由后台线程按块长定时调用回调
+- speed 为时钟倍速：1.0 与真实设备同节奏，2.0 两倍速；0 表示阻塞读写不限速
+  （回调式输出流仍需要时钟，此时按 MAX_CALLBACK_SPEED 倍速）
+- 故障模拟：unplug（设备从列表消失，读写报错）、stall（读取阻塞不返回）、silence（只送全零，
+  模拟 macOS 静默拔线）；可带持续时间，也可用 schedule() 按时间表注入，检验 CaptureHub 与输出引擎的重连逻辑
+"""
+
+import threading
+import time
+import wave
+from collections import deque
+
+import numpy as np
+
+from utils.logger import logger
+from utils.resample import make_resampler
+
+MAX_CALLBACK_SPEED = 50.0
+INPUT, OUTPUT = "input", "output"
+
+
+class VirtualDeviceError(Exception):
+    """虚拟设备不可用（对应 PortAudio 的设备错误）。"""
+
+
+class CallbackFlags:
+    input_overflow = False
+    input_underflow = False
+    output_overflow = False
+    output_underflow = False
+
+    def __bool__(self):
+        return False
+
+
+class _TimeInfo:
+    def __init__(self, now, latency):
+        self.currentTime = now
+        self.inputBufferAdcTime = now - latency
+        self.outputBufferDacTime = now + latency
+
+
+def load_wav(path):
+    """读取 16bit WAV，返回 ((帧数, 声道) int16 数组, 采样率)。"""
+    with wave.open(path, "rb") as wf:
+        if wf.getsampwidth() != 2:
+            raise ValueError(f"{path}: 只支持 16bit PCM WAV")
+        rate = wf.getframerate()
+        channels = wf.getnchannels()
+        pcm = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+    return pcm.reshape(-1, channels), rate
+
+
+def convert(pcm, src_rate, samplerate, channels):
+    """把 (帧数, 声道) int16 音频转换为目标采样率与声道数（多出的声道丢弃，不足的循环复制）。"""
+    pcm = pcm[:, np.arange(channels) % pcm.shape[1]]
+    if make_resampler(src_rate, samplerate) is None:
+        return np.ascontiguousarray(pcm)
+    columns = []
+    for ch in range(channels):
+        resampler = make_resampler(src_rate, samplerate)
+        parts = [resampler.process(pcm[i:i + 4096, ch]).copy() for i in range(0, len(pcm), 4096)]
+        columns.append(np.concatenate(parts) if parts else np.zeros(0, dtype=np.int16))
+    return np.stack(columns, axis=1)
+
+
+class Tape:
+    """虚拟麦克风的音源：排队的音频依次读出，读完后补底噪；loop 为真时循环。"""
+
+    def __init__(self, noise_std=10, loop=False, seed=0):
+        self.noise_std = noise_std
+        self.loop = loop
+        self._items = deque()  # (原始音频, 采样率)
+        self._current = None  # (已转换音频, 读取位置, 原始条目)
+        self._format = None
+        self._lock = threading.Lock()
+        self._rng = np.random.default_rng(seed)
+        self.frames_played = 0  # 读出的录音帧数（不含底噪）
+
+    def feed(self, pcm, samplerate):
+        if pcm.ndim == 1:
+            pcm = pcm[:, None]
+        with self._lock:
+            self._items.append((pcm, samplerate))
+
+    def pending(self):
+        """还没读完的录音条数。"""
+        with self._lock:
+            return len(self._items) + (self._current is not None)
+
+    def read(self, frames, samplerate, channels):
+        out = np.empty((frames, channels), dtype=np.int16)
+        filled = 0
+        with self._lock:
+            if self._format != (samplerate, channels):
+                # 输入流格式变了（重开时换了参数）：当前这条从头按新格式转换
+                self._format = (samplerate, channels)
+                if self._current is not None:
+                    self._items.appendleft(self._current[2])
+                    self._current = None
+            while filled < frames:
+                if self._current is None:
+                    if not self._items:
+                        break
+                    item = self._items.popleft()
+                    self._current = [convert(item[0], item[1], samplerate, channels), 0, item]
+                data, pos, item = self._current
+                n = min(frames - filled, len(data) - pos)
+                out[filled:filled + n] = data[pos:pos + n]
+                filled += n
+                self.frames_played += n
+                self._current[1] += n
+                if self._current[1] >= len(data):
+                    self._current = None
+                    if self.loop:
+                        self._items.append(item)
+        if filled < frames:
+            out[filled:] = self._rng.normal(0, self.noise_std, (frames - filled, channels)) if self.noise_std else 0
+        return out
+
+
+class MemorySink:
+    """把播放输出留在内存里；data() 返回 (帧数, 声道) 数组。"""
+
+    def __init__(self):
+        self.samplerate = None
+        self.channels = None
+        self.frames = 0
+        self.first_write_at = None
+        self._blocks = []
+        self._lock = threading.Lock()
+
+    def open(self, samplerate, channels):
+        if self.samplerate is None:
+            self.samplerate, self.channels = samplerate, channels
+        return (samplerate, channels) == (self.samplerate, self.channels)
+
+    def write(self, frames):
+        with self._lock:
+            if self.first_write_at is None:
+                self.first_write_at = time.monotonic()
+            self._blocks.append(np.array(frames, dtype=np.int16, copy=True))
+            self.frames += len(frames)
+
+    def data(self):
+        with self._lock:
+            if not self._blocks:
+                return np.zeros((0, self.channels or 1), dtype=np.int16)
+            return np.concatenate(self._blocks)
+
+    def close(self):
+        pass
+
+
+class WavSink(MemorySink):
+    """把播放输出写入 WAV 文件（格式以第一次打开的输出流为准）。"""
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._wav = None
+
+    def open(self, samplerate, channels):
+        ok = super().open(samplerate, channels)
+        with self._lock:
+            if self._wav is None:
+                self._wav = wave.open(self.path, "wb")
+                self._wav.setnchannels(channels)
+                self._wav.setsampwidth(2)
+                self._wav.setframerate(samplerate)
+        return ok
+
+    def write(self, frames):
+        with self._lock:
+            if self.first_write_at is None:
+                self.first_write_at = time.monotonic()
+            if self._wav is not None:
+                self._wav.writeframes(np.ascontiguousarray(frames, dtype=np.int16).tobytes())
+            self.frames += len(frames)
+
+    def data(self):
+        raise NotImplementedError("WavSink 的输出在文件里：" + self.path)
+
+    def close(self):
+        with self._lock:
+            if self._wav is not None:
+                self._wav.close()
+                self._wav = None
+
+
+class _VirtualStream:
+    def __init__(self, backend, kind, samplerate, channels, dtype="int16", blocksize=None, device=None):
+        backend.resolve(device, kind)
+        self.backend = backend
+        self.kind = kind
+        self.samplerate = samplerate
+        self.channels = channels
+        self.dtype = dtype
+        self.blocksize = blocksize or int(samplerate * 0.02)
+        self.latency = self.blocksize / float(samplerate)
+        self.active = False
+        self.closed = False
+        self._stopped = threading.Event()
+        self._started_at = None
+        self._frames = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self):
+        if self.closed:
+            raise VirtualDeviceError("流已关闭")
+        self.backend.check(self.kind)
+        self.active = True
+        self._stopped.clear()
+        self._started_at = time.monotonic()
+        self._frames = 0
+        self.backend._opened(self)
+
+    def stop(self):
+        self.active = False
+        self._stopped.set()
+
+    abort = stop
+
+    def close(self):
+        self.stop()
+        if not self.closed:
+            self.closed = True
+            self.backend._closed(self)
+
+    def _pace(self, frames, speed):
+        """按时钟倍速等到这些帧"应该"读完/播完的时刻；流被停止时提前返回 False。"""
+        self._frames += frames
+        if not speed:
+            return not self._stopped.is_set()
+        due = self._started_at + self._frames / float(self.samplerate) / speed
+        delay = due - time.monotonic()
+        if delay > 0:
+            return not self._stopped.wait(delay)
+        return not self._stopped.is_set()
+
+    def _wait_while_stalled(self, speed):
+        if not self.backend.faulted(self.kind, "stall"):
+            return
+        while self.backend.faulted(self.kind, "stall"):
+            if self._stopped.wait(0.02):
+                raise VirtualDeviceError("流已中止")
+        if speed:
+            # 停滞期间时钟没走：从现在起重新计时
+            self._started_at = time.monotonic() - self._frames / float(self.samplerate) / speed
+
+
+class VirtualInputStream(_VirtualStream):
+    def __init__(self, backend, samplerate, channels, dtype="int16", blocksize=None, device=None, **kwargs):
+        super().__init__(backend, INPUT, samplerate, channels, dtype, blocksize, device)
+
+    def read(self, frames):
+        """阻塞读取 frames 帧，返回 ((帧数, 声道) 数组, 是否溢出)。"""
+        if not self.active:
+            raise VirtualDeviceError("输入流未启动")
+        self._wait_while_stalled(self.backend.speed)
+        if not self.backend.present(INPUT):
+            self.active = False
+            raise VirtualDeviceError("输入设备已断开")
+        if not self._pace(frames, self.backend.speed):
+            raise VirtualDeviceError("流已中止")
+        data = self.backend.tape.read(frames, self.samplerate, self.channels)
+        if self.backend.faulted(INPUT, "silence"):
+            data[:] = 0
+        self.backend.frames_read += frames
+        return data.astype(self.dtype, copy=False), False
+
+
+class VirtualOutputStream(_VirtualStream):
+    def __init__(self, backend, samplerate, channels, dtype="int16", blocksize=None, device=None, callback=None,
+                 **kwargs):
+        super().__init__(backend, OUTPUT, samplerate, channels, dtype, blocksize, device)
+        self.callback = callback
+        self._thread = None
+        if not backend.sink.open(samplerate, channels):
+            logger.warning(f"虚拟输出格式 {samplerate}Hz/{channels}声道 与输出文件不一致，本流的输出不记录")
+            self._record = False
+        else:
+            self._record = True
+
+    def start(self):
+        super().start()
+        if self.callback is not None:
+            self._thread = threading.Thread(target=self._run, name="virtual-output", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        super().stop()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=1.0)
+
+    abort = stop
+
+    def _emit(self, frames):
+        if self._record and (self.backend.record_idle or frames.any()):
+            self.backend.sink.write(frames)
+        self.backend.frames_written += len(frames)
+
+    def write(self, frames):
+        """阻塞写入（按时钟倍速节流）。"""
+        if not self.active:
+            raise VirtualDeviceError("输出流未启动")
+        self._wait_while_stalled(self.backend.speed)
+        if not self.backend.present(OUTPUT):
+            self.active = False
+            raise VirtualDeviceError("输出设备已断开")
+        self._emit(np.asarray(frames))
+        self._pace(len(frames), self.backend.speed)
+        return False
+
+    def _run(self):
+        speed = self.backend.speed or MAX_CALLBACK_SPEED
+        outdata = np.zeros((self.blocksize, self.channels), dtype=self.dtype)
+        flags = CallbackFlags()
+        try:
+            while self.active:
+                self._wait_while_stalled(speed)
+                if not self.backend.present(OUTPUT):
+                    logger.debug("虚拟输出设备已断开，回调停止")
+                    break
+                self.callback(outdata, self.blocksize, _TimeInfo(time.monotonic(), self.latency), flags)
+                self._emit(outdata)
+                if not self._pace(self.blocksize, speed):
+                    break
+        except VirtualDeviceError:
+            pass
+        except Exception as e:
+            logger.error(f"虚拟输出回调异常: {e}")
+        finally:
+            self.active = False
+
+
+class VirtualAudioBackend:
+    """与 SoundDeviceBackend 同接口的虚拟设备：一个麦克风、一个扬声器。"""
+
+    name = "virtual"
+
+    def __init__(self, input_name="Virtual Mic", output_name="Virtual Speaker", input_channels=4,
+                 samplerate=16000, speed=1.0, sink=None, loop=False, noise_std=10, record_idle=False):
+        self.input_name = input_name
+        self.output_name = output_name
+        self.input_channels = input_channels
+        self.samplerate = samplerate
+        self.speed = speed
+        self.sink = sink or MemorySink()
+        self.record_idle = record_idle  # 回调输出的全零块是否也写入（长时间浸泡测试时文件会很大）
+        self.tape = Tape(noise_std=noise_std, loop=loop)
+        self._present = {INPUT: True, OUTPUT: True}
+        self._faults = {}  # (设备, 故障) -> 结束时刻（None 为直到手动恢复）
+        self._lock = threading.Lock()
+        self._timers = []
+        self._streams = set()
+        self.opens = {INPUT: 0, OUTPUT: 0}
+        self.refreshes = 0
+        self.frames_read = 0
+        self.frames_written = 0
+        self.fault_log = []  # (时刻, 设备, 故障, 开始/结束)
+
+    # ---- 音源 ----
+
+    def feed(self, source, samplerate=None):
+        """排入一段麦克风输入：WAV 路径，或 (帧数, 声道) / 一维 int16 数组（须给 samplerate）。"""
+        if isinstance(source, str):
+            source, samplerate = load_wav(source)
+        self.tape.feed(np.asarray(source, dtype=np.int16), samplerate or self.samplerate)
+
+    # ---- 设备查询（sounddevice 接口） ----
+
+    def _devices(self):
+        # 输出在前、输入在后：输入拔出时不影响输出设备的编号
+        devices = [{"name": self.output_name, "index": 0, "hostapi": 0, "max_input_channels": 0,
+                    "max_output_channels": 2, "default_samplerate": 44100.0}]
+        devices.append({"name": self.input_name, "index": 1, "hostapi": 0,
+                        "max_input_channels": self.input_channels, "max_output_channels": 0,
+                        "default_samplerate": float(self.samplerate)})
+        return [d for d, kind in zip(devices, (OUTPUT, INPUT)) if self.present(kind)]
+
+    def resolve(self, device, kind):
+        """按编号、名称关键词或默认值找到设备；不存在时抛出 VirtualDeviceError。"""
+        channels_key = "max_input_channels" if kind == INPUT else "max_output_channels"
+        for dev in self._devices():
+            if dev[channels_key] <= 0:
+                continue
+            if device is None or device == dev["index"] or \
+                    (isinstance(device, str) and device.lower() in dev["name"].lower()):
+                return dev
+        raise VirtualDeviceError(f"找不到{'输入' if kind == INPUT else '输出'}设备: {device}")
+
+    def query_devices(self, device=None, kind=None):
+        if device is None and kind is None:
+            return self._devices()
+        return self.resolve(device, kind or OUTPUT)
+
+    def check_input_settings(self, device=None, **kwargs):
+        self.resolve(device, INPUT)
+
+    def InputStream(self, **kwargs):
+        return VirtualInputStream(self, **kwargs)
+
+    def OutputStream(self, **kwargs):
+        return VirtualOutputStream(self, **kwargs)
+
+    def terminate(self):
+        self.refreshes += 1
+
+    def initialize(self):
+        pass
+
+    def check(self, kind):
+        if not self.present(kind):
+            raise VirtualDeviceError(f"{'输入' if kind == INPUT else '输出'}设备不可用")
+
+    def _opened(self, stream):
+        with self._lock:
+            self._streams.add(stream)
+            self.opens[stream.kind] += 1
+
+    def _closed(self, stream):
+        with self._lock:
+            self._streams.discard(stream)
+
+    # ---- 故障模拟 ----
+
+    def present(self, kind):
+        return self._present[kind] and not self.faulted(kind, "unplug")
+
+    def faulted(self, kind, fault):
+        with self._lock:
+            if (kind, fault) not in self._faults:
+                return False
+            until = self._faults[(kind, fault)]
+            if until is not None and time.monotonic() >= until:
+                del self._faults[(kind, fault)]
+                self._log(kind, fault, "end", at=until)
+                return False
+            return True
+
+    def _log(self, kind, fault, phase, at=None):
+        # 带持续时间的故障在到期后第一次查询时才结束，日志记到期时刻
+        self.fault_log.append((at or time.monotonic(), kind, fault, phase))
+        logger.info(f"虚拟音频设备：{kind} {fault} {'开始' if phase == 'start' else '结束'}")
+
+    def inject(self, fault, duration_s=None, kind=INPUT):
+        """注入故障：unplug / stall / silence；duration_s 为 None 时持续到 clear()。"""
+        if fault not in ("unplug", "stall", "silence"):
+            raise ValueError(f"未知故障类型: {fault}")
+        with self._lock:
+            self._faults[(kind, fault)] = time.monotonic() + duration_s if duration_s else None
+            self._log(kind, fault, "start")
+
+    def clear(self, fault=None, kind=INPUT):
+        """结束故障（默认结束该设备的全部故障）。"""
+        with self._lock:
+            for key in [k for k in self._faults if k[0] == kind and (fault is None or k[1] == fault)]:
+                del self._faults[key]
+                self._log(kind, key[1], "end")
+
+    def unplug(self, duration_s=None, kind=INPUT):
+        self.inject("unplug", duration_s, kind)
+
+    def replug(self, kind=INPUT):
+        self.clear("unplug", kind)
+
+    def stall(self, duration_s=None, kind=INPUT):
+        self.inject("stall", duration_s, kind)
+
+    def silence(self, duration_s=None, kind=INPUT):
+        self.inject("silence", duration_s, kind)
+
+    def schedule(self, faults):
+        """按时间表注入故障：[{at: 秒, kind: unplug/stall/silence, duration: 秒, device: input/output}, ...]。"""
+        for item in faults or []:
+            timer = threading.Timer(float(item.get("at", 0)), self.inject,
+                                    args=(item["kind"], item.get("duration"), item.get("device", INPUT)))
+            timer.daemon = True
+            timer.start()
+            self._timers.append(timer)
+
+    def stats(self):
+        return {
+            "opens": dict(self.opens),
+            "refreshes": self.refreshes,
+            "frames_read": self.frames_read,
+            "frames_written": self.frames_written,
+            "pending_inputs": self.tape.pending(),
+            "faults": len([f for f in self.fault_log if f[3] == "start"]),
+        }
+
+    def close(self):
+        for timer in self._timers:
+            timer.cancel()
+        with self._lock:
+            streams = list(self._streams)
+        for stream in streams:
+            stream.close()
+        self.sink.close()
+
+
+def create_virtual_backend(cfg, input_name=None):
+    """按 audio_backend 配置段创建虚拟后端；input_name 为虚拟麦克风冒充的设备名（通常是 audio_in.device）。"""
+    cfg = cfg or {}
+    output = cfg.get("output")
+    backend = VirtualAudioBackend(
+        input_name=cfg.get("input_name") or (input_name if isinstance(input_name, str) else None) or "Virtual Mic",
+        input_channels=cfg.get("channels", 4),
+        speed=cfg.get("speed", 1.0),
+        sink=WavSink(output) if output else MemorySink(),
+        loop=cfg.get("loop", False),
+        noise_std=cfg.get("noise_std", 10),
+        record_idle=cfg.get("record_idle", False),
+    )
+    for path in cfg.get("input") or []:
+        backend.feed(path)
+    backend.schedule(cfg.get("faults"))
+    return backend
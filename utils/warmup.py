@@ -0,0 +1,152 @@
+"""连接预热：唤醒词一触发，就趁提示音播放的空档把后面要用的连接提前建好。
+
+- 预解析各服务域名（DNS）
+- 预先建立并鉴权 ASR websocket，录音开始时直接使用
+- 预备一条 TTS websocket（被取走后自动补一条，供逐句合成的下一句使用）
+- 预热到 DeepSeek 的 HTTP keep-alive 连接
+每条预热连接都有存活期，须短于服务端空闲断开时间，过期的连接直接关闭不用。
+每轮对话结束时打印本轮预热节省的毫秒数：只有取走即用的连接计入节省；
+只是把连接池预热好（如 DeepSeek keep-alive）的槽位单独列为"已预热"，其收益无法按建连耗时计算。
+"""
+
+import socket
+import threading
+import time
+
+from utils.logger import logger
+
+
+class _Slot:
+    def __init__(self, name, factory, ttl_s, refill_on_take=False, close=None, reusable=True):
+        self.name = name
+        self.factory = factory
+        self.ttl_s = ttl_s
+        self.refill_on_take = refill_on_take
+        self.reusable = reusable
+        self.close = close
+        self.conn = None
+        self.created_at = 0.0
+        self.cost_ms = 0.0
+        self.warming = False
+
+
+class Warmup:
+    def __init__(self, hosts=(), enabled=True):
+        self.hosts = list(hosts)
+        self.enabled = enabled
+        self._slots = {}
+        self._lock = threading.Lock()
+        self._active = False
+        self._turn_saved = []  # 本轮 [(名称, 节省毫秒)]
+        self._turn_prepared = []  # 本轮用到的非连接预热 [(名称, 预热毫秒)]
+
+    def register(self, name, factory, ttl_s, refill_on_take=False, close=None, reusable=True):
+        """注册一种可预热的连接：factory() 建立连接，close(conn) 关闭（默认调用 conn.close()）。
+        reusable 为假表示 factory 的返回值不是可取走的连接（只是预热了别处的连接池），不计入节省。"""
+        self._slots[name] = _Slot(name, factory, ttl_s, refill_on_take, close, reusable)
+
+    def begin_session(self):
+        """唤醒时调用：后台预解析域名并预热全部已注册连接。"""
+        if not self.enabled:
+            return
+        self._active = True
+        threading.Thread(target=self._resolve_hosts, daemon=True).start()
+        self.prepare(*self._slots)
+
+    def end_session(self):
+        """对话结束：关闭所有未使用的预热连接，不再补充。"""
+        self._active = False
+        with self._lock:
+            for slot in self._slots.values():
+                self._discard(slot)
+
+    def prepare(self, *names):
+        """后台预热指定连接（已就绪或正在预热的跳过）。"""
+        if not self.enabled:
+            return
+        for name in names:
+            slot = self._slots.get(name)
+            with self._lock:
+                if slot is None or slot.warming or (slot.conn is not None and not self._expired(slot)):
+                    continue
+                self._discard(slot)
+                slot.warming = True
+            threading.Thread(target=self._warm, args=(slot,), daemon=True).start()
+
+    def take(self, name):
+        """取走一条预热好的连接；没有或已过期返回 None，调用方自行新建。"""
+        slot = self._slots.get(name)
+        if slot is None:
+            return None
+        with self._lock:
+            if slot.conn is None:
+                return None
+            if self._expired(slot):
+                logger.debug(f"预热连接[{name}]已过期，丢弃")
+                self._discard(slot)
+                return None
+            conn = slot.conn
+            slot.conn = None
+            (self._turn_saved if slot.reusable else self._turn_prepared).append((name, slot.cost_ms))
+        if slot.refill_on_take and self._active:
+            self.prepare(name)
+        return conn
+
+    def report_turn(self):
+        """打印并清空本轮预热节省的时间；返回节省的总毫秒数（不含只预热连接池的槽位）。"""
+        with self._lock:
+            saved, prepared = self._turn_saved, self._turn_prepared
+            self._turn_saved, self._turn_prepared = [], []
+        total = sum(ms for _, ms in saved)
+        if saved:
+            detail = "，".join(f"{name}={ms:.0f}ms" for name, ms in saved)
+            logger.info(f"本轮连接预热共节省 {total:.0f}ms（{detail}）")
+        if prepared:
+            detail = "，".join(f"{name}={ms:.0f}ms" for name, ms in prepared)
+            logger.info(f"本轮已预热（连接池复用，不计入节省）：{detail}")
+        return total
+
+    def _warm(self, slot):
+        started = time.monotonic()
+        try:
+            conn = slot.factory()
+        except Exception as e:
+            logger.debug(f"预热连接[{slot.name}]失败: {e}")
+            conn = None
+        cost_ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            slot.warming = False
+            if conn is None:
+                return
+            if not self._active:
+                slot.conn = conn
+                self._discard(slot)
+                return
+            slot.conn = conn
+            slot.created_at = time.monotonic()
+            slot.cost_ms = cost_ms
+        logger.debug(f"预热连接[{slot.name}]就绪，耗时{cost_ms:.0f}ms")
+
+    def _expired(self, slot):
+        return time.monotonic() - slot.created_at >= slot.ttl_s
+
+    def _discard(self, slot):
+        conn, slot.conn = slot.conn, None
+        if conn is None:
+            return
+        try:
+            if slot.close is not None:
+                slot.close(conn)
+            elif hasattr(conn, "close"):
+                conn.close()
+        except Exception:
+            pass
+
+    def _resolve_hosts(self):
+        for host in self.hosts:
+            started = time.monotonic()
+            try:
+                socket.getaddrinfo(host, 443, type=socket.SOCK_STREAM)
+                logger.debug(f"预解析域名 {host} 耗时{(time.monotonic() - started) * 1000:.0f}ms")
+            except OSError as e:
+                logger.debug(f"预解析域名 {host} 失败: {e}")
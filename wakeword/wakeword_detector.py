@@ -1,32 +1,15 @@
 import os
-import queue
-import sys
 import time
-import threading
 
 import numpy as np
 import sherpa_onnx
-import sounddevice as sd
 
 from utils.logger import logger
-from utils.audio_device import find_input_device, refresh_audio_devices, wait_for_input_device
+from utils.audio_device import DeviceUnavailable
+from utils.resample import make_resampler
+from utils.tracing import tracer
 
-RESTART_LIMIT = 3
-
-
-def _self_restart():
-    """原地重启进程（PID 不变），重新加载音频引擎；带次数上限防循环。"""
-    count = int(os.environ.get("VOICEBOX_RESTART_COUNT", "0")) + 1
-    os.environ["VOICEBOX_RESTART_COUNT"] = str(count)
-    if count > RESTART_LIMIT:
-        logger.warning("已达到自动重启上限，转入安静等待。")
-        return False
-    logger.warning(f"连续打开失败，自动重启程序以重新加载音频引擎（第{count}次）...")
-    script = os.path.abspath(sys.argv[0])
-    if not os.path.exists(script):
-        script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
-    os.execv(sys.executable, [sys.executable, script])
-    return True
+KEYWORD_TAIL_S = 0.15  # 最后一个 token 的时间戳是其起点，再往后补一点才是唤醒词真正说完
 
 
 class WakewordDetector:
@@ -36,8 +19,8 @@ class WakewordDetector:
         self,
         model_dir,
         keywords_file,
-        audio_device_index=None,
-        channels=4,
+        hub,
+        pipeline_factory=None,
         keywords_score=1.0,
         keywords_threshold=0.25,
         num_threads=2,
@@ -46,9 +29,12 @@ class WakewordDetector:
     ):
         self.model_dir = model_dir
         self.keywords_file = keywords_file
-        self.audio_device_index = audio_device_index
-        self.channels = channels
+        self.hub = hub  # 共享麦克风采集（audio_in.capture.CaptureHub）
+        # 多声道前端处理链工厂（返回 process(块) -> float32 单声道）；不传则只取第 0 路
+        self.pipeline_factory = pipeline_factory
         self.sample_rate = sample_rate
+        self.last_detected_at = None  # 最近一次检测到唤醒词的时刻（time.monotonic），用于统计唤醒响应延迟
+        self.last_keyword_span = None  # 最近一次唤醒词在采集缓冲区中的 (起始游标, 结束游标)
 
         encoder = os.path.join(model_dir, "encoder-epoch-13-avg-2-chunk-16-left-64.onnx")
         decoder = os.path.join(model_dir, "decoder-epoch-13-avg-2-chunk-16-left-64.onnx")
@@ -68,130 +54,84 @@ class WakewordDetector:
         )
 
     def start(self, callback):
-        """持续监听麦克风，检测到唤醒词后释放资源并回调。
-        麦克风未接入、中途断线或静默拔线时自动等待并重连，不再崩溃退出。"""
+        """订阅共享麦克风持续监听，检测到唤醒词后退订并回调。
+        麦克风未接入或中途断线时等采集中心重新接入后继续，不再崩溃退出。"""
         logger.info("唤醒词检测已启动，等待麦克风...")
-        consecutive_failures = 0
+        pipeline = self.pipeline_factory() if self.pipeline_factory else self._channel0_pipeline()
+        keyword = None
+        sub = None
         try:
-            while True:
-                device_id = wait_for_input_device(self.audio_device_index)
-                keyword = None
-                stream = self.kws.create_stream()
-                stop_monitor = threading.Event()
-                dead_event = threading.Event()
-                monitor = None
+            while not keyword:
+                if sub is None:
+                    self.hub.wait_ready()
+                    sub = self.hub.subscribe("kws")
+                    # 每次订阅新建检测流：结果时间戳从 base_cursor 起算，可换算回采集缓冲区位置
+                    stream = self.kws.create_stream()
+                    base_cursor = sub.cursor
+                    logger.info("唤醒词检测已启动，等待唤醒...")
                 try:
-                    audio_queue = queue.Queue(maxsize=100)
-
-                    def audio_callback(indata, frames, time_info, status):
-                        if dead_event.is_set():
-                            raise sd.CallbackAbort
-                        try:
-                            audio_queue.put_nowait(indata.copy())
-                        except queue.Full:
-                            pass
-
-                    with sd.InputStream(
-                        samplerate=self.sample_rate,
-                        channels=self.channels,
-                        dtype="int16",
-                        blocksize=1600,
-                        device=device_id,
-                        callback=audio_callback,
-                    ) as mic:
-                        consecutive_failures = 0
-                        os.environ["VOICEBOX_RESTART_COUNT"] = "0"
-                        logger.info("唤醒词检测已启动，等待唤醒...")
-                        monitor = threading.Thread(
-                            target=self._monitor_device,
-                            args=(mic, stop_monitor, dead_event),
-                            daemon=True,
-                        )
-                        monitor.start()
-                        while True:
-                            try:
-                                pcm = audio_queue.get(timeout=0.5)
-                            except queue.Empty:
-                                if dead_event.is_set():
-                                    logger.warning("检测到麦克风设备异常，退出当前监听流，等待重新接入...")
-                                    break
-                                continue
-                            mono = np.ascontiguousarray(pcm[:, 0])
-                            samples = mono.astype(np.float32) / 32768.0
-                            stream.accept_waveform(self.sample_rate, samples)
-                            if self.kws.is_ready(stream):
-                                self.kws.decode_stream(stream)
-                                keyword = self.kws.get_result(stream)
-                                if keyword:
-                                    logger.info(f"检测到唤醒词: {keyword}")
-                                    self.kws.reset_stream(stream)
-                                    break
-                except Exception as e:
-                    consecutive_failures += 1
-                    if consecutive_failures == 1 or consecutive_failures % 12 == 0:
-                        logger.warning(f"麦克风打开失败：{e}，等待重新接入...")
-                finally:
-                    stop_monitor.set()
-                    dead_event.set()
-                    if monitor is not None:
-                        monitor.join(timeout=1.0)
-                if keyword:
-                    break
-                # 连续失败：每约12秒刷新一次设备列表（清除幽灵条目）；约1分钟后仍不行则自动重启兜底
-                if consecutive_failures and consecutive_failures % 4 == 0:
-                    refresh_audio_devices()
-                if consecutive_failures and consecutive_failures % 20 == 0:
-                    if _self_restart():
-                        return
-                time.sleep(3)
+                    item = sub.read(timeout=0.5)
+                except DeviceUnavailable:
+                    logger.warning("检测到麦克风设备异常，等待重新接入...")
+                    sub.close()
+                    sub = None
+                    continue
+                if item is None:
+                    continue
+                stream.accept_waveform(self.sample_rate, pipeline(item[0]))
+                while self.kws.is_ready(stream):
+                    self.kws.decode_stream(stream)
+                    keyword = self.kws.get_result(stream)
+                    if keyword:
+                        self.last_detected_at = time.monotonic()
+                        tracer.begin("wake", at=self.last_detected_at)
+                        tracer.mark("wake.detected", at=self.last_detected_at, keyword=keyword)
+                        self.last_keyword_span = self._keyword_span(stream, base_cursor, sub.cursor)
+                        logger.info(f"检测到唤醒词: {keyword}")
+                        self.kws.reset_stream(stream)
+                        break
         except KeyboardInterrupt:
             logger.info("唤醒词检测终止。")
-        # 资源释放后再回调
+        finally:
+            if sub is not None:
+                sub.close()
+        # 退订后再回调
         callback()
 
-    def _monitor_device(self, mic, stop_event, dead_event, interval=3.0, probe_interval=30.0):
-        """后台监视麦克风是否仍在线；发现异常则设置 dead_event，让读取循环干净退出。"""
-        probe_fail_count = 0
-        last_probe = time.monotonic()
-        while not stop_event.is_set():
-            if find_input_device(self.audio_device_index) is None:
-                logger.warning("检测到麦克风断开，准备重新接入...")
-                dead_event.set()
-                return
-            try:
-                if not mic.active:
-                    logger.warning("检测到麦克风流已停止，准备重新接入...")
-                    dead_event.set()
-                    return
-            except Exception:
-                pass
-            # 定期主动探测设备健康（应对 macOS 静默拔线：不报错、列表不更新、流不停止）
-            if time.monotonic() - last_probe >= probe_interval:
-                last_probe = time.monotonic()
-                if self._probe_input_device():
-                    probe_fail_count = 0
-                else:
-                    probe_fail_count += 1
-                    if probe_fail_count >= 2:
-                        logger.warning("检测到麦克风设备异常（连续探测失败），准备重新接入...")
-                        dead_event.set()
-                        return
-            stop_event.wait(timeout=interval)
-
-    def _probe_input_device(self):
-        """尝试在目标麦克风上打开并读取一小段音频，验证设备当前是否可用。"""
+    def _channel0_pipeline(self):
+        resampler = make_resampler(self.hub.samplerate, self.sample_rate)
+
+        def process(block):
+            mono = block[:, 0].astype(np.float32) / 32768.0
+            return resampler.process(mono) if resampler is not None else mono
+
+        return process
+
+    def _keyword_span(self, stream, base_cursor, detect_cursor):
+        """按 token 时间戳把唤醒词换算成采集缓冲区中的 (起始游标, 结束游标)；取不到时间戳时按检测时刻往前估。"""
+        blocks_per_s = self.hub.samplerate / self.hub.block_size
         try:
-            device_id = find_input_device(self.audio_device_index)
-            if device_id is None:
-                return False
-            with sd.InputStream(
-                samplerate=self.sample_rate,
-                channels=1,
-                dtype="int16",
-                blocksize=320,
-                device=device_id,
-            ) as probe:
-                probe.read(320)
-            return True
+            stamps = self.kws.timestamps(stream)
         except Exception:
-            return False
+            stamps = []
+        if not stamps:
+            return max(base_cursor, detect_cursor - int(1.5 * blocks_per_s)), detect_cursor
+        start = base_cursor + int(stamps[0] * blocks_per_s)
+        end = base_cursor + int((stamps[-1] + KEYWORD_TAIL_S) * blocks_per_s) + 1
+        return start, min(max(end, start + 1), detect_cursor)
+
+    def create_spotter(self):
+        """创建独立的检测流（供播放期间的打断监听使用），返回 feed(int16 单声道) -> 关键词或 None。"""
+        stream = self.kws.create_stream()
+
+        def feed(mono):
+            stream.accept_waveform(self.sample_rate, mono.astype(np.float32) / 32768.0)
+            while self.kws.is_ready(stream):
+                self.kws.decode_stream(stream)
+                keyword = self.kws.get_result(stream)
+                if keyword:
+                    self.kws.reset_stream(stream)
+                    return keyword
+            return None
+
+        return feed